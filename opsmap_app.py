@@ -1,8 +1,29 @@
 import streamlit as st
 import json
 import pandas as pd
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta
+from collections import OrderedDict
+import bisect
+import csv
+import hashlib
+import html
+import io
+import logging
+import mmap
 import os
+import re
+import shutil
+import struct
+import threading
+import time
+import unicodedata
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger("opsmap")
 
 # ページ設定
 st.set_page_config(
@@ -12,23 +33,3172 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# データファイルのパス
-TASKS_FILE = "tasks_data.json"
-FLOWS_FILE = "flows_data.json"
-SKILLS_FILE = "skills_data.json"
-ORG_FILE = "org_data.json"
+# データ保存先（ワークスペースごとに DATA_ROOT/<workspace>/ 以下へ分割）
+DATA_ROOT = os.environ.get("OPSMAP_DATA_ROOT", "data")
+DEFAULT_TENANT = "default"
+MAX_ACTIVE_TENANTS = int(os.environ.get("OPSMAP_MAX_ACTIVE_TENANTS", "8"))
+TENANT_IDLE_SECONDS = int(os.environ.get("OPSMAP_TENANT_IDLE_SECONDS", "1800"))
+TENANT_NAME_PATTERN = re.compile(r"^[\w\-]{1,64}$")
+
+# データファイル名（ワークスペースのディレクトリからの相対名）
+TASKS_FILE = "tasks_data.json"
+FLOWS_FILE = "flows_data.json"
+SKILLS_FILE = "skills_data.json"
+ORG_FILE = "org_data.json"
+LINKS_FILE = "links_data.json"
+
+# フローは1フロー1ファイルで保存し、一覧用のヘッダーだけを索引ファイルに持つ
+# （FLOWS_FILE はフローのデータセット名として通知・リンクなどで引き続き使う）
+FLOWS_DIR = "flows"
+FLOW_INDEX_FILE = os.path.join(FLOWS_DIR, "_index.json")
+FLOW_HEADER_FIELDS = ["flow_id", "flow_name", "description"]
+DATA_FILES = [TASKS_FILE, FLOWS_FILE, SKILLS_FILE, ORG_FILE, LINKS_FILE]
+
+# 読み取り専用スナップショット（保存時に生成し、表示側はメモリマップして必要な行・列だけを復号する）
+SNAPSHOT_FILES = [TASKS_FILE, SKILLS_FILE, ORG_FILE]
+SNAPSHOT_MAGIC = b"OPSNAP1\n"
+LIST_PAGE_SIZE = 50
+
+# ワークスペース（テナント）管理
+def normalize_tenant(name):
+    """ワークスペース名を検証して正規化する"""
+    name = (name or "").strip()
+    if not TENANT_NAME_PATTERN.match(name):
+        raise ValueError(f"ワークスペース名が不正です: {name!r}")
+    return name
+
+def current_tenant():
+    """現在のセッションで選択されているワークスペース"""
+    return st.session_state.get("tenant", DEFAULT_TENANT)
+
+def tenant_dir(tenant=None):
+    path = os.path.join(DATA_ROOT, normalize_tenant(tenant or current_tenant()))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def data_path(filename, tenant=None):
+    return os.path.join(tenant_dir(tenant), filename)
+
+def list_tenants():
+    if not os.path.isdir(DATA_ROOT):
+        return []
+    return sorted(
+        name for name in os.listdir(DATA_ROOT)
+        if os.path.isdir(os.path.join(DATA_ROOT, name)) and TENANT_NAME_PATTERN.match(name)
+    )
+
+class TenantRegistry:
+    """ワークスペースごとのデータキャッシュとロックを保持し、アイドルなものをLRUで破棄する"""
+
+    def __init__(self, max_tenants=MAX_ACTIVE_TENANTS, idle_seconds=TENANT_IDLE_SECONDS):
+        self.max_tenants = max_tenants
+        self.idle_seconds = idle_seconds
+        self._caches = OrderedDict()  # tenant -> {"last_access": float, "datasets": {filename: (mtime_ns, data)}}
+        self._locks = {}  # ロックは小さいので破棄しない（破棄中の書き込みと競合させないため）
+        self._guard = threading.Lock()
+
+    def lock(self, tenant):
+        with self._guard:
+            if tenant not in self._locks:
+                self._locks[tenant] = threading.RLock()
+            return self._locks[tenant]
+
+    def datasets(self, tenant):
+        now = time.time()
+        with self._guard:
+            entry = self._caches.pop(tenant, None) or {"datasets": {}}
+            entry["last_access"] = now
+            self._caches[tenant] = entry
+            self._evict(now)
+            return entry["datasets"]
+
+    def drop(self, tenant):
+        with self._guard:
+            self._caches.pop(tenant, None)
+
+    def _evict(self, now):
+        while len(self._caches) > self.max_tenants:
+            self._caches.popitem(last=False)
+        for tenant in list(self._caches.keys()):
+            if now - self._caches[tenant]["last_access"] <= self.idle_seconds:
+                break
+            del self._caches[tenant]
+
+@st.cache_resource
+def get_tenant_registry():
+    return TenantRegistry()
+
+# データセット変更通知（プロセス内Pub/Sub）
+DATASET_LABELS = {
+    TASKS_FILE: "業務辞書",
+    FLOWS_FILE: "フロー",
+    SKILLS_FILE: "スキル",
+    ORG_FILE: "組織データ",
+    LINKS_FILE: "業務リンク",
+}
+CHANGE_HISTORY_SIZE = 200
+AUTO_REFRESH_SECONDS = 5
+
+class DatasetBus:
+    """ストレージ層が発行するデータセットのバージョン変更を購読者・各セッションへ配信する"""
+
+    def __init__(self, history_size=CHANGE_HISTORY_SIZE):
+        self.history_size = history_size
+        self._versions = {}  # (tenant, filename) -> version
+        self._history = {}  # (tenant, filename) -> [{"version", "origin", "record_ids", "changes"}, ...]
+        self._subscribers = []  # [(callback, 失敗時に破棄する派生インデックスのキー)]
+        self._guard = threading.Lock()
+
+    def subscribe(self, callback, index_keys=()):
+        """callback(tenant, filename, event) を登録する（書き込みと同じスレッドで同期的に呼ばれる）
+
+        購読者が例外を送出しても他の購読者には配信を続け、index_keys の派生インデックスを
+        破棄して次に参照されたときに作り直させる。
+        """
+        with self._guard:
+            if all(registered != callback for registered, _ in self._subscribers):
+                self._subscribers.append((callback, tuple(index_keys)))
+
+    def publish(self, tenant, filename, record_ids=None, changes=None, origin=None):
+        key = (tenant, filename)
+        with self._guard:
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            event = {
+                "version": version,
+                "origin": origin,
+                "record_ids": None if record_ids is None else list(record_ids),
+                "changes": changes,
+            }
+            history = self._history.setdefault(key, [])
+            history.append({k: v for k, v in event.items() if k != "changes"})
+            del history[:-self.history_size]
+            subscribers = list(self._subscribers)
+        for callback, index_keys in subscribers:
+            try:
+                callback(tenant, filename, event)
+            except Exception:
+                logger.exception("購読者 %s が %s/%s の変更の処理に失敗しました", callback.__name__, tenant, filename)
+                datasets = get_tenant_registry().datasets(tenant)
+                for key in index_keys:
+                    datasets.pop(key, None)
+        return version
+
+    def version(self, tenant, filename):
+        return self._versions.get((tenant, filename), 0)
+
+    def changes_since(self, tenant, filename, since_version):
+        """since_version より後の変更履歴。履歴が切り詰められていれば None（全体を再読込）"""
+        with self._guard:
+            history = list(self._history.get((tenant, filename), []))
+        newer = [entry for entry in history if entry["version"] > since_version]
+        if newer and newer[0]["version"] != since_version + 1:
+            return None
+        return newer
+
+@st.cache_resource
+def get_dataset_bus():
+    bus = DatasetBus()
+    bus.subscribe(on_flows_written)
+    bus.subscribe(on_links_affected, ["index:links"])
+    bus.subscribe(on_impact_affected, ["index:impact"])
+    bus.subscribe(on_home_stats_affected, ["index:home"])
+    bus.subscribe(on_schedule_affected, ["index:schedule"])
+    bus.subscribe(on_audit_event, ["index:audit"])
+    bus.subscribe(on_integrity_affected, ["index:integrity"])
+    return bus
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def current_user():
+    """変更者の表示名（ログイン済みならメールアドレス、なければサイドバーで入力した名前）"""
+    if get_script_run_ctx() is None:
+        return "system"
+    if st.user.get("is_logged_in"):
+        return st.user.get("email") or st.user.get("name") or "ログインユーザー"
+    return st.session_state.get("user_name") or "匿名"
+
+# データ保存・読み込み関数
+def save_data(filename, data, tenant=None, record_ids=None, changes=None, publish=True):
+    """ワークスペース単位でロックし、一時ファイル経由でアトミックに書き込んで変更を通知する
+
+    record_ids が None の場合はデータセット全体が置き換わったものとして通知する。
+    publish=False は複数ファイルをまとめて1つの変更として通知する呼び出し元向け。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    registry = get_tenant_registry()
+    path = data_path(filename, tenant)
+    with registry.lock(tenant):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        registry.datasets(tenant)[filename] = (mtime_ns, data)
+        if filename in SNAPSHOT_FILES:
+            write_snapshot(snapshot_path(path), data, mtime_ns)
+        if not publish:
+            return None
+        return get_dataset_bus().publish(
+            tenant, filename, record_ids=record_ids, changes=changes, origin=current_session_id()
+        )
+
+def load_data(filename, tenant=None):
+    """ファイルの更新時刻が変わっていなければキャッシュ済みのデータを返す"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    registry = get_tenant_registry()
+    path = data_path(filename, tenant)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    datasets = registry.datasets(tenant)
+    cached = datasets.get(filename)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with registry.lock(tenant):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        datasets[filename] = (mtime_ns, data)
+    return data
+
+def snapshot_path(path):
+    return os.path.splitext(path)[0] + ".snap"
+
+def write_snapshot(path, records, source_mtime_ns):
+    """レコードのリストを列ごとのオフセット索引付きバイナリに書き出す
+
+    レイアウト: MAGIC | ヘッダー長(uint64) | ヘッダーJSON | 8バイト境界までのパディング | 列データ...
+    各列は「行数 + 1 個の uint64 オフセット」と、セルをJSONで表現して ',' で連結した本体からなる。
+    本体を '[' と ']' で囲めば列全体を1回の json.loads で復号できる。
+    """
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    body = io.BytesIO()
+    column_meta = []
+    for column in columns:
+        cells = []
+        missing = []
+        for row, record in enumerate(records):
+            if column in record:
+                cells.append(json.dumps(record[column], ensure_ascii=False).encode("utf-8"))
+            else:
+                cells.append(b"null")
+                missing.append(row)
+        offsets = [0]
+        for cell in cells:
+            offsets.append(offsets[-1] + len(cell) + 1)
+        meta = {"name": column, "offsets_at": body.tell(), "missing": missing}
+        body.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        meta["data_at"] = body.tell()
+        body.write(b",".join(cells) + b",")
+        meta["data_len"] = body.tell() - meta["data_at"]
+        body.write(b"\0" * (-body.tell() % 8))
+        column_meta.append(meta)
+    header = json.dumps(
+        {"rows": len(records), "columns": column_meta, "source_mtime_ns": source_mtime_ns}, ensure_ascii=False
+    ).encode("utf-8")
+    header += b" " * (-(len(SNAPSHOT_MAGIC) + 8 + len(header)) % 8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(body.getvalue())
+    os.replace(tmp_path, path)
+
+class SnapshotReader:
+    """write_snapshot の出力をメモリマップし、要求された行・列だけを復号する"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"スナップショットの形式が不正です: {path}")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(SNAPSHOT_MAGIC))
+        body_at = len(SNAPSHOT_MAGIC) + 8 + header_len
+        header = json.loads(self._mm[len(SNAPSHOT_MAGIC) + 8:body_at])
+        self.source_mtime_ns = header["source_mtime_ns"]
+        self.row_count = header["rows"]
+        self._columns = {}
+        for meta in header["columns"]:
+            meta = dict(meta, offsets_at=meta["offsets_at"] + body_at, data_at=meta["data_at"] + body_at, missing=set(meta["missing"]))
+            self._columns[meta["name"]] = meta
+        self.column_names = list(self._columns)
+
+    def __len__(self):
+        return self.row_count
+
+    def cell(self, row, column, default=None):
+        meta = self._columns.get(column)
+        if meta is None or row in meta["missing"]:
+            return default
+        start, end = struct.unpack_from("<2Q", self._mm, meta["offsets_at"] + 8 * row)
+        return json.loads(self._mm[meta["data_at"] + start:meta["data_at"] + end - 1])
+
+    def column(self, column):
+        """1列分を一度に復号する（欠損セルは None）"""
+        meta = self._columns.get(column)
+        if meta is None:
+            return [None] * self.row_count
+        data = self._mm[meta["data_at"]:meta["data_at"] + meta["data_len"] - 1]
+        return json.loads(b"[" + data + b"]") if self.row_count else []
+
+    def row(self, row, columns=None):
+        return {
+            column: self.cell(row, column)
+            for column in (columns or self.column_names)
+            if column in self._columns and row not in self._columns[column]["missing"]
+        }
+
+    def cells(self, positions, column):
+        """指定した行のセルを、バイト列を連結して1回の json.loads で復号する（欠損セルは None）"""
+        meta = self._columns[column]
+        offsets = np.frombuffer(self._mm, dtype="<u8", count=self.row_count + 1, offset=meta["offsets_at"])
+        rows = np.asarray(positions, dtype=np.int64)
+        data_at = meta["data_at"]
+        return json.loads(b"[" + b",".join(
+            self._mm[data_at + start:data_at + end - 1] for start, end in zip(offsets[rows].tolist(), offsets[rows + 1].tolist())
+        ) + b"]")
+
+    def rows(self, positions=None, columns=None):
+        positions = range(self.row_count) if positions is None else positions
+        columns = [c for c in (columns or self.column_names) if c in self._columns]
+        if positions == range(self.row_count) and not any(self._columns[c]["missing"] for c in columns):
+            values = [self.column(column) for column in columns]
+            return [dict(zip(columns, row_values)) for row_values in zip(*values)]
+        if len(positions) == 0:
+            return []
+        values = [self.cells(positions, column) for column in columns]
+        missing = [self._columns[column]["missing"] for column in columns]
+        return [
+            {column: value for column, value, column_missing in zip(columns, row_values, missing) if row not in column_missing}
+            for row, row_values in zip(positions, zip(*values))
+        ]
+
+    def close(self):
+        self._mm.close()
+
+def get_snapshot(filename, tenant=None):
+    """データセットの読み取り専用スナップショット（元のJSONより古ければ作り直す）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    path = data_path(filename, tenant)
+    try:
+        source_mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        source_mtime_ns = 0
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get(f"snapshot:{filename}")
+    if cached and cached[0] == source_mtime_ns:
+        return cached[1]
+    with get_tenant_registry().lock(tenant):
+        snap_path = snapshot_path(path)
+        reader = None
+        if os.path.exists(snap_path):
+            reader = SnapshotReader(snap_path)
+            if reader.source_mtime_ns != source_mtime_ns:
+                reader.close()
+                reader = None
+        if reader is None:
+            write_snapshot(snap_path, load_data(filename, tenant), source_mtime_ns)
+            reader = SnapshotReader(snap_path)
+        datasets[f"snapshot:{filename}"] = (source_mtime_ns, reader)
+    return reader
+
+def dataset_version(tenant, filename):
+    """バス上のバージョンとファイル更新時刻の組（外部からの書き換えも検知する）"""
+    try:
+        mtime_ns = os.stat(data_path(FLOW_INDEX_FILE if filename == FLOWS_FILE else filename, tenant)).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = 0
+    return (get_dataset_bus().version(tenant, filename), mtime_ns)
+
+def cached_index(tenant, name, version, builder):
+    """派生インデックスをワークスペースのキャッシュに保持する（ワークスペースと一緒にLRUで破棄される）"""
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get(f"index:{name}")
+    if cached and cached[0] == version:
+        return cached[1]
+    value = builder()
+    datasets[f"index:{name}"] = (version, value)
+    return value
+
+def record_map(filename, tenant=None, id_field="id"):
+    """ID → レコードの辞書（データセットが更新されるまでキャッシュ）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    return cached_index(
+        tenant, f"records:{filename}", dataset_version(tenant, filename),
+        lambda: {record[id_field]: record for record in load_data(filename, tenant)}
+    )
+
+def next_record_id(records, prefix, id_field="id"):
+    """削除後も重複しないよう、既存IDの最大連番 + 1 で新しいIDを採番する"""
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)$")
+    numbers = [int(m.group(1)) for r in records if (m := pattern.match(str(r.get(id_field, ""))))]
+    return f"{prefix}_{max(numbers, default=0) + 1:03d}"
+
+def write_records(filename, changes, tenant=None, id_field="id"):
+    """IDを指定したレコード単位の変更をまとめて1回の書き込みで反映する
+
+    changes は (record_id, record) のリストで、record が None なら削除、
+    既存IDなら置き換え、未知のIDなら末尾に追加する。
+    キャッシュ済みのリストやレコードは書き換えず、新しいリストを保存する。
+    戻り値は実際に反映された (record_id, 変更前, 変更後) のリスト。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        updated = list(load_data(filename, tenant))
+        positions = {record[id_field]: i for i, record in enumerate(updated)}
+        applied = []
+        for record_id, record in changes:
+            old = updated[positions[record_id]] if record_id in positions else None
+            if old is None and record is None:
+                continue
+            if record is None:
+                updated[positions.pop(record_id)] = None
+            elif old is None:
+                positions[record_id] = len(updated)
+                updated.append(record)
+            else:
+                updated[positions[record_id]] = record
+            applied.append((record_id, old, record))
+        if applied:
+            updated = [record for record in updated if record is not None]
+            save_data(
+                filename, updated, tenant,
+                record_ids=[record_id for record_id, _, _ in applied], changes=applied
+            )
+        return applied
+
+def diff_records(old_records, new_records, id_field="id"):
+    """2つのレコードリストの差分を (record_id, 変更前, 変更後) のリストで返す"""
+    old_by_id = {record[id_field]: record for record in old_records}
+    new_ids = set()
+    changes = []
+    for record in new_records:
+        new_ids.add(record[id_field])
+        old = old_by_id.get(record[id_field])
+        if old != record:
+            changes.append((record[id_field], old, record))
+    changes += [(record_id, old, None) for record_id, old in old_by_id.items() if record_id not in new_ids]
+    return changes
+
+def replace_records(filename, records, tenant=None, id_field="id"):
+    """データセット全体を置き換える。購読者にはレコード単位の差分として通知する（インポート・リセット用）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        changes = diff_records(load_data(filename, tenant), records, id_field)
+        if changes:
+            save_data(
+                filename, list(records), tenant,
+                record_ids=[record_id for record_id, _, _ in changes], changes=changes
+            )
+        return changes
+
+def safe_file_stem(record_id):
+    return re.sub(r"[^\w\-]", "_", str(record_id))
+
+def flow_file(flow_id):
+    return os.path.join(FLOWS_DIR, safe_file_stem(flow_id) + ".json")
+
+def flow_header(flow):
+    header = {field: flow.get(field, "") for field in FLOW_HEADER_FIELDS}
+    header["updated_at"] = flow.get("metadata", {}).get("updated_at", "")
+    return header
+
+def load_flow_headers(tenant=None):
+    """フロー一覧（ID・名前・説明・更新日時）だけを読み込む"""
+    return load_data(FLOW_INDEX_FILE, tenant)
+
+def flow_header_map(tenant=None):
+    tenant = normalize_tenant(tenant or current_tenant())
+    return cached_index(
+        tenant, "flow_headers", dataset_version(tenant, FLOWS_FILE),
+        lambda: {header["flow_id"]: header for header in load_flow_headers(tenant)}
+    )
+
+def load_flow(flow_id, tenant=None):
+    """1つのフローを読み込む（存在しなければ None）"""
+    return load_data(flow_file(flow_id), tenant) or None
+
+def load_all_flows(tenant=None):
+    """全フローを読み込む（エクスポート・横断的な分析用）"""
+    return [flow for header in load_flow_headers(tenant) if (flow := load_flow(header["flow_id"], tenant))]
+
+def write_flows(changes, tenant=None):
+    """フロー単位の変更を、変更されたフローのファイルと索引ファイルだけに書き込む
+
+    changes は (flow_id, flow) のリストで、flow が None なら削除。
+    書き込み後にフローのデータセット (FLOWS_FILE) の変更として1回だけ通知する。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    registry = get_tenant_registry()
+    with registry.lock(tenant):
+        headers = list(load_flow_headers(tenant))
+        positions = {header["flow_id"]: i for i, header in enumerate(headers)}
+        applied = []
+        for flow_id, flow in changes:
+            old = load_flow(flow_id, tenant)
+            if old is None and flow is None:
+                continue
+            if flow is None:
+                os.remove(data_path(flow_file(flow_id), tenant))
+                registry.datasets(tenant).pop(flow_file(flow_id), None)
+                headers[positions.pop(flow_id)] = None
+            else:
+                save_data(flow_file(flow_id), flow, tenant, publish=False)
+                if flow_id in positions:
+                    headers[positions[flow_id]] = flow_header(flow)
+                else:
+                    positions[flow_id] = len(headers)
+                    headers.append(flow_header(flow))
+            applied.append((flow_id, old, flow))
+        if applied:
+            save_data(FLOW_INDEX_FILE, [header for header in headers if header], tenant, publish=False)
+            get_dataset_bus().publish(
+                tenant, FLOWS_FILE, record_ids=[flow_id for flow_id, _, _ in applied],
+                changes=applied, origin=current_session_id()
+            )
+        return applied
+
+def migrate_flows_file(tenant):
+    """旧形式の flows_data.json（全フローを1ファイルに保存）を1フロー1ファイルに分割する"""
+    legacy_path = data_path(FLOWS_FILE, tenant)
+    if not os.path.exists(legacy_path) or os.path.exists(data_path(FLOW_INDEX_FILE, tenant)):
+        return
+    with open(legacy_path, 'r', encoding='utf-8') as f:
+        flows = json.load(f)
+    for flow in flows:
+        save_data(flow_file(flow["flow_id"]), flow, tenant, publish=False)
+    save_data(FLOW_INDEX_FILE, [flow_header(flow) for flow in flows], tenant, publish=False)
+    os.replace(legacy_path, legacy_path + ".migrated")
+
+def updated_flow(flow, **fields):
+    """フローを直接書き換えず、変更したフィールドと更新日時を反映した新しいフローを返す"""
+    metadata = dict(flow.get("metadata", {}))
+    metadata["updated_at"] = datetime.now().isoformat()
+    return {**flow, **fields, "metadata": metadata}
+
+def sync_dataset_versions(tenant):
+    """前回の実行以降に他のセッションで更新されたデータセットと変更レコードを検出する"""
+    bus = get_dataset_bus()
+    seen = st.session_state.setdefault("dataset_versions", {})
+    session_id = current_session_id()
+    updates = {}
+    for filename in DATA_FILES:
+        key = f"{tenant}/{filename}"
+        version = bus.version(tenant, filename)
+        last_seen = seen.get(key)
+        seen[key] = version
+        if last_seen is None or last_seen == version:
+            continue
+        history = bus.changes_since(tenant, filename, last_seen)
+        if history is None:
+            updates[filename] = None
+            continue
+        others = [entry for entry in history if entry["origin"] != session_id]
+        if not others:
+            continue
+        if any(entry["record_ids"] is None for entry in others):
+            updates[filename] = None
+        else:
+            updates[filename] = {rid for entry in others for rid in entry["record_ids"]}
+    return updates
+
+@st.fragment(run_every=AUTO_REFRESH_SECONDS)
+def watch_dataset_changes(tenant, filenames):
+    """表示中のデータセットが他のセッションで更新されたら画面を再描画する"""
+    bus = get_dataset_bus()
+    seen = st.session_state.get("dataset_versions", {})
+    if any(bus.version(tenant, f) != seen.get(f"{tenant}/{f}", 0) for f in filenames):
+        st.rerun()
+
+LEGACY_MIGRATION_MARKER = ".legacy_migrated"
+
+def migrate_legacy_files(tenant):
+    """旧バージョンでカレントディレクトリに保存されていたファイルを既定ワークスペースへ取り込む
+
+    取り込みは1回だけ行い、済んだことをワークスペースの目印ファイルに残す
+    （リセットでデータファイルを消した後に古いデータを取り込み直さないため）。
+    """
+    if tenant != DEFAULT_TENANT:
+        return
+    marker = data_path(LEGACY_MIGRATION_MARKER, tenant)
+    if os.path.exists(marker):
+        return
+    for filename in DATA_FILES:
+        target = data_path(filename, tenant)
+        if os.path.exists(filename) and not os.path.exists(target):
+            shutil.copy2(filename, target)
+    with open(marker, 'w', encoding='utf-8') as f:
+        f.write(datetime.now().isoformat())
+
+# フローのバージョン管理（差分 + 定期スナップショットの追記型ログ）
+FLOW_VERSIONS_DIR = "flow_versions"
+FLOW_SNAPSHOT_INTERVAL = 50
+FLOW_STRUCTURE_KEYS = ("nodes", "connections")
+
+def flow_version_path(flow_id, tenant):
+    directory = os.path.join(tenant_dir(tenant), FLOW_VERSIONS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, safe_file_stem(flow_id) + ".jsonl")
+
+def connection_key(conn):
+    return (conn.get("from"), conn.get("to"), conn.get("condition", ""))
+
+def compute_flow_delta(old, new):
+    """2つのフローの構造的な差分（ノード・接続の追加/削除/変更とフィールド変更）"""
+    delta = {}
+    fields = {k: v for k, v in new.items() if k not in FLOW_STRUCTURE_KEYS and old.get(k) != v}
+    removed_fields = [k for k in old if k not in FLOW_STRUCTURE_KEYS and k not in new]
+    if fields:
+        delta["fields"] = fields
+    if removed_fields:
+        delta["removed_fields"] = removed_fields
+
+    old_nodes = {node["node_id"]: node for node in old.get("nodes", [])}
+    new_node_ids = {node["node_id"] for node in new.get("nodes", [])}
+    nodes = {
+        "added": [[i, node] for i, node in enumerate(new.get("nodes", [])) if node["node_id"] not in old_nodes],
+        "removed": [node_id for node_id in old_nodes if node_id not in new_node_ids],
+        "changed": [node for node in new.get("nodes", []) if node["node_id"] in old_nodes and old_nodes[node["node_id"]] != node],
+    }
+    if any(nodes.values()):
+        delta["nodes"] = {k: v for k, v in nodes.items() if v}
+
+    remaining = {}
+    for conn in old.get("connections", []):
+        remaining[connection_key(conn)] = remaining.get(connection_key(conn), 0) + 1
+    added_connections = []
+    for i, conn in enumerate(new.get("connections", [])):
+        key = connection_key(conn)
+        if remaining.get(key):
+            remaining[key] -= 1
+        else:
+            added_connections.append([i, conn])
+    removed_connections = [list(key) for key, count in remaining.items() for _ in range(count)]
+    if added_connections or removed_connections:
+        delta["connections"] = {k: v for k, v in (("added", added_connections), ("removed", removed_connections)) if v}
+    return delta
+
+def apply_flow_delta(flow, delta):
+    """compute_flow_delta の差分を適用した新しいフローを返す"""
+    removed_fields = set(delta.get("removed_fields", []))
+    result = {k: v for k, v in flow.items() if k not in removed_fields}
+    result.update(delta.get("fields", {}))
+
+    node_delta = delta.get("nodes", {})
+    removed = set(node_delta.get("removed", []))
+    changed = {node["node_id"]: node for node in node_delta.get("changed", [])}
+    nodes = [changed.get(node["node_id"], node) for node in flow.get("nodes", []) if node["node_id"] not in removed]
+    for index, node in node_delta.get("added", []):
+        nodes.insert(index, node)
+    result["nodes"] = nodes
+
+    conn_delta = delta.get("connections", {})
+    to_remove = {}
+    for key in conn_delta.get("removed", []):
+        to_remove[tuple(key)] = to_remove.get(tuple(key), 0) + 1
+    connections = []
+    for conn in flow.get("connections", []):
+        key = connection_key(conn)
+        if to_remove.get(key):
+            to_remove[key] -= 1
+        else:
+            connections.append(conn)
+    for index, conn in conn_delta.get("added", []):
+        connections.insert(index, conn)
+    result["connections"] = connections
+    return result
+
+def get_flow_version_index(tenant):
+    """ワークスペースのフローごとの (読み込み済みサイズ, [{"version", "at", "kind", "offset"}, ...])
+
+    ワークスペースのデータキャッシュに置き、アイドルなワークスペースと一緒に破棄されるようにする。
+    """
+    return get_tenant_registry().datasets(tenant).setdefault("index:flow_versions", {})
+
+def load_flow_history(flow_id, tenant=None):
+    """フローのバージョン一覧。履歴ファイルは前回読んだ位置以降だけを追加で索引する"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    path = flow_version_path(flow_id, tenant)
+    if not os.path.exists(path):
+        return []
+    index = get_flow_version_index(tenant)
+    size, entries = index.get(flow_id, (0, []))
+    if os.path.getsize(path) < size:  # リセット等で作り直された場合は索引し直す
+        size, entries = 0, []
+    if os.path.getsize(path) != size:
+        entries = list(entries)
+        with open(path, 'rb') as f:
+            f.seek(size)
+            offset = size
+            for line in f:
+                record = json.loads(line)
+                kind = "deleted" if record.get("deleted") else ("snapshot" if "snapshot" in record else "delta")
+                entries.append({"version": record["version"], "at": record["at"], "kind": kind, "offset": offset})
+                offset += len(line)
+        index[flow_id] = (offset, entries)
+    return entries
+
+def _read_flow_version_lines(path, entries):
+    with open(path, 'rb') as f:
+        for entry in entries:
+            f.seek(entry["offset"])
+            yield json.loads(f.readline())
+
+def checkout_flow(flow_id, version, tenant=None):
+    """指定バージョンのフローを直前のスナップショットから差分を適用して復元する（削除済みなら None）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    entries = load_flow_history(flow_id, tenant)
+    position = next((i for i, entry in enumerate(entries) if entry["version"] == version), None)
+    if position is None:
+        raise KeyError(f"{flow_id} にバージョン {version} はありません")
+    start = position
+    while entries[start]["kind"] == "delta":
+        start -= 1
+    flow = None
+    for record in _read_flow_version_lines(flow_version_path(flow_id, tenant), entries[start:position + 1]):
+        if record.get("deleted"):
+            flow = None
+        elif "snapshot" in record:
+            flow = record["snapshot"]
+        else:
+            flow = apply_flow_delta(flow, record["delta"])
+    return flow
+
+def record_flow_version(tenant, flow_id, old, new):
+    """フローの変更を1バージョンとして追記する（一定間隔または差分で再現できない場合はスナップショット）"""
+    path = flow_version_path(flow_id, tenant)
+    entries = load_flow_history(flow_id, tenant)
+    now = datetime.now().isoformat()
+    lines = []
+    version = entries[-1]["version"] if entries else 0
+    if not entries and old is not None:
+        version += 1
+        lines.append({"version": version, "at": old.get("metadata", {}).get("updated_at", now), "snapshot": old})
+    version += 1
+    if new is None:
+        lines.append({"version": version, "at": now, "deleted": True})
+    else:
+        since_snapshot = 0
+        for entry in reversed(entries):
+            if entry["kind"] != "delta":
+                break
+            since_snapshot += 1
+        delta = compute_flow_delta(old, new) if old is not None else None
+        if delta == {}:
+            return
+        if delta is None or since_snapshot + 1 >= FLOW_SNAPSHOT_INTERVAL or apply_flow_delta(old, delta) != new:
+            lines.append({"version": version, "at": now, "snapshot": new})
+        else:
+            lines.append({"version": version, "at": now, "delta": delta})
+    with open(path, 'a', encoding='utf-8') as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+def on_flows_written(tenant, filename, event):
+    """フローの書き込みごとにバージョンを記録するバス購読者"""
+    if filename != FLOWS_FILE or not event["changes"]:
+        return
+    for flow_id, old, new in event["changes"]:
+        record_flow_version(tenant, flow_id, old, new)
+
+def flow_diff_dot(old, new):
+    """2つのバージョンの差分を色分けした Graphviz (DOT) 図"""
+    delta = compute_flow_delta(old or {}, new or {})
+    node_delta = delta.get("nodes", {})
+    added = {node["node_id"] for _, node in node_delta.get("added", [])}
+    removed = set(node_delta.get("removed", []))
+    changed = {node["node_id"] for node in node_delta.get("changed", [])}
+    conn_delta = delta.get("connections", {})
+    added_conns = [connection_key(conn) for _, conn in conn_delta.get("added", [])]
+    removed_conns = [tuple(key) for key in conn_delta.get("removed", [])]
+
+    def quote(text):
+        return json.dumps(str(text), ensure_ascii=False)
+
+    lines = ["digraph flow {", "rankdir=LR;", 'node [shape=box, style="rounded,filled", fillcolor="#ffffff"];']
+    all_nodes = {node["node_id"]: node for node in (old or {}).get("nodes", [])}
+    all_nodes.update({node["node_id"]: node for node in (new or {}).get("nodes", [])})
+    for node_id, node in all_nodes.items():
+        if node_id in added:
+            style = 'fillcolor="#d4edda", color="#28a745"'
+        elif node_id in removed:
+            style = 'fillcolor="#f8d7da", color="#dc3545", style="rounded,filled,dashed"'
+        elif node_id in changed:
+            style = 'fillcolor="#fff3cd", color="#ffc107"'
+        else:
+            style = 'color="#adb5bd"'
+        lines.append(f"{quote(node_id)} [label={quote(node.get('label', node_id))}, {style}];")
+
+    unchanged_conns = list((new or {}).get("connections", []))
+    for conn in unchanged_conns:
+        key = connection_key(conn)
+        if key in added_conns:
+            added_conns.remove(key)
+            style = 'color="#28a745", penwidth=2'
+        else:
+            style = 'color="#adb5bd"'
+        lines.append(f"{quote(key[0])} -> {quote(key[1])} [label={quote(key[2])}, {style}];")
+    for key in removed_conns:
+        lines.append(f'{quote(key[0])} -> {quote(key[1])} [label={quote(key[2])}, color="#dc3545", style=dashed];')
+    lines.append("}")
+    return "\n".join(lines)
+
+# フローの一括インポート・エクスポート（CSV / テキストDSL）
+NODE_TYPES = ["start", "end", "task", "decision", "input", "output", "subflow"]
+FLOW_NODE_COLUMNS = ["node_id", "type", "label", "description", "assigned_to", "estimated_time", "subflow_id"]
+FLOW_EDGE_COLUMNS = ["from", "to", "condition"]
+# ラベル・担当者・説明は、そのままでは読み違える場合に JSON 形式の "..." で囲んで書く
+DSL_QUOTED = r'"(?:[^"\\]|\\.)*"'
+DSL_NODE_PATTERN = re.compile(
+    rf"^(?P<id>[^\s:]+)\s*:\s*(?P<type>\w+)\s+(?P<label>{DSL_QUOTED}|.+?)(?:\s+>(?P<subflow>\S+))?"
+    rf"(?:\s+@(?P<assigned>{DSL_QUOTED}|[^\s\"]\S*))?(?:\s+(?P<time>\d+)分)?$"
+)
+DSL_AMBIGUOUS_LABEL = re.compile(r'^\s|\s$|["|\r\n]|->|\s(?:[>@]\S*|\d+分)$')
+DSL_AMBIGUOUS_ASSIGNEE = re.compile(r'^"|[\s|]|->')
+DSL_AMBIGUOUS_DESCRIPTION = re.compile(r'^\s|\s$|^"|[\r\n]')
+DSL_AMBIGUOUS_CONDITION = re.compile(r'^\s|\s$|["\[\]\r\n]')
+DSL_EDGE_PATTERN = re.compile(rf"^(?P<chain>.+?)(?:\s*\[(?P<condition>{DSL_QUOTED}|[^\]]*)\])?$")
+
+def make_flow_node(node_id, node_type, label, description="", assigned_to="", estimated_time=0, subflow_id=""):
+    node = {"node_id": node_id, "type": node_type, "label": label}
+    if node_type not in ["start", "end"]:
+        node.update({"description": description, "assigned_to": assigned_to, "estimated_time": estimated_time})
+    if node_type == "subflow":
+        node["subflow_id"] = subflow_id
+    return node
+
+def next_node_id(nodes, prefix="step"):
+    """削除後も重複しないノードIDを採番する（既存の最大連番 + 1）"""
+    pattern = re.compile(rf"^{re.escape(prefix)}_(\d+)$")
+    numbers = [int(m.group(1)) for node in nodes if (m := pattern.match(str(node.get("node_id", ""))))]
+    return f"{prefix}_{max(numbers, default=0) + 1}"
+
+def parse_estimated_time(value, location, issues):
+    value = str(value or "").strip().rstrip("分")
+    if not value:
+        return 0
+    if not value.isdigit():
+        issues.append({"level": "error", "location": location, "message": f"予想時間が数値ではありません: {value}"})
+        return 0
+    return int(value)
+
+def parse_flow_csv(nodes_text, edges_text):
+    """ノード表CSVと接続リストCSVをフローのノード・接続に変換する"""
+    issues = []
+    nodes = []
+    for line_no, row in enumerate(csv.DictReader(io.StringIO(nodes_text.strip())), start=2):
+        location = f"ノードCSV {line_no}行目"
+        node_id = (row.get("node_id") or "").strip()
+        if not node_id:
+            issues.append({"level": "error", "location": location, "message": "node_id が空です"})
+            continue
+        nodes.append(make_flow_node(
+            node_id,
+            (row.get("type") or "task").strip(),
+            (row.get("label") or node_id).strip(),
+            (row.get("description") or "").strip(),
+            (row.get("assigned_to") or "").strip(),
+            parse_estimated_time(row.get("estimated_time"), location, issues),
+            (row.get("subflow_id") or "").strip(),
+        ))
+    connections = []
+    for line_no, row in enumerate(csv.DictReader(io.StringIO(edges_text.strip())), start=2):
+        conn = {"from": (row.get("from") or "").strip(), "to": (row.get("to") or "").strip()}
+        if (row.get("condition") or "").strip():
+            conn["condition"] = row["condition"].strip()
+        conn["_location"] = f"接続CSV {line_no}行目"
+        connections.append(conn)
+    return nodes, connections, issues
+
+def dsl_quote(value, ambiguous):
+    """DSL に書く値（ambiguous に当たる値と空文字は "..." で囲む）"""
+    value = str(value)
+    return json.dumps(value, ensure_ascii=False) if not value or ambiguous.search(value) else value
+
+def dsl_unquote(value):
+    value = (value or "").strip()
+    return json.loads(value) if re.fullmatch(DSL_QUOTED, value) else value
+
+def parse_flow_dsl(text):
+    """テキストDSLをフローのノード・接続に変換する
+
+    ノード: `step_1: task 請求内容確認 @経理部・田中 30分 | 説明`
+    サブフロー: `step_2: subflow 支払処理 >flow_002`（> の後に参照するフローID）
+    接続:   `step_1 -> step_2 -> decision_1` / `decision_1 -> step_3 [承認]`
+    予想時間には「分」を付ける。ラベル・担当者・説明・条件は "..." で囲むと記号や空白をそのまま書ける。
+    """
+    issues = []
+    nodes = []
+    connections = []
+    for line_no, raw in enumerate(text.splitlines(), start=1):
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        location = f"{line_no}行目"
+        # "..." の中の | や -> は区切りとみなさない
+        masked = re.sub(DSL_QUOTED, lambda quoted: "_" * len(quoted.group()), line)
+        head_end = masked.find("|") if "|" in masked else len(line)
+        if "->" in masked[:head_end]:
+            match = DSL_EDGE_PATTERN.match(line)
+            chain = [part.strip() for part in match.group("chain").split("->")]
+            if any(not part for part in chain):
+                issues.append({"level": "error", "location": location, "message": f"接続の書式が不正です: {line}"})
+                continue
+            for from_id, to_id in zip(chain, chain[1:]):
+                conn = {"from": from_id, "to": to_id}
+                if match.group("condition"):
+                    conn["condition"] = dsl_unquote(match.group("condition"))
+                conn["_location"] = location
+                connections.append(conn)
+            continue
+        line, description = line[:head_end], line[head_end + 1:]
+        match = DSL_NODE_PATTERN.match(line.strip())
+        if not match:
+            issues.append({"level": "error", "location": location, "message": f"ノードの書式が不正です: {raw.strip()}"})
+            continue
+        nodes.append(make_flow_node(
+            match.group("id"),
+            match.group("type"),
+            dsl_unquote(match.group("label")),
+            dsl_unquote(description),
+            dsl_unquote(match.group("assigned")),
+            int(match.group("time") or 0),
+            match.group("subflow") or "",
+        ))
+    return nodes, connections, issues
+
+def validate_flow_structure(nodes, connections, node_types=None, flow_ids=None):
+    """ノード・接続を1パスで検証する（参照切れ・開始/終了ノード・到達不能ノード・循環）
+
+    flow_ids を渡すと、サブフローが参照するフローが存在するかも確認する。
+    """
+    node_types = node_types or NODE_TYPES
+    issues = []
+    node_ids = {}
+    for position, node in enumerate(nodes):
+        location = node.get("_location", f"ノード {position + 1}件目（{node.get('node_id')}）")
+        if node["node_id"] in node_ids:
+            issues.append({"level": "error", "location": location, "message": f"ノードIDが重複しています: {node['node_id']}"})
+        node_ids[node["node_id"]] = node
+        if node.get("type") not in node_types:
+            issues.append({"level": "error", "location": location, "message": f"不明なノードタイプです: {node.get('type')}"})
+        elif node["type"] == "subflow":
+            if not node.get("subflow_id"):
+                issues.append({"level": "error", "location": location, "message": "サブフローの参照先（subflow_id）がありません"})
+            elif flow_ids is not None and node["subflow_id"] not in flow_ids:
+                issues.append({"level": "error", "location": location, "message": f"存在しないフローを参照しています: {node['subflow_id']}"})
+
+    start_ids = [node_id for node_id, node in node_ids.items() if node.get("type") == "start"]
+    if not start_ids:
+        issues.append({"level": "error", "location": "フロー全体", "message": "開始ノード（start）がありません"})
+    if not any(node.get("type") == "end" for node in node_ids.values()):
+        issues.append({"level": "error", "location": "フロー全体", "message": "終了ノード（end）がありません"})
+
+    adjacency = {node_id: [] for node_id in node_ids}
+    for position, conn in enumerate(connections):
+        location = conn.get("_location", f"接続 {position + 1}件目")
+        dangling = [conn[end] for end in ("from", "to") if conn.get(end) not in node_ids]
+        if dangling:
+            issues.append({"level": "error", "location": location, "message": f"存在しないノードを参照しています: {', '.join(map(str, dangling))}"})
+            continue
+        adjacency[conn["from"]].append(conn["to"])
+
+    # 開始ノードからの到達性と循環（反復DFSで各ノード・各接続を1回ずつ訪問）
+    state = {}
+    back_edges = []
+    for start_id in start_ids:
+        if start_id in state:
+            continue
+        state[start_id] = "open"
+        stack = [(start_id, iter(adjacency[start_id]))]
+        while stack:
+            node_id, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node_id] = "done"
+                stack.pop()
+            elif child not in state:
+                state[child] = "open"
+                stack.append((child, iter(adjacency[child])))
+            elif state[child] == "open":
+                back_edges.append((node_id, child))
+    for node_id in node_ids:
+        if node_id not in state:
+            issues.append({"level": "warning", "location": f"ノード {node_id}", "message": "開始ノードから到達できません"})
+        elif not adjacency[node_id] and node_ids[node_id].get("type") != "end":
+            issues.append({"level": "warning", "location": f"ノード {node_id}", "message": "次の接続がなく終了ノードに到達しません"})
+    for from_id, to_id in back_edges:
+        issues.append({"level": "warning", "location": f"接続 {from_id} → {to_id}", "message": "循環（差し戻しループ）を形成しています"})
+    return issues
+
+def layout_flow_nodes(nodes, connections):
+    """開始ノードからの距離で列、同じ列内の順番で行を決めて position を付与する"""
+    adjacency = {}
+    for conn in connections:
+        adjacency.setdefault(conn["from"], []).append(conn["to"])
+    depth = {}
+    queue = [node["node_id"] for node in nodes if node["type"] == "start"]
+    for node_id in queue:
+        depth.setdefault(node_id, 0)
+    for node_id in queue:
+        for child in adjacency.get(node_id, []):
+            if child not in depth:
+                depth[child] = depth[node_id] + 1
+                queue.append(child)
+    rows = {}
+    for node in nodes:
+        column = depth.get(node["node_id"], max(depth.values(), default=0) + 1)
+        row = rows.get(column, 0)
+        rows[column] = row + 1
+        node["position"] = {"x": 100 + 200 * column, "y": 50 + 100 * row}
+    return nodes
+
+def import_flow(flow_name, description, nodes, connections, flow_id=None, tenant=None):
+    """検証済みのノード・接続から1つのフローを組み立て、1回の書き込みで保存する"""
+    connections = [{k: v for k, v in conn.items() if not k.startswith("_")} for conn in connections]
+    nodes = layout_flow_nodes([{k: v for k, v in node.items() if not k.startswith("_")} for node in nodes], connections)
+    existing = load_flow(flow_id, tenant) if flow_id else None
+    now = datetime.now().isoformat()
+    flow = {
+        "flow_id": flow_id or next_record_id(load_flow_headers(tenant), "flow", id_field="flow_id"),
+        "flow_name": flow_name,
+        "description": description,
+        "nodes": nodes,
+        "connections": connections,
+        "metadata": {
+            "created_by": existing["metadata"].get("created_by", "user") if existing else "user",
+            "created_at": existing["metadata"].get("created_at", now) if existing else now,
+            "updated_at": now
+        }
+    }
+    write_flows([(flow["flow_id"], flow)], tenant=tenant)
+    return flow
+
+def export_flow_csv(flow):
+    """フローをノード表CSVと接続リストCSVに書き出す"""
+    nodes_buffer = io.StringIO()
+    writer = csv.DictWriter(nodes_buffer, fieldnames=FLOW_NODE_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(flow["nodes"])
+    edges_buffer = io.StringIO()
+    writer = csv.DictWriter(edges_buffer, fieldnames=FLOW_EDGE_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(flow["connections"])
+    return nodes_buffer.getvalue(), edges_buffer.getvalue()
+
+def export_flow_dsl(flow):
+    """フローをテキストDSLに書き出す（parse_flow_dsl で読み戻せる）"""
+    lines = [f"# {flow['flow_name']}", "# ノード"]
+    for node in flow["nodes"]:
+        line = f"{node['node_id']}: {node['type']} {dsl_quote(node['label'], DSL_AMBIGUOUS_LABEL)}"
+        if node.get("subflow_id"):
+            line += f" >{node['subflow_id']}"
+        if node.get("assigned_to"):
+            line += f" @{dsl_quote(node['assigned_to'], DSL_AMBIGUOUS_ASSIGNEE)}"
+        if step_minutes(node):
+            line += f" {round(step_minutes(node))}分"
+        if node.get("description"):
+            line += f" | {dsl_quote(node['description'], DSL_AMBIGUOUS_DESCRIPTION)}"
+        lines.append(line)
+    lines.append("# 接続")
+    for conn in flow["connections"]:
+        condition = f" [{dsl_quote(conn['condition'], DSL_AMBIGUOUS_CONDITION)}]" if conn.get("condition") else ""
+        lines.append(f"{conn['from']} -> {conn['to']}{condition}")
+    return "\n".join(lines) + "\n"
+
+def render_flow_issues(issues):
+    errors = [issue for issue in issues if issue["level"] == "error"]
+    warnings = [issue for issue in issues if issue["level"] == "warning"]
+    if errors:
+        st.error("\n".join(f"• {issue['location']}: {issue['message']}" for issue in errors))
+    if warnings:
+        st.warning("\n".join(f"• {issue['location']}: {issue['message']}" for issue in warnings))
+    if not issues:
+        st.success("問題は見つかりませんでした")
+    return not errors
+
+# 組織（OpsMapの業務）・業務辞書・フローのリンク索引
+LINKED_FILES = {ORG_FILE: ("業務", "id"), TASKS_FILE: ("業務名", "id"), FLOWS_FILE: ("flow_name", "flow_id")}
+
+LINK_TARGETS = {"task_id": TASKS_FILE, "flow_id": FLOWS_FILE}
+
+def link_name(name):
+    """名前による自動リンク用の正規化（「〇〇フロー」は「〇〇」と同一視する）"""
+    name = str(name or "").strip()
+    return name[:-len("フロー")] if name.endswith("フロー") and len(name) > len("フロー") else name
+
+class LinkIndex:
+    """組織エントリ ↔ 業務 ↔ フローのIDによる双方向リンク
+
+    リンクは links_data.json に保存し、逆引きと名前索引はメモリ上に保持して
+    書き込みのたびに差分で更新する。明示的にリンクを外した場合は None を保存し、
+    名前による自動リンクの対象から外す。構築時には、渡されたデータにない
+    ID を指すリンク（キャッシュがない間に削除されたもの）を取り除く。
+    """
+
+    def __init__(self, links, org_data, tasks_data, flows_data):
+        links = links if isinstance(links, dict) else {}
+        self.org_links = {}  # org_id -> {"task_id": .., "flow_id": ..}
+        self.task_links = {}  # task_id -> {"flow_id": ..}
+        self.orgs_by_task = {}
+        self.orgs_by_flow = {}
+        self.tasks_by_flow = {}
+        self.names = {ORG_FILE: {}, TASKS_FILE: {}, FLOWS_FILE: {}}
+        self.dirty = False
+        for filename, records in ((ORG_FILE, org_data), (TASKS_FILE, tasks_data), (FLOWS_FILE, flows_data)):
+            name_field, id_field = LINKED_FILES[filename]
+            for record in records:
+                self._add_name(filename, record.get(name_field), record[id_field])
+        ids = {filename: set().union(*self.names[filename].values()) for filename in self.names}
+        exists = lambda filename, record_id: record_id is None or record_id in ids[filename]
+        for task_id, link in links.get("task", {}).items():
+            if task_id in ids[TASKS_FILE] and "flow_id" in link and exists(FLOWS_FILE, link["flow_id"]):
+                self.link_task(task_id, link["flow_id"])
+        for org_id, link in links.get("org", {}).items():
+            if org_id in ids[ORG_FILE]:
+                self.link_org(org_id, **{
+                    key: value for key, value in link.items()
+                    if key in LINK_TARGETS and exists(LINK_TARGETS[key], value)
+                })
+        for task in tasks_data:
+            self._auto_link_task(task["id"], task.get("業務名"))
+        for org in org_data:
+            self._auto_link_org(org["id"], org.get("業務"))
+
+    def to_json(self):
+        return {"org": self.org_links, "task": self.task_links}
+
+    # 参照
+    def task_for_org(self, org_id):
+        return self.org_links.get(org_id, {}).get("task_id")
+
+    def flow_for_task(self, task_id):
+        return self.task_links.get(task_id, {}).get("flow_id")
+
+    def flow_for_org(self, org_id):
+        link = self.org_links.get(org_id, {})
+        return link.get("flow_id") or self.flow_for_task(link.get("task_id"))
+
+    def orgs_for_task(self, task_id):
+        return sorted(self.orgs_by_task.get(task_id, ()))
+
+    def tasks_for_flow(self, flow_id):
+        return sorted(self.tasks_by_flow.get(flow_id, ()))
+
+    def orgs_for_flow(self, flow_id):
+        orgs = set(self.orgs_by_flow.get(flow_id, ()))
+        for task_id in self.tasks_by_flow.get(flow_id, ()):
+            orgs |= self.orgs_by_task.get(task_id, set())
+        return sorted(orgs)
+
+    # 更新
+    def link_org(self, org_id, task_id=..., flow_id=...):
+        """組織エントリのリンクを設定する（省略した項目は変更しない、None はリンク解除）"""
+        link = self.org_links.setdefault(org_id, {})
+        for key, value, reverse in (("task_id", task_id, self.orgs_by_task), ("flow_id", flow_id, self.orgs_by_flow)):
+            if value is ... or (key in link and link[key] == value):
+                continue
+            self.dirty = True
+            if link.get(key) is not None:
+                reverse.get(link[key], set()).discard(org_id)
+            link[key] = value
+            if value is not None:
+                reverse.setdefault(value, set()).add(org_id)
+
+    def link_task(self, task_id, flow_id):
+        link = self.task_links.setdefault(task_id, {})
+        if "flow_id" in link and link["flow_id"] == flow_id:
+            return
+        self.dirty = True
+        if link.get("flow_id") is not None:
+            self.tasks_by_flow.get(link["flow_id"], set()).discard(task_id)
+        link["flow_id"] = flow_id
+        if flow_id is not None:
+            self.tasks_by_flow.setdefault(flow_id, set()).add(task_id)
+
+    def apply_change(self, filename, record_id, old, new):
+        """レコードの追加・変更・削除をリンクと名前索引に反映する。リンクが変わったら True"""
+        name_field, _ = LINKED_FILES[filename]
+        old_name = old.get(name_field) if old else None
+        new_name = new.get(name_field) if new else None
+        if old is not None:
+            self._remove_name(filename, old_name, record_id)
+        if new is not None:
+            self._add_name(filename, new_name, record_id)
+        self.dirty = False
+        if new is None:
+            self._unlink(filename, record_id)
+        elif old is None or link_name(old_name) != link_name(new_name):
+            if filename == ORG_FILE:
+                self._auto_link_org(record_id, new_name)
+            elif filename == TASKS_FILE:
+                self._auto_link_task(record_id, new_name)
+                for org_id in self.names[ORG_FILE].get(link_name(new_name), ()):
+                    self._auto_link_org(org_id, new_name)
+            else:
+                for task_id in self.names[TASKS_FILE].get(link_name(new_name), ()):
+                    self._auto_link_task(task_id, new_name)
+                for org_id in self.names[ORG_FILE].get(link_name(new_name), ()):
+                    self._auto_link_org(org_id, new_name)
+        return self.dirty
+
+    def _add_name(self, filename, name, record_id):
+        self.names[filename].setdefault(link_name(name), set()).add(record_id)
+
+    def _remove_name(self, filename, name, record_id):
+        self.names[filename].get(link_name(name), set()).discard(record_id)
+
+    def _first(self, filename, name):
+        ids = self.names[filename].get(link_name(name))
+        return min(ids) if ids else None
+
+    def _auto_link_task(self, task_id, name):
+        if "flow_id" not in self.task_links.get(task_id, {}):
+            flow_id = self._first(FLOWS_FILE, name)
+            if flow_id is not None:
+                self.link_task(task_id, flow_id)
+
+    def _auto_link_org(self, org_id, name):
+        link = self.org_links.get(org_id, {})
+        if "task_id" not in link:
+            task_id = self._first(TASKS_FILE, name)
+            if task_id is not None:
+                self.link_org(org_id, task_id=task_id)
+        if "flow_id" not in link and self.task_for_org(org_id) is None:
+            flow_id = self._first(FLOWS_FILE, name)
+            if flow_id is not None:
+                self.link_org(org_id, flow_id=flow_id)
+
+    def _unlink(self, filename, record_id):
+        if filename == ORG_FILE:
+            self.link_org(record_id, task_id=None, flow_id=None)
+            self.org_links.pop(record_id, None)
+        elif filename == TASKS_FILE:
+            for org_id in list(self.orgs_by_task.pop(record_id, ())):
+                self.org_links[org_id].pop("task_id", None)
+            self.link_task(record_id, None)
+            self.task_links.pop(record_id, None)
+        else:
+            for org_id in list(self.orgs_by_flow.pop(record_id, ())):
+                self.org_links[org_id].pop("flow_id", None)
+            for task_id in list(self.tasks_by_flow.pop(record_id, ())):
+                self.task_links[task_id].pop("flow_id", None)
+        self.dirty = True
+
+def link_index_version(tenant):
+    return tuple(get_dataset_bus().version(tenant, filename) for filename in (ORG_FILE, TASKS_FILE, FLOWS_FILE, LINKS_FILE))
+
+def get_link_index(tenant=None):
+    """ワークスペースのリンク索引。キャッシュが最新でなければリンクファイルとデータから再構築する"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:links")
+    if cached and cached[0] == link_index_version(tenant):
+        return cached[1]
+    with get_tenant_registry().lock(tenant):
+        links = load_data(LINKS_FILE, tenant)
+        index = LinkIndex(
+            links, load_data(ORG_FILE, tenant), load_data(TASKS_FILE, tenant), load_flow_headers(tenant)
+        )
+        if index.to_json() != links:
+            save_data(LINKS_FILE, index.to_json(), tenant)
+        datasets["index:links"] = (link_index_version(tenant), index)
+    return index
+
+def save_link_index(tenant, index):
+    save_data(LINKS_FILE, index.to_json(), tenant)
+    get_tenant_registry().datasets(tenant)["index:links"] = (link_index_version(tenant), index)
+
+def on_links_affected(tenant, filename, event):
+    """組織・業務・フローの書き込みをリンク索引へ差分で反映するバス購読者"""
+    if filename not in LINKED_FILES:
+        return
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:links")
+    expected = list(link_index_version(tenant))
+    expected[list(LINKED_FILES).index(filename)] -= 1
+    if not cached or cached[0] != tuple(expected) or event["changes"] is None:
+        datasets.pop("index:links", None)  # 次に参照されたときに再構築する
+        return
+    index = cached[1]
+    changed = False
+    for record_id, old, new in event["changes"]:
+        changed = index.apply_change(filename, record_id, old, new) or changed
+    if changed:
+        save_link_index(tenant, index)
+    else:
+        datasets["index:links"] = (link_index_version(tenant), index)
+
+def set_org_links(org_id, task_id, flow_id, tenant=None):
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        index = get_link_index(tenant)
+        index.dirty = False
+        index.link_org(org_id, task_id=task_id, flow_id=flow_id)
+        if index.dirty:
+            save_link_index(tenant, index)
+
+def set_task_flow_link(task_id, flow_id, tenant=None):
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        index = get_link_index(tenant)
+        index.dirty = False
+        index.link_task(task_id, flow_id)
+        if index.dirty:
+            save_link_index(tenant, index)
+
+# 到達可能性・影響分析（フロー単位の推移閉包ビットセット + 担当者/ステップ名の索引）
+ASSIGNEE_SEPARATOR = re.compile(r"[・、,，/／\s]+")
+PERSON_SEPARATOR = re.compile(r"[、,，/／\s]+")
+
+def assignee_people(value):
+    """担当者欄を人に分解する。「、」などで区切った各記載の「・」より前は所属とみなす
+
+    例: 「経理部・田中、佐藤」→ {"田中", "佐藤"}
+    """
+    return {entry.rsplit("・", 1)[-1] for entry in PERSON_SEPARATOR.split(str(value or "")) if entry.rsplit("・", 1)[-1]}
+
+def iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+class FlowReachability:
+    """1フローのノード間の到達可能性をSCC縮約とビットセットで事前計算する"""
+
+    def __init__(self, flow):
+        self.node_ids = list(dict.fromkeys(node["node_id"] for node in flow.get("nodes", [])))
+        self.position = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        adjacency = [[] for _ in self.node_ids]
+        for conn in flow.get("connections", []):
+            if conn.get("from") in self.position and conn.get("to") in self.position:
+                adjacency[self.position[conn["from"]]].append(self.position[conn["to"]])
+        self.reach = self._closure(adjacency)
+
+    @staticmethod
+    def _closure(adjacency):
+        # 反復版Tarjan法。SCCは下流（シンク）側から順に確定するので、その順に到達集合を合成できる
+        count = len(adjacency)
+        index = [None] * count
+        low = [0] * count
+        on_stack = [False] * count
+        component = [None] * count
+        component_reach = []
+        stack = []
+        counter = 0
+        for root in range(count):
+            if index[root] is not None:
+                continue
+            work = [(root, iter(adjacency[root]))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if index[child] is None:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack[child] = True
+                        work.append((child, iter(adjacency[child])))
+                    elif on_stack[child]:
+                        low[node] = min(low[node], index[child])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] != index[node]:
+                    continue
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = len(component_reach)
+                    members.append(member)
+                    if member == node:
+                        break
+                mask = 0
+                for member in members:
+                    mask |= 1 << member
+                reach = 0
+                cyclic = len(members) > 1
+                for member in members:
+                    for child in adjacency[member]:
+                        if component[child] == component[member]:
+                            cyclic = True
+                        else:
+                            reach |= component_reach[component[child]] | (1 << child)
+                component_reach.append(reach | (mask if cyclic else 0))
+        return [component_reach[component[i]] for i in range(count)]
+
+    def mask(self, node_ids):
+        bits = 0
+        for node_id in node_ids:
+            if node_id in self.position:
+                bits |= 1 << self.position[node_id]
+        return bits
+
+    def downstream_bits(self, bits):
+        result = 0
+        for i in iter_bits(bits):
+            result |= self.reach[i]
+        return result
+
+    def ids(self, bits):
+        return [self.node_ids[i] for i in iter_bits(bits)]
+
+class ImpactIndex:
+    """フロー・業務・組織を横断した影響分析用の索引（書き込みごとに差分で更新する）"""
+
+    def __init__(self):
+        self.flows = {}  # flow_id -> {"flow_name", "reach", "nodes": {node_id: node}}
+        self.flow_nodes_by_assignee = {}  # token -> {flow_id: set(node_id)}
+        self.flow_nodes_by_label = {}  # label -> {flow_id: set(node_id)}
+        self.records_by_assignee = {TASKS_FILE: {}, ORG_FILE: {}}  # token -> set(record_id)
+        self.record_owners = {TASKS_FILE: {}, ORG_FILE: {}}  # record_id -> tokens
+
+    def apply_change(self, filename, record_id, old, new):
+        if filename == FLOWS_FILE:
+            self._remove_flow(record_id)
+            if new is not None:
+                self._add_flow(new)
+            return
+        if filename not in self.records_by_assignee:
+            return
+        owner_field = "担当者"
+        by_assignee = self.records_by_assignee[filename]
+        for token in self.record_owners[filename].pop(record_id, ()):
+            by_assignee.get(token, set()).discard(record_id)
+        if new is not None:
+            tokens = assignee_people(new.get(owner_field))
+            self.record_owners[filename][record_id] = tokens
+            for token in tokens:
+                by_assignee.setdefault(token, set()).add(record_id)
+
+    def _add_flow(self, flow):
+        flow_id = flow["flow_id"]
+        nodes = {node["node_id"]: node for node in flow.get("nodes", [])}
+        self.flows[flow_id] = {"flow_name": flow.get("flow_name", flow_id), "reach": FlowReachability(flow), "nodes": nodes}
+        for node_id, node in nodes.items():
+            for token in assignee_people(node.get("assigned_to")):
+                self.flow_nodes_by_assignee.setdefault(token, {}).setdefault(flow_id, set()).add(node_id)
+            self.flow_nodes_by_label.setdefault(node.get("label", ""), {}).setdefault(flow_id, set()).add(node_id)
+
+    def _remove_flow(self, flow_id):
+        entry = self.flows.pop(flow_id, None)
+        if not entry:
+            return
+        for node in entry["nodes"].values():
+            for token in assignee_people(node.get("assigned_to")):
+                self.flow_nodes_by_assignee.get(token, {}).pop(flow_id, None)
+            self.flow_nodes_by_label.get(node.get("label", ""), {}).pop(flow_id, None)
+
+    # 問い合わせ
+    def downstream(self, flow_id, node_id):
+        """指定ステップの下流にあるステップID（ループで自分に戻る場合は自分も含む）"""
+        entry = self.flows.get(flow_id)
+        if not entry:
+            return []
+        reach = entry["reach"]
+        return reach.ids(reach.downstream_bits(reach.mask([node_id])))
+
+    def flows_through(self, label):
+        """ステップ名で通過フローを探す（完全一致がなければ部分一致）"""
+        matches = self.flow_nodes_by_label.get(label)
+        if not matches:
+            matches = {}
+            for candidate, flows in self.flow_nodes_by_label.items():
+                if label and label in candidate:
+                    for flow_id, node_ids in flows.items():
+                        matches.setdefault(flow_id, set()).update(node_ids)
+        return [
+            {"flow_id": flow_id, "flow_name": self.flows[flow_id]["flow_name"], "node_ids": sorted(node_ids)}
+            for flow_id, node_ids in sorted(matches.items()) if node_ids and flow_id in self.flows
+        ]
+
+    def person_impact(self, person):
+        """担当者が不在になった場合に止まるフローのステップ（下流を含む）・業務・組織の業務"""
+        token = str(person or "").strip()
+        steps = []
+        for flow_id, node_ids in sorted(self.flow_nodes_by_assignee.get(token, {}).items()):
+            if not node_ids:
+                continue
+            reach = self.flows[flow_id]["reach"]
+            direct = reach.mask(node_ids)
+            steps.append({
+                "flow_id": flow_id,
+                "flow_name": self.flows[flow_id]["flow_name"],
+                "node_ids": reach.ids(direct),
+                "downstream": reach.ids(reach.downstream_bits(direct) & ~direct),
+            })
+        records = {}
+        for filename in (TASKS_FILE, ORG_FILE):
+            record_ids = sorted(self.records_by_assignee[filename].get(token, ()))
+            records[filename] = [
+                {"id": record_id, "single_owner": len(self.record_owners[filename][record_id]) == 1}
+                for record_id in record_ids
+            ]
+        return {"person": token, "flow_steps": steps, "tasks": records[TASKS_FILE], "org": records[ORG_FILE]}
+
+    def node_label(self, flow_id, node_id):
+        return self.flows.get(flow_id, {}).get("nodes", {}).get(node_id, {}).get("label", node_id)
+
+    def assignees(self):
+        names = set(self.flow_nodes_by_assignee) | set(self.records_by_assignee[TASKS_FILE]) | set(self.records_by_assignee[ORG_FILE])
+        return sorted(name for name in names if self.person_has_work(name))
+
+    def person_has_work(self, name):
+        return (any(self.flow_nodes_by_assignee.get(name, {}).values())
+                or bool(self.records_by_assignee[TASKS_FILE].get(name))
+                or bool(self.records_by_assignee[ORG_FILE].get(name)))
+
+IMPACT_FILES = (FLOWS_FILE, TASKS_FILE, ORG_FILE)
+
+def impact_index_version(tenant):
+    return tuple(get_dataset_bus().version(tenant, filename) for filename in IMPACT_FILES)
+
+def get_impact_index(tenant=None):
+    """影響分析用の索引。キャッシュが最新でなければ全データセットから構築する"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:impact")
+    if cached and cached[0] == impact_index_version(tenant):
+        return cached[1]
+    with get_tenant_registry().lock(tenant):
+        index = ImpactIndex()
+        for flow in load_all_flows(tenant):
+            index.apply_change(FLOWS_FILE, flow["flow_id"], None, flow)
+        for filename in (TASKS_FILE, ORG_FILE):
+            for record in load_data(filename, tenant):
+                index.apply_change(filename, record["id"], None, record)
+        datasets["index:impact"] = (impact_index_version(tenant), index)
+    return index
+
+def on_impact_affected(tenant, filename, event):
+    """フロー・業務・組織の書き込みを影響分析の索引へ差分で反映するバス購読者"""
+    if filename not in IMPACT_FILES:
+        return
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:impact")
+    expected = list(impact_index_version(tenant))
+    expected[IMPACT_FILES.index(filename)] -= 1
+    if not cached or cached[0] != tuple(expected) or event["changes"] is None:
+        datasets.pop("index:impact", None)
+        return
+    for record_id, old, new in event["changes"]:
+        cached[1].apply_change(filename, record_id, old, new)
+    datasets["index:impact"] = (impact_index_version(tenant), cached[1])
+
+# ホーム画面の集計（書き込みごとに差分で更新する）
+# 1文字の単位は「月曜日」「日報」のような語の一部では単位とみなさない（曜日の指定は毎週とみなす）
+FREQUENCY_PATTERN = re.compile(
+    r"(?P<unit>[月火水木金土日]曜|毎日|日次|毎週|週次|週末|隔週|毎月|月次|月末|月初|隔月|四半期|半期|半年|毎年|年次|年度末|年末"
+    r"|(?<![一-龥])[日週月年](?![一-龥]))(?:\s*に?\s*(?P<times>\d+)\s*回)?"
+)
+FREQUENCY_UNITS = {
+    "毎日": "day", "日次": "day", "日": "day",
+    "毎週": "week", "週次": "week", "週末": "week", "週": "week", "隔週": "biweek",
+    "毎月": "month", "月次": "month", "月末": "month", "月初": "month", "月": "month", "隔月": "bimonth",
+    "四半期": "quarter", "半期": "half", "半年": "half",
+    "毎年": "year", "年次": "year", "年度末": "year", "年末": "year", "年": "year",
+    **{f"{day}曜": "week" for day in "月火水木金土日"},
+}
+# 「3ヶ月に1回」「2週間ごとに2回」のような間隔の指定
+FREQUENCY_INTERVAL_PATTERN = re.compile(
+    r"(?P<count>\d+)\s*(?P<unit>日|週間|週|[かヶヵカケ箇]月|月|年)\s*(?:に|ごと|毎)\s*(?:に)?\s*(?:(?P<times>\d+)\s*回)?"
+)
+FREQUENCY_INTERVAL_UNIT_DAYS = {"日": 1, "週": 7, "月": 30.4, "年": 365}
+FREQUENCY_LABELS = {
+    "day": "毎日", "week": "毎週", "biweek": "隔週", "month": "毎月", "bimonth": "隔月",
+    "quarter": "四半期", "third": "4か月ごと", "half": "半期", "year": "毎年",
+}
+PERIOD_DAYS = {"day": 1, "week": 7, "biweek": 14, "month": 30.4, "bimonth": 61, "quarter": 91, "third": 122, "half": 182, "year": 365}
+PERIOD_WEEKS = {"week": 1, "biweek": 2}
+PERIOD_MONTHS = {"month": 1, "bimonth": 2, "quarter": 3, "third": 4, "half": 6, "year": 12}
+# 期間ごとの締め月（月以上の周期の業務は期末の週に実施するものとみなす。年度は3月末締め）
+PERIOD_END_MONTHS = {period: tuple(month for month in range(1, 13) if (month - 3) % months == 0) for period, months in PERIOD_MONTHS.items()}
+HIGH_IMPORTANCE = "★★★"
+HOME_FILES = (TASKS_FILE, SKILLS_FILE, ORG_FILE, FLOWS_FILE)
+HOME_LIST_SIZE = 5
+
+def parse_frequency(value):
+    """頻度の記載を (周期, 回数) に変換する（「随時」など周期が読み取れなければ None）
+
+    「N<単位>に M回」は N<単位> に最も近い長さの周期で M回とみなす（例: 3ヶ月に1回 → 四半期に1回）。
+    """
+    text = unicodedata.normalize("NFKC", str(value or ""))
+    if match := FREQUENCY_INTERVAL_PATTERN.search(text):
+        days = int(match.group("count")) * FREQUENCY_INTERVAL_UNIT_DAYS[match.group("unit").rstrip("間")[-1]]
+        period = min(PERIOD_DAYS, key=lambda period: abs(PERIOD_DAYS[period] - days))
+        return period, int(match.group("times") or 1)
+    match = FREQUENCY_PATTERN.search(text)
+    if not match:
+        return None
+    return FREQUENCY_UNITS[match.group("unit")], int(match.group("times") or 1)
+
+def week_number(day):
+    """1970-01-05（月曜日）の週を1とした通し週番号（隔週の業務の判定用）"""
+    return (int(np.datetime64(day, "D").astype(np.int64)) + 3) // 7
+
+def periods_due_in_week(today):
+    """today を含む週（月〜日）に実施される周期の一覧"""
+    week_start = today - timedelta(days=today.weekday())
+    week_days = [week_start + timedelta(days=offset) for offset in range(7)]
+    month_ends = {day.month for day in week_days if (day + timedelta(days=1)).month != day.month}
+    return ["day"] + [period for period, weeks in PERIOD_WEEKS.items() if week_number(week_start) % weeks == 0] + [
+        period for period, months in PERIOD_END_MONTHS.items() if month_ends & set(months)
+    ]
+
+def is_single_owner_critical(record):
+    return record.get("重要度") == HIGH_IMPORTANCE and len(assignee_people(record.get("担当者"))) == 1
+
+class HomeStats:
+    """ホーム画面に表示する集計値
+
+    各データセットの書き込みを (id, 旧レコード, 新レコード) 単位で反映するため、
+    ホーム画面の表示は組織の規模によらず一定の手間で済む。
+    """
+
+    def __init__(self):
+        self.counts = {filename: 0 for filename in HOME_FILES}
+        self.recurring = {period: {} for period in FREQUENCY_LABELS}  # 周期 -> {task_id: 業務名}
+        self.single_owner = {}  # (filename, id) -> 業務名
+        self.skill_gaps = {}  # 不足レベル -> {skill_id: スキル分野}
+        self.recent_flows = OrderedDict()  # flow_id -> (フロー名, 更新日時)（新しいものが末尾）
+
+    def _discard(self, filename, record_id, record):
+        self.counts[filename] -= 1
+        if filename == TASKS_FILE and (frequency := parse_frequency(record.get("頻度"))):
+            self.recurring[frequency[0]].pop(record_id, None)
+        if filename in (TASKS_FILE, ORG_FILE):
+            self.single_owner.pop((filename, record_id), None)
+        if filename == SKILLS_FILE:
+            gap = self.skill_gap(record)
+            if gap > 0:
+                self.skill_gaps[gap].pop(record_id, None)
+        if filename == FLOWS_FILE:
+            self.recent_flows.pop(record_id, None)
+
+    def _add(self, filename, record_id, record):
+        self.counts[filename] += 1
+        if filename == TASKS_FILE and (frequency := parse_frequency(record.get("頻度"))):
+            self.recurring[frequency[0]][record_id] = record.get("業務名", record_id)
+        if filename in (TASKS_FILE, ORG_FILE) and is_single_owner_critical(record):
+            self.single_owner[(filename, record_id)] = record.get("業務名") or record.get("業務", record_id)
+        if filename == SKILLS_FILE:
+            gap = self.skill_gap(record)
+            if gap > 0:
+                self.skill_gaps.setdefault(gap, {})[record_id] = record.get("スキル分野", record_id)
+        if filename == FLOWS_FILE:
+            self.recent_flows[record_id] = (record.get("flow_name", record_id), record.get("metadata", {}).get("updated_at", ""))
+            self.recent_flows.move_to_end(record_id)
+            while len(self.recent_flows) > HOME_LIST_SIZE:
+                self.recent_flows.popitem(last=False)
+
+    @staticmethod
+    def skill_gap(skill):
+        """目標と現在のレベル差（どちらかが数値でなければ差なしとする）"""
+        target, current = integer_value(skill.get("目標レベル")), integer_value(skill.get("現在レベル"))
+        return 0 if target is None or current is None else target - current
+
+    def apply_change(self, filename, record_id, old, new):
+        if old is not None:
+            self._discard(filename, record_id, old)
+        if new is not None:
+            self._add(filename, record_id, new)
+
+    def due_this_week(self, today):
+        """今週実施する定期業務を [(周期, {task_id: 業務名})] で返す"""
+        return [(period, self.recurring[period]) for period in periods_due_in_week(today) if self.recurring[period]]
+
+    def largest_skill_gaps(self, limit=HOME_LIST_SIZE):
+        """不足レベルの大きいスキルから順に最大 limit 件"""
+        result = []
+        for gap in sorted(self.skill_gaps, reverse=True):
+            for skill_id, name in self.skill_gaps[gap].items():
+                if len(result) >= limit:
+                    return result
+                result.append((name, gap))
+        return result
+
+    def skill_gap_count(self):
+        return sum(len(skills) for skills in self.skill_gaps.values())
+
+def home_stats_version(tenant):
+    return tuple(get_dataset_bus().version(tenant, filename) for filename in HOME_FILES)
+
+def get_home_stats(tenant=None):
+    """ホーム画面の集計。キャッシュが最新でなければ各データセットから作り直す"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:home")
+    if cached and cached[0] == home_stats_version(tenant):
+        return cached[1]
+    with get_tenant_registry().lock(tenant):
+        stats = HomeStats()
+        for filename in (TASKS_FILE, SKILLS_FILE, ORG_FILE):
+            for record in load_data(filename, tenant):
+                stats.apply_change(filename, record["id"], None, record)
+        # フローは索引ファイルの更新日時から最近の分だけを取り出す（本体は読み込まない）
+        headers = load_flow_headers(tenant)
+        stats.counts[FLOWS_FILE] = len(headers)
+        for header in sorted(headers, key=lambda header: header.get("updated_at", ""))[-HOME_LIST_SIZE:]:
+            stats.recent_flows[header["flow_id"]] = (header["flow_name"], header.get("updated_at", ""))
+        datasets["index:home"] = (home_stats_version(tenant), stats)
+    return stats
+
+def on_home_stats_affected(tenant, filename, event):
+    """書き込みをホーム画面の集計へ差分で反映するバス購読者"""
+    if filename not in HOME_FILES:
+        return
+    datasets = get_tenant_registry().datasets(tenant)
+    cached = datasets.get("index:home")
+    expected = list(home_stats_version(tenant))
+    expected[HOME_FILES.index(filename)] -= 1
+    if not cached or cached[0] != tuple(expected) or event["changes"] is None:
+        datasets.pop("index:home", None)
+        return
+    for record_id, old, new in event["changes"]:
+        cached[1].apply_change(filename, record_id, old, new)
+    datasets["index:home"] = (home_stats_version(tenant), cached[1])
+
+# 業務カレンダー（定期業務の発生日を展開し、担当者×週の負荷を求める）
+EFFORT_PATTERN = re.compile(r"(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>分|時間|h|H|日)")
+EFFORT_UNIT_MINUTES = {"分": 1, "時間": 60, "h": 60, "H": 60, "日": 480}
+WEEKLY_CAPACITY_MINUTES = int(os.environ.get("OPSMAP_WEEKLY_CAPACITY_MINUTES", "2400"))
+UNASSIGNED = "（未割当）"
+
+def parse_effort_minutes(value):
+    """工数の記載（「30分」「1.5時間」「1日」）を分に換算する。読み取れなければ 0"""
+    return sum(
+        float(match.group("amount")) * EFFORT_UNIT_MINUTES[match.group("unit")]
+        for match in EFFORT_PATTERN.finditer(str(value or ""))
+    )
+
+def step_minutes(node):
+    """ステップの予想時間（分）。「30分」のような文字列も読み、読み取れない値や負の値は 0"""
+    value = node.get("estimated_time")
+    minutes = integer_value(value)
+    if minutes is None:
+        minutes = parse_effort_minutes(value)
+    return max(minutes, 0)
+
+def week_start(day):
+    """day を含む週の月曜日（numpy の datetime64[D]）"""
+    day = np.datetime64(day, "D")
+    return day - (day.astype(np.int64) + 3) % 7  # 1970-01-01 は木曜日
+
+def occurrence_dates(period, times, start, end):
+    """周期 period で times 回ずつ発生する業務の [start, end) 内の発生日
+
+    日次は平日ごと、週次・隔週は対象の週の平日に均等に、月以上の周期は期間を times 等分した各区間の末日に発生する。
+    """
+    start, end = np.datetime64(start, "D"), np.datetime64(end, "D")
+    if period == "day" or period in PERIOD_WEEKS:
+        days = np.arange(start, end, dtype="datetime64[D]")
+        weekday = (days.astype(np.int64) + 3) % 7
+        if period == "day":
+            return np.repeat(days[weekday < 5], times)
+        in_period = (days.astype(np.int64) + 3) // 7 % PERIOD_WEEKS[period] == 0
+        days, weekday = days[in_period], weekday[in_period]
+        slots = np.minimum(np.arange(times) * 5 // max(times, 1), 4)
+        return np.sort(np.concatenate([days[weekday == slot] for slot in slots])) if times else days[:0]
+    months = PERIOD_MONTHS[period]
+    first_month = start.astype("datetime64[M]")
+    # 期間の途中の発生日も含めるため、end を含む期間が終わる月までの期末を並べてから [start, end) に絞る
+    period_ends = np.arange(first_month, end.astype("datetime64[M]") + months, dtype="datetime64[M]")
+    period_ends = period_ends[np.isin(period_ends.astype(np.int64) % 12 + 1, PERIOD_END_MONTHS[period])]
+    period_starts = (period_ends - (months - 1)).astype("datetime64[D]")
+    lengths = ((period_ends + 1).astype("datetime64[D]") - period_starts).astype(np.int64)
+    offsets = (lengths[:, None] * (np.arange(times) + 1)[None, :]) // times - 1
+    dates = (period_starts[:, None] + offsets).ravel()
+    return dates[(dates >= start) & (dates < end)]
+
+def weekly_occurrences(period, times, start, weeks):
+    """週ごとの発生回数（長さ weeks の配列）"""
+    dates = occurrence_dates(period, times, start, start + np.timedelta64(7 * weeks, "D"))
+    return np.bincount(((dates - start).astype(np.int64) // 7), minlength=weeks)[:weeks]
+
+def task_schedule_entry(task, flow):
+    """1業務の発生周期と1回あたりの担当者別工数（分）
+
+    紐づくフローのステップに予想時間があればステップの担当者（未設定なら業務の担当者）に配分し、
+    なければ業務の工数を担当者で等分する。
+    """
+    frequency = parse_frequency(task.get("頻度"))
+    people = sorted(assignee_people(task.get("担当者"))) or [UNASSIGNED]
+    load = {}
+    steps = [node for node in (flow or {}).get("nodes", []) if step_minutes(node) > 0]
+    if steps:
+        for node in steps:
+            node_people = sorted(assignee_people(node.get("assigned_to"))) or people
+            for person in node_people:
+                load[person] = load.get(person, 0) + step_minutes(node) / len(node_people)
+    else:
+        minutes = parse_effort_minutes(task.get("工数"))
+        for person in people:
+            load[person] = minutes / len(people)
+    return {"name": task.get("業務名", ""), "frequency": frequency, "flow_id": (flow or {}).get("flow_id"), "load": load}
+
+class WorkloadCalendar:
+    """担当者×週の負荷（分）"""
+
+    def __init__(self, people, start, load, capacity=WEEKLY_CAPACITY_MINUTES):
+        self.people = people
+        self.person_rows = {person: row for row, person in enumerate(people)}
+        self.start = start
+        self.load = load
+        self.capacity = capacity
+
+    @property
+    def week_starts(self):
+        return self.start + np.arange(self.load.shape[1]) * np.timedelta64(7, "D")
+
+    def overloads(self):
+        """容量を超える (担当者, 週の開始日, 負荷) を負荷の大きい順に"""
+        rows, weeks = np.nonzero(self.load > self.capacity)
+        order = np.argsort(-self.load[rows, weeks], kind="stable")
+        rows, weeks = rows[order], weeks[order]
+        return list(zip([self.people[row] for row in rows.tolist()], self.week_starts[weeks].tolist(), self.load[rows, weeks].tolist()))
+
+    def person_load(self, person):
+        row = self.person_rows.get(person)
+        return self.load[row] if row is not None else np.zeros(self.load.shape[1])
+
+class WorkloadSchedule:
+    """業務ごとの発生周期と工数配分を保持し、関係する業務が変わったときだけ作り直す
+
+    書き込みの通知では変更された業務・フローのIDを記録するだけにし、
+    参照時にその業務（とフローにリンクされた業務）の分だけを再計算する。
+    """
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.entries = {}
+        self.dirty_tasks = set()
+        self.dirty_flows = set()
+        self.links_changed = False
+        self.rebuild = True
+        self.generation = 0
+        self._calendars = {}
+
+    def notify(self, filename, event):
+        if event["version"] != self.versions.get(filename, 0) + 1 or event["changes"] is None and filename != LINKS_FILE:
+            self.rebuild = True
+        elif filename == TASKS_FILE:
+            self.dirty_tasks.update(record_id for record_id, _, _ in event["changes"])
+        elif filename == FLOWS_FILE:
+            self.dirty_flows.update(record_id for record_id, _, _ in event["changes"])
+        else:
+            self.links_changed = True
+        self.versions[filename] = event["version"]
+
+    def refresh(self, tenant):
+        if not (self.rebuild or self.dirty_tasks or self.dirty_flows or self.links_changed):
+            return
+        tasks = record_map(TASKS_FILE, tenant)
+        link_index = get_link_index(tenant)
+        if self.rebuild:
+            stale = set(tasks) | set(self.entries)
+        else:
+            stale = set(self.dirty_tasks)
+            stale.update(task_id for task_id, entry in self.entries.items() if entry["flow_id"] in self.dirty_flows)
+            if self.links_changed:
+                stale.update(task_id for task_id, entry in self.entries.items() if entry["flow_id"] != link_index.flow_for_task(task_id))
+        for task_id in stale:
+            task = tasks.get(task_id)
+            if task is None:
+                self.entries.pop(task_id, None)
+                continue
+            flow_id = link_index.flow_for_task(task_id)
+            self.entries[task_id] = task_schedule_entry(task, load_flow(flow_id, tenant) if flow_id else None)
+        self.dirty_tasks.clear()
+        self.dirty_flows.clear()
+        self.links_changed = self.rebuild = False
+        self.generation += 1
+        self._calendars.clear()
+
+    def calendar(self, start, weeks):
+        """start の週から weeks 週分の負荷表（同じ条件の結果は業務が変わるまで再利用する）"""
+        start = week_start(start)
+        key = (start, weeks)
+        if key not in self._calendars:
+            templates = {}
+            people = {}
+            person_rows, template_rows, minutes = [], [], []
+            for entry in self.entries.values():
+                if entry["frequency"] is None:
+                    continue
+                template_row = templates.setdefault(entry["frequency"], len(templates))
+                for person, person_minutes in entry["load"].items():
+                    person_rows.append(people.setdefault(person, len(people)))
+                    template_rows.append(template_row)
+                    minutes.append(person_minutes)
+            occurrences = np.array(
+                [weekly_occurrences(period, times, start, weeks) for period, times in templates] or np.zeros((0, weeks)),
+                dtype=float
+            )
+            person_rows, template_rows, minutes = np.array(person_rows, dtype=np.int64), np.array(template_rows, dtype=np.int64), np.array(minutes, dtype=float)
+            load = np.zeros((len(people), weeks))
+            for template_row in range(len(templates)):
+                selected = template_rows == template_row
+                load += np.outer(np.bincount(person_rows[selected], minutes[selected], minlength=len(people)), occurrences[template_row])
+            self._calendars[key] = WorkloadCalendar(list(people), start, load)
+        return self._calendars[key]
+
+    def occurrences(self, task_id, start, end):
+        entry = self.entries.get(task_id)
+        if not entry or entry["frequency"] is None:
+            return np.array([], dtype="datetime64[D]")
+        return occurrence_dates(*entry["frequency"], start, end)
+
+SCHEDULE_FILES = (TASKS_FILE, FLOWS_FILE, LINKS_FILE)
+
+def get_workload_schedule(tenant=None):
+    """ワークスペースの業務カレンダー。参照時に変更された業務の分だけ更新する"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    with get_tenant_registry().lock(tenant):
+        schedule = datasets.get("index:schedule")
+        if schedule is None:
+            schedule = WorkloadSchedule({filename: get_dataset_bus().version(tenant, filename) for filename in SCHEDULE_FILES})
+            datasets["index:schedule"] = schedule
+        schedule.refresh(tenant)
+    return schedule
+
+def on_schedule_affected(tenant, filename, event):
+    """業務・フロー・リンクの書き込みを業務カレンダーに通知するバス購読者"""
+    if filename not in SCHEDULE_FILES:
+        return
+    schedule = get_tenant_registry().datasets(tenant).get("index:schedule")
+    if schedule is not None:
+        schedule.notify(filename, event)
+
+# 監査ログ（誰がいつどのレコードのどの項目を変更したかを月ごとの追記型ログに記録する）
+AUDIT_DIR = "audit"
+AUDIT_FILES = (TASKS_FILE, SKILLS_FILE, ORG_FILE, FLOWS_FILE)
+AUDIT_OPERATION_LABELS = {"create": "追加", "update": "変更", "delete": "削除", "replace": "一括置換"}
+
+def audit_entry(filename, record_id, old, new, at, user):
+    """1レコードの変更を監査ログの1行にする
+
+    追加は変更後の全項目、削除は変更前の全項目、変更は値が変わった項目だけを before/after に持つ。
+    フローは項目ではなくノード・接続の構造差分を持つ（内容の復元はフローのバージョン履歴から行う）。
+    """
+    entry = {"at": at, "user": user, "file": filename, "id": record_id}
+    if old is None:
+        entry["op"] = "create"
+    elif new is None:
+        entry["op"] = "delete"
+    else:
+        entry["op"] = "update"
+    if filename == FLOWS_FILE:
+        entry["name"] = (new or old).get("flow_name", "")
+        if entry["op"] == "update":
+            entry["delta"] = compute_flow_delta(old, new)
+        return entry
+    if entry["op"] == "create":
+        entry["after"] = new
+    elif entry["op"] == "delete":
+        entry["before"] = old
+    else:
+        fields = [field for field in dict.fromkeys([*old, *new]) if old.get(field, ...) != new.get(field, ...)]
+        entry["before"] = {field: old[field] for field in fields if field in old}
+        entry["after"] = {field: new[field] for field in fields if field in new}
+    return entry
+
+def undo_audit_entry(record, entry):
+    """entry の変更を取り消した、変更前のレコードを返す"""
+    if entry["op"] == "create":
+        return None
+    if entry["op"] == "delete":
+        return dict(entry["before"])
+    record = dict(record or {})
+    for field in dict.fromkeys([*entry["before"], *entry["after"]]):
+        if field in entry["before"]:
+            record[field] = entry["before"][field]
+        else:
+            record.pop(field, None)
+    return record
+
+class AuditLog:
+    """ワークスペースの監査ログ（audit/YYYY-MM.jsonl）と、その時刻索引・レコード索引
+
+    ログは追記のみで、時刻索引は追記順（= 時刻順）の (時刻, 位置) の配列、
+    レコード索引は (データセット, ID) ごとの時刻索引上の位置のリスト。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sizes = {}  # セグメント名 -> 索引済みのバイト数
+        self.times = []
+        self.locations = []  # 時刻索引と同じ順の (セグメント名, オフセット)
+        self.records = {}  # (filename, record_id) -> [時刻索引上の位置, ...]
+
+    def _index_line(self, segment, offset, entry):
+        position = len(self.times)
+        self.times.append(entry["at"])
+        self.locations.append((segment, offset))
+        if "id" in entry:
+            self.records.setdefault((entry["file"], entry["id"]), []).append(position)
+
+    def refresh(self):
+        """前回索引した位置以降に追記された行だけを索引する"""
+        if not os.path.isdir(self.directory):
+            return
+        segments = sorted(name for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+        if any(os.path.getsize(os.path.join(self.directory, name)) < size for name, size in self.sizes.items()):
+            self.__init__(self.directory)  # 作り直されたログは索引し直す
+        for segment in segments:
+            path = os.path.join(self.directory, segment)
+            size = self.sizes.get(segment, 0)
+            if os.path.getsize(path) == size:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(size)
+                for line in f:
+                    self._index_line(segment, size, json.loads(line))
+                    size += len(line)
+            self.sizes[segment] = size
+
+    def append(self, entries):
+        """エントリを追記する（呼び出し元がワークスペースのロックを持つこと）"""
+        self.refresh()
+        os.makedirs(self.directory, exist_ok=True)
+        by_segment = {}
+        for entry in entries:
+            by_segment.setdefault(entry["at"][:7] + ".jsonl", []).append(entry)
+        for segment, segment_entries in sorted(by_segment.items()):
+            offset = self.sizes.get(segment, 0)
+            lines = [json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for entry in segment_entries]
+            with open(os.path.join(self.directory, segment), 'ab') as f:
+                f.write(b"".join(lines))
+            for entry, line in zip(segment_entries, lines):
+                self._index_line(segment, offset, entry)
+                offset += len(line)
+            self.sizes[segment] = offset
+
+    def read(self, positions):
+        """時刻索引上の位置のエントリを読み込む（同じセグメントはまとめて開く）"""
+        positions = list(positions)
+        entries = {}
+        by_segment = {}
+        for position in positions:
+            segment, offset = self.locations[position]
+            by_segment.setdefault(segment, []).append((offset, position))
+        for segment, offsets in by_segment.items():
+            with open(os.path.join(self.directory, segment), 'rb') as f:
+                for offset, position in sorted(offsets):
+                    f.seek(offset)
+                    entries[position] = dict(json.loads(f.readline()), position=position)
+        return [entries[position] for position in positions]
+
+    def since(self, at):
+        """時刻 at（ISO形式）以降のエントリの位置（古い順）"""
+        return range(bisect.bisect_left(self.times, at), len(self.times))
+
+    def history(self, filename, record_id):
+        return self.read(self.records.get((filename, record_id), []))
+
+    def record_ids(self, filename):
+        return [record_id for (file, record_id) in self.records if file == filename]
+
+def get_audit_log(tenant=None):
+    """ワークスペースの監査ログ（索引はワークスペースのキャッシュに保持し、追記分だけ読み足す）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    with get_tenant_registry().lock(tenant):
+        audit_log = datasets.get("index:audit")
+        if audit_log is None:
+            audit_log = datasets["index:audit"] = AuditLog(os.path.join(tenant_dir(tenant), AUDIT_DIR))
+        audit_log.refresh()
+    return audit_log
+
+def on_audit_event(tenant, filename, event):
+    """書き込みを監査ログに記録するバス購読者"""
+    if filename not in AUDIT_FILES:
+        return
+    at = datetime.now().isoformat()
+    user = current_user()
+    if event["changes"] is None:
+        entries = [{"at": at, "user": user, "file": filename, "op": "replace"}]
+    else:
+        entries = [audit_entry(filename, record_id, old, new, at, user) for record_id, old, new in event["changes"]]
+        if filename == FLOWS_FILE:
+            for entry in entries:  # on_flows_written が先に記録したバージョン番号を控えておく
+                versions = load_flow_history(entry["id"], tenant)
+                if versions:
+                    entry["version"] = versions[-1]["version"]
+    with get_tenant_registry().lock(tenant):
+        get_audit_log(tenant).append(entries)
+
+def record_at(filename, record_id, position, before=False, tenant=None):
+    """レコードの履歴上の位置 position の変更の直後（before=True なら直前）の状態（存在しなければ None）
+
+    現在のレコードから、それより後の変更を新しい順に取り消して求める。
+    フローはエントリに控えたバージョン番号でバージョン履歴から取り出す。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    audit_log = get_audit_log(tenant)
+    if filename == FLOWS_FILE:
+        (entry,) = audit_log.read([position])
+        version = entry.get("version", 0) - (1 if before else 0)
+        return checkout_flow(record_id, version, tenant) if version > 0 else None
+    record = record_map(filename, tenant).get(record_id)
+    later = [p for p in audit_log.records.get((filename, record_id), []) if p > position or before and p == position]
+    for entry in reversed(audit_log.read(later)):
+        record = undo_audit_entry(record, entry)
+    return record
+
+def restore_record(filename, record_id, position, before=False, tenant=None):
+    """レコードを履歴上の指定時点の状態に戻す（その時点で存在しなければ削除する）"""
+    record = record_at(filename, record_id, position, before, tenant)
+    if filename == FLOWS_FILE:
+        return write_flows([(record_id, updated_flow(record) if record else None)], tenant)
+    return write_records(filename, [(record_id, record)], tenant)
+
+def describe_audit_entry(entry):
+    """監査ログのエントリを1行の説明にする"""
+    if entry["op"] == "replace":
+        return f"{DATASET_LABELS[entry['file']]}を一括で置き換え"
+    record = entry.get("after") or entry.get("before") or {}
+    name = entry.get("name") or record.get("業務名") or record.get("業務") or record.get("スキル分野") or ""
+    text = f"{DATASET_LABELS[entry['file']]}「{name or entry['id']}」を{AUDIT_OPERATION_LABELS[entry['op']]}"
+    if entry["op"] == "update" and entry["file"] != FLOWS_FILE:
+        text += "：" + "、".join(
+            f"{field} {entry['before'].get(field, '')} → {entry['after'].get(field, '')}"
+            for field in dict.fromkeys([*entry["before"], *entry["after"]])
+        )
+    elif entry["op"] == "update":
+        delta = entry.get("delta", {})
+        parts = [
+            f"{label}{len(delta.get(kind, {}).get(action, []))}件"
+            for kind, action, label in (("nodes", "added", "ノード追加"), ("nodes", "removed", "ノード削除"), ("nodes", "changed", "ノード変更"),
+                                        ("connections", "added", "接続追加"), ("connections", "removed", "接続削除"))
+            if delta.get(kind, {}).get(action)
+        ] + [f"{field}を変更" for field in delta.get("fields", {}) if field != "metadata"]
+        if parts:
+            text += "：" + "、".join(parts)
+    return text
+
+# 絞り込み（ファセット）用の索引
+FACET_FIELDS = {
+    ORG_FILE: ["グループ", "部門", "課・係", "担当者", "重要度"],
+    TASKS_FILE: ["部門", "担当者", "重要度", "頻度"],
+    SKILLS_FILE: ["現在レベル", "目標レベル"],
+}
+FACET_MISSING = "（未設定）"
+
+def facet_values(field, cell):
+    """1セルが属するファセット値（担当者は複数人の記載をそれぞれの人に分解する）"""
+    if field == "担当者":
+        return assignee_people(cell) or {FACET_MISSING}
+    return {str(cell) if cell not in (None, "") else FACET_MISSING}
+
+class FacetIndex:
+    """スナップショットの行位置に対するファセット索引
+
+    項目ごとに (行位置, 値コード) の組を numpy 配列で持ち、選択条件は行数分の真偽値マスク（ビットマップ）で扱う。
+    複数項目の AND と、各項目の件数（自分以外の項目の条件だけを適用した件数）をいずれも配列演算で求める。
+    """
+
+    def __init__(self, snapshot, fields):
+        self.size = len(snapshot)
+        self.fields = fields
+        self._values = {}
+        self._codes = {}
+        self._rows = {}
+        self._pair_codes = {}
+        for field in fields:
+            codes = {}
+            rows, pair_codes = [], []
+            for row, cell in enumerate(snapshot.column(field)):
+                for value in facet_values(field, cell):
+                    rows.append(row)
+                    pair_codes.append(codes.setdefault(value, len(codes)))
+            self._values[field] = list(codes)
+            self._codes[field] = codes
+            self._rows[field] = np.array(rows, dtype=np.int64)
+            self._pair_codes[field] = np.array(pair_codes, dtype=np.int64)
+
+    def values(self, field):
+        return sorted(self._values[field])
+
+    def field_mask(self, field, selected):
+        """1項目分の条件マスク（未選択なら None = 全件）"""
+        if not selected:
+            return None
+        codes = [self._codes[field][value] for value in selected if value in self._codes[field]]
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self._rows[field][np.isin(self._pair_codes[field], codes)]] = True
+        return mask
+
+    def masks(self, selections):
+        return {field: self.field_mask(field, selections.get(field)) for field in self.fields}
+
+    def match(self, selections, base=None):
+        mask = np.ones(self.size, dtype=bool) if base is None else base.copy()
+        for field_mask in self.masks(selections).values():
+            if field_mask is not None:
+                mask &= field_mask
+        return mask
+
+    def counts(self, selections, base=None):
+        """項目ごとの {値: 件数}。その項目自身の選択は件数に影響させない"""
+        masks = self.masks(selections)
+        result = {}
+        for field in self.fields:
+            other = np.ones(self.size, dtype=bool) if base is None else base.copy()
+            for other_field, field_mask in masks.items():
+                if other_field != field and field_mask is not None:
+                    other &= field_mask
+            counts = np.bincount(self._pair_codes[field][other[self._rows[field]]], minlength=len(self._values[field]))
+            result[field] = dict(zip(self._values[field], counts.tolist()))
+        return result
+
+    def positions(self, selections, base=None):
+        return np.flatnonzero(self.match(selections, base)).tolist()
+
+def get_facet_index(filename, tenant=None):
+    """データセットのファセット索引（スナップショットが作り直されるまでキャッシュ）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    snapshot = get_snapshot(filename, tenant)
+    return snapshot, cached_index(
+        tenant, f"facets:{filename}", snapshot.source_mtime_ns,
+        lambda: FacetIndex(snapshot, FACET_FIELDS[filename])
+    )
+
+def render_facet_filters(filename, key, search_field=None, search_term=""):
+    """ファセットの絞り込みUIを表示し、(スナップショット, 一致した行位置) を返す"""
+    snapshot, index = get_facet_index(filename)
+    base = None
+    if search_term:
+        base = np.array([search_term.lower() in str(name).lower() for name in snapshot.column(search_field)], dtype=bool)
+    selections = {field: st.session_state.get(f"{key}_{field}", []) for field in index.fields}
+    counts = index.counts(selections, base)
+    for column, field in zip(st.columns(len(index.fields)), index.fields):
+        with column:
+            options = index.values(field) + [value for value in selections[field] if value not in counts[field]]
+            selections[field] = st.multiselect(
+                field, options, key=f"{key}_{field}",
+                format_func=lambda value, field=field: f"{value} ({counts[field].get(value, 0)})"
+            )
+    return snapshot, index.positions(selections, base)
+
+def paginate(positions, key):
+    """一致した行位置のうち、表示するページの分だけを返す"""
+    page_count = max((len(positions) - 1) // LIST_PAGE_SIZE + 1, 1)
+    if st.session_state.get(key, 1) > page_count:
+        st.session_state[key] = page_count
+    list_page = st.number_input(f"ページ（全{page_count}ページ・{len(positions)}件）", min_value=1, max_value=page_count, value=1, key=key) if page_count > 1 else 1
+    return positions[(list_page - 1) * LIST_PAGE_SIZE:list_page * LIST_PAGE_SIZE]
+
+def render_record_picker(filename, key, name_field, label):
+    """編集するレコードを検索・ファセット・ページで絞り込んで1件選ぶ（選んだ行だけを復号して返す。なければ None）"""
+    search_term = st.text_input(f"🔍 {label}を検索", key=f"{key}_search")
+    snapshot, positions = render_facet_filters(filename, f"{key}_facet", name_field, search_term)
+    page_positions = paginate(positions, f"{key}_page")
+    if not page_positions:
+        st.info("条件に一致するデータはありません")
+        return None
+    ids = snapshot.cells(page_positions, "id")
+    names = dict(zip(ids, snapshot.cells(page_positions, name_field)))
+    record_id = st.selectbox(f"編集する{label}", ids, format_func=lambda record_id: f"{names[record_id]}（{record_id}）", key=f"{key}_selected")
+    return snapshot.rows([page_positions[ids.index(record_id)]])[0]
+
+# 組織・業務の一括操作（選択したIDの変更を1回の書き込みにまとめる）
+def update_records(filename, record_ids, update, tenant=None):
+    """指定したIDのレコードに update(record) の結果を反映する（変わらないレコードは書き込まない）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        records = record_map(filename, tenant)
+        changes = []
+        for record_id in record_ids:
+            if record_id in records and (new := update(records[record_id])) != records[record_id]:
+                changes.append((record_id, new))
+        return write_records(filename, changes, tenant)
+
+def delete_records(filename, record_ids, tenant=None):
+    return write_records(filename, [(record_id, None) for record_id in record_ids], tenant)
+
+def replace_assignee(value, old_person, new_person):
+    """担当者欄の old_person を new_person に置き換える（区切り文字はそのまま、重複した人は1人にまとめる）"""
+    parts = re.split(f"({ASSIGNEE_SEPARATOR.pattern})", str(value or ""))
+    seen = set()
+    result = []
+    for i, part in enumerate(parts):
+        if i % 2:  # 区切り文字
+            result.append(part)
+            continue
+        token = new_person if part == old_person else part
+        if token and token in seen:
+            if result:
+                result.pop()
+            continue
+        seen.add(token)
+        result.append(token)
+    return "".join(result).strip("・、,，/／ ")
+
+def reassign_records(filename, record_ids, old_person, new_person, tenant=None):
+    return update_records(
+        filename, record_ids,
+        lambda record: {**record, "担当者": replace_assignee(record.get("担当者"), old_person, new_person)}, tenant
+    )
+
+def move_org_entries(record_ids, group, department, subdivision=None, tenant=None):
+    """組織エントリを別のグループ・部門の下へ移動する（subdivision が None なら課・係はそのまま）"""
+    def move(record):
+        moved = {**record, "グループ": group, "部門": department}
+        if subdivision is not None:
+            moved["課・係"] = subdivision
+        return moved
+    return update_records(ORG_FILE, record_ids, move, tenant)
+
+def rename_department(old_name, new_name, group=None, include_tasks=True, tenant=None):
+    """部門名を組織データ（と業務辞書）でまとめて変更する。group を指定するとそのグループ内だけ"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    rename = lambda record: {**record, "部門": new_name}
+    org_ids = [
+        org_id for org_id, org in record_map(ORG_FILE, tenant).items()
+        if org.get("部門") == old_name and (group is None or org.get("グループ") == group)
+    ]
+    applied = update_records(ORG_FILE, org_ids, rename, tenant)
+    if include_tasks:
+        task_ids = [task_id for task_id, task in record_map(TASKS_FILE, tenant).items() if task.get("部門") == old_name]
+        applied += update_records(TASKS_FILE, task_ids, rename, tenant)
+    return applied
+
+# 類似業務の検出（文字 n-gram の MinHash + LSH）と統合
+DEDUP_FILES = {TASKS_FILE: ("業務名", "説明"), ORG_FILE: ("業務", None)}
+DEDUP_PERMUTATIONS = 64
+DEDUP_BANDS = 16
+DEDUP_ROWS = DEDUP_PERMUTATIONS // DEDUP_BANDS
+DEDUP_HASH_SEED = 20240601
+DEDUP_EMPTY = np.iinfo(np.uint32).max
+DEDUP_MAX_CLUSTER_SIZE = 20
+
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+def normalize_text(text):
+    """全角半角・大文字小文字・空白や記号の違いを吸収する"""
+    return NON_WORD_PATTERN.sub("", unicodedata.normalize("NFKC", str(text or "")).lower())
+
+def text_shingles(text, size):
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash_signatures(shingle_sets):
+    """各集合の MinHash 署名（行数 × DEDUP_PERMUTATIONS の uint32 配列。空集合の行は最大値）
+
+    シングルの語彙ごとに置換（乗算シフトハッシュの上位32ビット）を一度だけ計算し、
+    置換ごとに集合単位の最小値を reduceat で取る。
+    """
+    rng = np.random.default_rng(DEDUP_HASH_SEED)
+    multipliers = rng.integers(1, 2 ** 63, DEDUP_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+    offsets = rng.integers(0, 2 ** 63, DEDUP_PERMUTATIONS, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), DEDUP_PERMUTATIONS), DEDUP_EMPTY, dtype=np.uint32)
+    vocabulary = {}
+    codes = [vocabulary.setdefault(shingle, len(vocabulary)) for shingles in shingle_sets for shingle in shingles]
+    if not codes:
+        return signatures
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in vocabulary], dtype=np.uint64)
+    permuted = ((multipliers[:, None] * hashes[None, :] + offsets[:, None]) >> np.uint64(32)).astype(np.uint32)
+    codes = np.array(codes, dtype=np.int64)
+    rows = np.array([row for row, shingles in enumerate(shingle_sets) if shingles], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum([len(shingle_sets[row]) for row in rows[:-1]], dtype=np.int64)])
+    for k in range(DEDUP_PERMUTATIONS):
+        signatures[rows, k] = np.minimum.reduceat(permuted[k][codes], starts)
+    return signatures
+
+class DuplicateIndex:
+    """業務辞書と組織データの名前・説明の MinHash 署名と、LSH による重複候補のクラスタ"""
+
+    def __init__(self, records):
+        self.records = records  # [(filename, record_id, 名前, 説明)]
+        descriptions = [text_shingles(description, 3) for _, _, _, description in records]
+        self.name_signatures = minhash_signatures([text_shingles(name, 2) for _, _, name, _ in records])
+        self.description_signatures = minhash_signatures(descriptions)
+        self.has_name = self.name_signatures[:, 0] != DEDUP_EMPTY
+        self.has_description = np.array([bool(shingles) for shingles in descriptions], dtype=bool)
+        self.rows = {(filename, record_id): row for row, (filename, record_id, _, _) in enumerate(records)}
+        self._clusters = {}
+
+    def similarity(self, left, right):
+        """名前の推定 Jaccard 係数と、両方に説明があれば説明の推定 Jaccard 係数の大きい方"""
+        name = np.where(
+            self.has_name[left] & self.has_name[right],
+            (self.name_signatures[left] == self.name_signatures[right]).mean(axis=-1), 0.0
+        )
+        description = (self.description_signatures[left] == self.description_signatures[right]).mean(axis=-1)
+        return np.where(self.has_description[left] & self.has_description[right], np.maximum(name, description), name)
+
+    def candidate_pairs(self, signatures, valid):
+        """同じバンドのバケットに入った行を、そのバケットの先頭の行と組にする（バケット内の全組は作らない）"""
+        rows = np.flatnonzero(valid)
+        pairs = [np.zeros((0, 2), dtype=np.int64)]
+        if len(rows) < 2:
+            return pairs[0]
+        weights = np.uint64(0x9E3779B97F4A7C15) ** np.arange(DEDUP_ROWS, dtype=np.uint64)
+        for band in range(DEDUP_BANDS):
+            band_rows = signatures[rows, band * DEDUP_ROWS:(band + 1) * DEDUP_ROWS].astype(np.uint64)
+            keys = (band_rows * weights).sum(axis=1, dtype=np.uint64)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            is_first = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+            first_of_group = order[np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))]
+            pairs.append(np.stack([rows[first_of_group[~is_first]], rows[order[~is_first]]], axis=1))
+        return np.concatenate(pairs)
+
+    def clusters(self, threshold):
+        """重複クラスタ（2件以上のもの、大きい順）
+
+        候補の組を連結すると似たもの同士が連鎖して巨大なクラスタになるため、類似度が threshold 以上の組が多い
+        レコードから順に中心とし、中心との類似度が threshold 以上のまだ割り当てていないレコードだけを
+        類似度の高い順に DEDUP_MAX_CLUSTER_SIZE 件までまとめる（先頭が中心）。
+        """
+        if threshold in self._clusters:
+            return self._clusters[threshold]
+        pairs = np.concatenate([
+            self.candidate_pairs(self.name_signatures, self.has_name),
+            self.candidate_pairs(self.description_signatures, self.has_description),
+        ])
+        size = np.int64(len(self.records))
+        encoded = np.unique(pairs[:, 0].astype(np.int64) * size + pairs[:, 1])
+        pairs = np.stack([encoded // size, encoded % size], axis=1)
+        scores = self.similarity(pairs[:, 0], pairs[:, 1]) if len(pairs) else np.zeros(0)
+        neighbors = {}
+        for (left, right), score in zip(pairs[scores >= threshold].tolist(), scores[scores >= threshold].tolist()):
+            if left != right:
+                neighbors.setdefault(left, {})[right] = score
+                neighbors.setdefault(right, {})[left] = score
+        assigned = set()
+        clusters = []
+        for center in sorted(neighbors, key=lambda row: (-len(neighbors[row]), row)):
+            if center in assigned:
+                continue
+            members = sorted((row for row in neighbors[center] if row not in assigned), key=lambda row: (-neighbors[center][row], row))
+            members = members[:DEDUP_MAX_CLUSTER_SIZE - 1]
+            if members:
+                assigned.update([center, *members])
+                clusters.append([center, *members])
+        self._clusters[threshold] = sorted(clusters, key=lambda rows: (-len(rows), rows[0]))
+        return self._clusters[threshold]
+
+    def similar_members(self, canonical, members, threshold):
+        """members のうち canonical との類似度が threshold 以上のもの（canonical 自身は除く）"""
+        rows = [self.rows[member] for member in members if member != canonical]
+        scores = self.similarity(self.rows[canonical], np.array(rows, dtype=np.int64)) if rows else []
+        return [self.records[row][:2] for row, score in zip(rows, scores) if score >= threshold]
+
+def get_duplicate_index(tenant=None):
+    """類似業務の索引（業務辞書・組織データが更新されるまでキャッシュ）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    def build():
+        records = []
+        for filename, (name_field, description_field) in DEDUP_FILES.items():
+            for record in load_data(filename, tenant):
+                records.append((filename, record["id"], record.get(name_field, ""), record.get(description_field, "") if description_field else ""))
+        return DuplicateIndex(records)
+    return cached_index(tenant, "duplicates", (dataset_version(tenant, TASKS_FILE), dataset_version(tenant, ORG_FILE)), build)
+
+def merge_assignees(*values):
+    """担当者欄をまとめる（記載の順序を保ち、同じ人は1人にする）"""
+    entries = {}
+    for value in values:
+        for entry in PERSON_SEPARATOR.split(str(value or "")):
+            if entry:
+                entries.setdefault(entry.rsplit("・", 1)[-1], entry)
+    return "、".join(entries.values())
+
+def merge_duplicates(canonical, duplicates, tenant=None):
+    """重複候補を canonical の (filename, record_id) に統合する
+
+    同じデータセットの重複は担当者を canonical にまとめて削除し、重複を参照していたリンクを canonical に付け替える。
+    別のデータセットのレコード（業務辞書 ↔ 組織データ）は削除せず canonical とリンクする。
+    戻り値は実際に反映された (record_id, 変更前, 変更後) のリスト。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    canonical_file, canonical_id = canonical
+    with get_tenant_registry().lock(tenant):
+        records = record_map(canonical_file, tenant)
+        if canonical_id not in records:
+            return []
+        same = [record_id for filename, record_id in duplicates if filename == canonical_file and record_id != canonical_id and record_id in records]
+        other = [record_id for filename, record_id in duplicates if filename != canonical_file]
+        # 削除するとリンクが外れるため、先にリンクを canonical へ付け替える
+        index = get_link_index(tenant)
+        index.dirty = False
+        if canonical_file == TASKS_FILE:
+            for record_id in same:
+                for org_id in index.orgs_for_task(record_id):
+                    index.link_org(org_id, task_id=canonical_id)
+                if index.flow_for_task(canonical_id) is None and index.flow_for_task(record_id) is not None:
+                    index.link_task(canonical_id, index.flow_for_task(record_id))
+            for org_id in other:
+                index.link_org(org_id, task_id=canonical_id)
+        else:
+            for record_id in same:
+                link = index.org_links.get(record_id, {})
+                for key in ("task_id", "flow_id"):
+                    if index.org_links.get(canonical_id, {}).get(key) is None and link.get(key) is not None:
+                        index.link_org(canonical_id, **{key: link[key]})
+            if other and index.task_for_org(canonical_id) is None:
+                index.link_org(canonical_id, task_id=other[0])
+        if index.dirty:
+            save_link_index(tenant, index)
+        merged = {**records[canonical_id], "担当者": merge_assignees(*(records[record_id].get("担当者") for record_id in [canonical_id] + same))}
+        changes = [(canonical_id, merged)] if merged != records[canonical_id] else []
+        return write_records(canonical_file, changes + [(record_id, None) for record_id in same], tenant)
+
+# データ整合性チェック（全データセットを1パスで検証し、安全に直せるものは自動修復する）
+IMPORTANCE_LEVELS = ["★☆☆", "★★☆", "★★★"]
+SKILL_LEVEL_RANGE = (1, 5)
+RECORD_FIELDS = {
+    ORG_FILE: ["グループ", "部門", "課・係", "業務", "担当者", "重要度"],
+    TASKS_FILE: ["業務名", "部門", "説明", "工数", "頻度", "重要度", "担当者"],
+    SKILLS_FILE: ["スキル分野", "現在レベル", "目標レベル", "経験業務数"],
+}
+RECORD_DEFAULTS = {"現在レベル": SKILL_LEVEL_RANGE[0], "目標レベル": SKILL_LEVEL_RANGE[0], "経験業務数": 0}
+REQUIRED_FIELDS = {ORG_FILE: "業務", TASKS_FILE: "業務名", SKILLS_FILE: "スキル分野"}
+RECORD_ID_PREFIXES = {ORG_FILE: "org", TASKS_FILE: "task", SKILLS_FILE: "skill"}
+INTEGRITY_FILES = (TASKS_FILE, FLOWS_FILE, SKILLS_FILE, ORG_FILE, LINKS_FILE)
+INTEGRITY_LEVEL_LABELS = {"error": "エラー", "warning": "警告"}
+
+def importance_index(value):
+    """重要度の選択肢での位置（想定外の値なら先頭）"""
+    return IMPORTANCE_LEVELS.index(value) if value in IMPORTANCE_LEVELS else 0
+
+def normalize_importance(value):
+    """「★★」「2」などの表記を3段階の重要度に直す（判別できなければ None）"""
+    if value in IMPORTANCE_LEVELS:
+        return value
+    text = unicodedata.normalize("NFKC", str(value or "")).strip()
+    if text.isdigit() and 1 <= int(text) <= len(IMPORTANCE_LEVELS):
+        return IMPORTANCE_LEVELS[int(text) - 1]
+    if text and set(text) <= {"★", "☆"} and 1 <= text.count("★") <= len(IMPORTANCE_LEVELS):
+        return IMPORTANCE_LEVELS[text.count("★") - 1]
+    return None
+
+def integer_value(value):
+    """数値や数値の文字列を整数に直す（直せなければ None）"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(unicodedata.normalize("NFKC", str(value)).strip())
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else None
+
+def clamp_integer(value, minimum, maximum=None):
+    """整数に直して範囲内に収める（直せなければ minimum）"""
+    number = integer_value(value)
+    if number is None:
+        return minimum
+    return max(minimum, number if maximum is None else min(maximum, number))
+
+def integrity_issue(filename, record_id, location, message, level="error", repairable=False):
+    return {
+        "dataset": filename, "record": record_id, "level": level,
+        "location": location, "message": message, "repairable": repairable,
+    }
+
+def inspect_record(filename, record):
+    """1レコードを検証して (修復後のレコード, 問題のリスト) を返す（IDの重複はデータセット単位で見る）"""
+    record_id = record.get("id")
+    location = f"{DATASET_LABELS[filename]} {record_id}"
+    repaired = dict(record)
+    issues = []
+    for field in RECORD_FIELDS[filename]:
+        if repaired.get(field) is None:
+            repaired[field] = RECORD_DEFAULTS.get(field, "")
+            issues.append(integrity_issue(filename, record_id, f"{location} / {field}", "項目がありません", repairable=True))
+    if not str(repaired[REQUIRED_FIELDS[filename]]).strip():
+        issues.append(integrity_issue(filename, record_id, f"{location} / {REQUIRED_FIELDS[filename]}", "必須項目が空です"))
+    if filename == SKILLS_FILE:
+        low, high = SKILL_LEVEL_RANGE
+        for field, minimum, maximum in (("現在レベル", low, high), ("目標レベル", low, high), ("経験業務数", 0, None)):
+            if integer_value(repaired[field]) is None:
+                issues.append(integrity_issue(filename, record_id, f"{location} / {field}", f"数値ではありません: {repaired[field]!r}"))
+                continue
+            number = clamp_integer(repaired[field], minimum, maximum)
+            if number != repaired[field]:
+                issues.append(integrity_issue(
+                    filename, record_id, f"{location} / {field}", f"範囲外または文字列の値です: {repaired[field]!r} → {number}", repairable=True
+                ))
+                repaired[field] = number
+    else:
+        importance = normalize_importance(repaired["重要度"])
+        if importance is None:
+            issues.append(integrity_issue(filename, record_id, f"{location} / 重要度", f"重要度が不正です: {repaired['重要度']!r}"))
+        elif importance != repaired["重要度"]:
+            issues.append(integrity_issue(
+                filename, record_id, f"{location} / 重要度", f"重要度の表記が不正です: {repaired['重要度']!r} → {importance}", repairable=True
+            ))
+            repaired["重要度"] = importance
+    return repaired, issues
+
+def inspect_records(filename, records):
+    """データセット全体を1パスで検証する。IDの欠落・重複は新しいIDを振って直す"""
+    allocated = None
+    seen = set()
+    repaired_records = []
+    issues = []
+    for position, record in enumerate(records):
+        if not isinstance(record, dict):
+            issues.append(integrity_issue(
+                filename, None, f"{DATASET_LABELS[filename]} {position + 1}件目", "形式が不正なレコードを取り除きます", repairable=True
+            ))
+            continue
+        record_id = record.get("id")
+        if record_id in seen or not record_id:
+            if allocated is None:
+                next_id = next_record_id(records, RECORD_ID_PREFIXES[filename])
+                allocated = int(next_id.rsplit("_", 1)[1])
+            new_id = f"{RECORD_ID_PREFIXES[filename]}_{allocated:03d}"
+            allocated += 1
+            issues.append(integrity_issue(
+                filename, record_id, f"{DATASET_LABELS[filename]} {position + 1}件目",
+                f"IDが{'重複' if record_id else '未設定'}です: {record_id!r} → {new_id}", repairable=True
+            ))
+            record = {**record, "id": new_id}
+        seen.add(record["id"])
+        repaired, record_issues = inspect_record(filename, record)
+        repaired_records.append(repaired)
+        issues += record_issues
+    return repaired_records, issues
+
+def inspect_flow(flow, flow_ids=None):
+    """フローを検証して (修復後のフロー, 問題のリスト) を返す
+
+    存在しないノードへの接続と重複した接続は削除し、数値でない・負の予想時間は分に読み直して（読めなければ 0）直す。
+    それ以外は validate_flow_structure の結果を報告する。
+    """
+    flow_id = flow.get("flow_id")
+    location = f"フロー {flow.get('flow_name') or flow_id}"
+    issues = []
+    nodes = []
+    repaired_nodes = []
+    for position, node in enumerate(flow.get("nodes", [])):
+        if not isinstance(node, dict) or not node.get("node_id"):
+            issues.append(integrity_issue(FLOWS_FILE, flow_id, f"{location} / ノード {position + 1}件目", "ノードIDがありません"))
+            repaired_nodes.append(node)
+            continue
+        value = node.get("estimated_time")
+        if "estimated_time" in node and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            minutes = round(step_minutes(node))
+            issues.append(integrity_issue(
+                FLOWS_FILE, flow_id, f"{location} / ノード {node['node_id']} / 予想時間",
+                f"予想時間が数値でないか負の値です: {value!r} → {minutes}", repairable=True
+            ))
+            node = {**node, "estimated_time": minutes}
+        nodes.append(node)
+        repaired_nodes.append(node)
+    node_ids = {node["node_id"] for node in nodes}
+    connections = []
+    seen = set()
+    for position, conn in enumerate(flow.get("connections", [])):
+        conn_location = f"{location} / 接続 {position + 1}件目（{conn.get('from')} → {conn.get('to')}）"
+        dangling = [str(conn.get(end)) for end in ("from", "to") if conn.get(end) not in node_ids]
+        if dangling:
+            issues.append(integrity_issue(
+                FLOWS_FILE, flow_id, conn_location, f"存在しないノードへの接続を削除します: {', '.join(dangling)}", repairable=True
+            ))
+        elif connection_key(conn) in seen:
+            issues.append(integrity_issue(FLOWS_FILE, flow_id, conn_location, "重複した接続を削除します", level="warning", repairable=True))
+        else:
+            seen.add(connection_key(conn))
+            connections.append(conn)
+    for issue in validate_flow_structure(nodes, connections, flow_ids=flow_ids):
+        issues.append(integrity_issue(FLOWS_FILE, flow_id, f"{location} / {issue['location']}", issue["message"], level=issue["level"]))
+    repaired = flow
+    if repaired_nodes != flow.get("nodes", []):
+        repaired = {**repaired, "nodes": repaired_nodes}
+    if len(connections) != len(flow.get("connections", [])):
+        repaired = {**repaired, "connections": connections}
+    return repaired, issues
+
+def inspect_links(links, org_ids, task_ids, flow_ids):
+    """業務リンクのうち、存在しない組織エントリ・業務・フローを指すものを検出して取り除く（ID集合が None なら確認しない）"""
+    links = links if isinstance(links, dict) else {}
+    repaired = {"org": {}, "task": {}}
+    issues = []
+    targets = {"task_id": ("業務", task_ids), "flow_id": ("フロー", flow_ids)}
+    for kind, sources, source_label in (("org", org_ids, "組織エントリ"), ("task", task_ids, "業務")):
+        for source_id, link in links.get(kind, {}).items():
+            location = f"業務リンク {source_label} {source_id}"
+            if sources is not None and source_id not in sources:
+                issues.append(integrity_issue(LINKS_FILE, source_id, location, f"存在しない{source_label}のリンクを削除します", repairable=True))
+                continue
+            kept = {}
+            for key, target in link.items():
+                label, target_ids = targets.get(key, (key, None))
+                if target is not None and target_ids is not None and target not in target_ids:
+                    issues.append(integrity_issue(LINKS_FILE, source_id, location, f"存在しない{label}へのリンクを削除します: {target}", repairable=True))
+                else:
+                    kept[key] = target
+            repaired[kind][source_id] = kept
+    return repaired, issues
+
+def inspect_dataset_bundle(bundle):
+    """インポートデータ（tasks / flows / skills / organization / links）をまとめて検証・修復する"""
+    repaired = dict(bundle)
+    issues = []
+    for key, filename in (("tasks", TASKS_FILE), ("skills", SKILLS_FILE), ("organization", ORG_FILE)):
+        if key in bundle:
+            repaired[key], record_issues = inspect_records(filename, bundle[key])
+            issues += record_issues
+    if "flows" in bundle:
+        flow_ids = {flow.get("flow_id") for flow in bundle["flows"]}
+        repaired["flows"] = []
+        for flow in bundle["flows"]:
+            repaired_flow, flow_issues = inspect_flow(flow, flow_ids)
+            repaired["flows"].append(repaired_flow)
+            issues += flow_issues
+    if "links" in bundle:
+        ids = lambda key, id_field="id": {record[id_field] for record in repaired[key]} if key in repaired else None
+        repaired["links"], link_issues = inspect_links(bundle["links"], ids("organization"), ids("tasks"), ids("flows", "flow_id"))
+        issues += link_issues
+    return repaired, issues
+
+class IntegrityReport:
+    """ワークスペースの整合性の問題をレコード単位で保持し、書き込みのたびに差分で更新する
+
+    組織・業務・スキル・フローは変更されたレコードだけを検証し直す。IDの重複とサブフローの参照切れは
+    件数表・参照表から求め、リンクと全体を置き換えた書き込みは参照時にそのデータセットだけ検証し直す。
+    """
 
-# データ保存・読み込み関数
-def save_data(filename, data):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    def __init__(self, versions):
+        self.versions = versions
+        self.issues = {filename: {} for filename in INTEGRITY_FILES}  # filename -> {record_id: [問題]}
+        self.id_counts = {filename: {} for filename in RECORD_FIELDS}
+        self.duplicates = {filename: set() for filename in RECORD_FIELDS}
+        self.subflow_refs = {}  # 参照先 flow_id -> {参照元 flow_id: [node_id]}
+        self.flow_ids = set()
+        self.stale = set(INTEGRITY_FILES)
+
+    def notify(self, filename, event):
+        if event["version"] != self.versions.get(filename, 0) + 1 or event["changes"] is None or filename == LINKS_FILE:
+            self.stale.add(filename)
+        elif self.duplicates.get(filename):
+            self.stale.add(filename)  # IDが重複している間はIDごとの変更からは件数を追えない
+        elif filename not in self.stale:
+            for record_id, old, new in event["changes"]:
+                self.apply_change(filename, record_id, old, new)
+        if filename in (ORG_FILE, TASKS_FILE, FLOWS_FILE):
+            self.stale.add(LINKS_FILE)
+        self.versions[filename] = event["version"]
+
+    def apply_change(self, filename, record_id, old, new):
+        if filename == FLOWS_FILE:
+            self._set_flow(record_id, old, new)
+            return
+        counts = self.id_counts[filename]
+        counts[record_id] = counts.get(record_id, 0) + (new is not None) - (old is not None)
+        if counts[record_id] > 1:
+            self.duplicates[filename].add(record_id)
+        else:
+            self.duplicates[filename].discard(record_id)
+            if counts[record_id] <= 0:
+                del counts[record_id]
+        self._set_issues(filename, record_id, inspect_record(filename, new)[1] if new is not None else [])
+
+    def _set_issues(self, filename, record_id, issues):
+        if issues:
+            self.issues[filename][record_id] = issues
+        else:
+            self.issues[filename].pop(record_id, None)
+
+    def _set_flow(self, flow_id, old, new):
+        for node in (old or {}).get("nodes", []):
+            if isinstance(node, dict) and node.get("subflow_id"):
+                self.subflow_refs.get(node["subflow_id"], {}).pop(flow_id, None)
+        for node in (new or {}).get("nodes", []):
+            if isinstance(node, dict) and node.get("type") == "subflow" and node.get("subflow_id"):
+                self.subflow_refs.setdefault(node["subflow_id"], {}).setdefault(flow_id, []).append(node.get("node_id"))
+        if new is None:
+            self.flow_ids.discard(flow_id)
+        else:
+            self.flow_ids.add(flow_id)
+        self._set_issues(FLOWS_FILE, flow_id, inspect_flow(new)[1] if new is not None else [])
+
+    def refresh(self, tenant):
+        """全体を置き換えた書き込みなどで古くなったデータセットだけを1パスで検証し直す"""
+        for filename in [filename for filename in INTEGRITY_FILES if filename in self.stale]:
+            self.issues[filename] = {}
+            if filename == FLOWS_FILE:
+                self.subflow_refs, self.flow_ids = {}, set()
+                for flow in load_all_flows(tenant):
+                    self._set_flow(flow["flow_id"], None, flow)
+            elif filename == LINKS_FILE:
+                for issue in inspect_links(load_data(LINKS_FILE, tenant), *(
+                    set(self.id_counts[file]) for file in (ORG_FILE, TASKS_FILE)
+                ), self.flow_ids)[1]:
+                    self.issues[LINKS_FILE].setdefault(issue["record"], []).append(issue)
+            else:
+                self.id_counts[filename], self.duplicates[filename] = {}, set()
+                for record in load_data(filename, tenant):
+                    self.apply_change(filename, record.get("id"), None, record)
+            self.stale.discard(filename)
+
+    def all_issues(self):
+        issues = [issue for by_record in self.issues.values() for record_issues in by_record.values() for issue in record_issues]
+        for filename, counts in self.id_counts.items():
+            missing = counts.get(None, 0) + counts.get("", 0)
+            if missing:
+                issues.append(integrity_issue(filename, None, DATASET_LABELS[filename], f"IDがないレコードがあります（{missing}件）", repairable=True))
+            for record_id in sorted(filter(None, self.duplicates[filename]), key=str):
+                issues.append(integrity_issue(
+                    filename, record_id, f"{DATASET_LABELS[filename]} {record_id}",
+                    f"IDが重複しています（{counts[record_id]}件）", repairable=True
+                ))
+        for target, sources in self.subflow_refs.items():
+            if target not in self.flow_ids:
+                for flow_id, node_ids in sources.items():
+                    issues += [
+                        integrity_issue(FLOWS_FILE, flow_id, f"フロー {flow_id} / ノード {node_id}", f"存在しないフローを参照しています: {target}")
+                        for node_id in node_ids
+                    ]
+        return issues
 
-def load_data(filename):
+def integrity_frame(issues):
+    """問題のリストを表示用の表にする"""
+    return pd.DataFrame([
+        {
+            "重大度": INTEGRITY_LEVEL_LABELS[issue["level"]],
+            "データ": DATASET_LABELS[issue["dataset"]],
+            "場所": issue["location"],
+            "内容": issue["message"],
+            "自動修復": "可" if issue["repairable"] else "",
+        }
+        for issue in issues
+    ], columns=["重大度", "データ", "場所", "内容", "自動修復"])
+
+def get_integrity_report(tenant=None):
+    """ワークスペースの整合性レポート（参照時に古くなったデータセットだけ検証し直す）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    datasets = get_tenant_registry().datasets(tenant)
+    with get_tenant_registry().lock(tenant):
+        report = datasets.get("index:integrity")
+        if report is None:
+            report = IntegrityReport({filename: get_dataset_bus().version(tenant, filename) for filename in INTEGRITY_FILES})
+            datasets["index:integrity"] = report
+        report.refresh(tenant)
+    return report
+
+def on_integrity_affected(tenant, filename, event):
+    """書き込みのたびに変更されたレコードを検証し直すバス購読者"""
+    if filename not in INTEGRITY_FILES:
+        return
+    report = get_tenant_registry().datasets(tenant).get("index:integrity")
+    if report is not None:
+        report.notify(filename, event)
+
+def repair_workspace(tenant=None):
+    """安全に直せる問題（項目の欠落・表記ゆれ・IDの欠落と重複・参照切れの接続とリンク）を一括で修復する
+
+    データセットごとに1回の書き込みにまとめ、修復した問題のリストを返す。
+    """
+    tenant = normalize_tenant(tenant or current_tenant())
+    with get_tenant_registry().lock(tenant):
+        bundle = {
+            "tasks": load_data(TASKS_FILE, tenant),
+            "skills": load_data(SKILLS_FILE, tenant),
+            "organization": load_data(ORG_FILE, tenant),
+            "flows": load_all_flows(tenant),
+            "links": load_data(LINKS_FILE, tenant),
+        }
+        repaired, issues = inspect_dataset_bundle(bundle)
+        for key, filename in (("tasks", TASKS_FILE), ("skills", SKILLS_FILE), ("organization", ORG_FILE)):
+            if repaired[key] != bundle[key]:
+                replace_records(filename, repaired[key], tenant)
+        write_flows([
+            (flow["flow_id"], updated_flow(flow)) for flow, original in zip(repaired["flows"], bundle["flows"]) if flow is not original
+        ], tenant)
+        if repaired["links"] != bundle["links"]:
+            save_data(LINKS_FILE, repaired["links"], tenant)
+    return [issue for issue in issues if issue["repairable"]]
+
+# 読み取り専用 JSON API（OPSMAP_API_PORT を指定すると Streamlit と同じプロセスで起動する）
+API_HOST = os.environ.get("OPSMAP_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("OPSMAP_API_PORT", "0"))
+API_DATASETS = {"org": (ORG_FILE, "業務"), "tasks": (TASKS_FILE, "業務名"), "skills": (SKILLS_FILE, "スキル分野")}
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_ROWS = 500
+API_RESERVED_PARAMS = {"page", "per_page", "q"}
+API_IMPACT_PARAMS = {"person": ("name",), "downstream": ("flow_id", "node_id"), "flows-through": ("label",)}
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def api_paging(params):
+    """page・per_page を検証する（per_page=0 は全件）"""
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+        page = int(params.get("page", ["1"])[-1])
+        per_page = int(params.get("per_page", [str(LIST_PAGE_SIZE)])[-1])
+    except ValueError:
+        raise APIError(400, "page と per_page は整数で指定してください")
+    if page < 1 or not 0 <= per_page <= API_MAX_PAGE_SIZE:
+        raise APIError(400, f"page は1以上、per_page は0〜{API_MAX_PAGE_SIZE}で指定してください")
+    return page, per_page
+
+def api_page(positions, page, per_page):
+    return positions if per_page == 0 else positions[(page - 1) * per_page:page * per_page]
+
+def query_snapshot(filename, name_field, params, tenant):
+    """クエリ条件に一致するスナップショットの行位置
+
+    q は名前の部分一致、それ以外のパラメータは項目名として扱い、同じ項目の複数指定は OR、項目間は AND。
+    ファセット対象の項目はファセット索引で、それ以外は列を復号して絞り込む。
+    """
+    if filename in FACET_FIELDS:
+        snapshot, index = get_facet_index(filename, tenant)
+    else:
+        snapshot, index = get_snapshot(filename, tenant), None
+    mask = np.ones(len(snapshot), dtype=bool)
+    for field, values in params.items():
+        if field in API_RESERVED_PARAMS:
+            continue
+        if field not in snapshot.column_names:
+            raise APIError(400, f"不明な項目です: {field}")
+        if index is not None and field in index.fields:
+            mask &= index.field_mask(field, values)
+        else:
+            mask &= np.isin(np.array([str(cell) for cell in snapshot.column(field)], dtype=object), values)
+    if params.get("q"):
+        term = params["q"][-1].lower()
+        mask &= np.array([term in str(name).lower() for name in snapshot.column(name_field)], dtype=bool)
+    return snapshot, np.flatnonzero(mask).tolist()
+
+def api_etag(tenant, versions, path, params):
+    """データセットのバージョンとリクエスト内容から ETag を作る"""
+    key = json.dumps([tenant, versions, path, sorted(params.items())], ensure_ascii=False, default=list)
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+
+class OpsMapAPIHandler(BaseHTTPRequestHandler):
+    """GET /api/workspaces
+    GET /api/<workspace>/{org,tasks,skills,flows}?page=&per_page=&q=&<項目>=<値>
+    GET /api/<workspace>/flows/<flow_id>
+    GET /api/<workspace>/impact/person?name=
+    GET /api/<workspace>/impact/downstream?flow_id=&node_id=
+    GET /api/<workspace>/impact/flows-through?label=
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        params = parse_qs(url.query)
+        try:
+            if parts[:1] != ["api"] or len(parts) < 2:
+                raise APIError(404, "見つかりません")
+            if parts[1:] == ["workspaces"]:
+                tenants = list_tenants()
+                return self.send_json(api_etag(None, tenants, url.path, {}), {"workspaces": tenants})
+            try:
+                tenant = normalize_tenant(parts[1])
+            except ValueError:
+                raise APIError(404, f"ワークスペースが見つかりません: {parts[1]}")
+            if tenant not in list_tenants():
+                raise APIError(404, f"ワークスペースが見つかりません: {tenant}")
+            if len(parts) == 3 and parts[2] in API_DATASETS:
+                self.send_dataset(tenant, parts[2], url.path, params)
+            elif len(parts) == 3 and parts[2] == "flows":
+                self.send_flow_list(tenant, url.path, params)
+            elif len(parts) == 4 and parts[2] == "flows":
+                self.send_flow(tenant, parts[3], url.path)
+            elif len(parts) == 4 and parts[2] == "impact":
+                self.send_impact(tenant, parts[3], url.path, params)
+            else:
+                raise APIError(404, "見つかりません")
+        except APIError as e:
+            self.send_json(None, {"error": str(e)}, status=e.status)
+
+    def send_dataset(self, tenant, dataset, path, params):
+        filename, name_field = API_DATASETS[dataset]
+        page, per_page = api_paging(params)
+        etag = api_etag(tenant, dataset_version(tenant, filename), path, params)
+        if self.not_modified(etag):
+            return
+        snapshot, positions = query_snapshot(filename, name_field, params, tenant)
+        rows = api_page(positions, page, per_page)
+        self.send_stream(
+            etag, {"workspace": tenant, "dataset": dataset, "total": len(positions), "page": page, "per_page": per_page},
+            (snapshot.rows(rows[start:start + API_STREAM_ROWS]) for start in range(0, len(rows), API_STREAM_ROWS))
+        )
+
+    def send_flow_list(self, tenant, path, params):
+        page, per_page = api_paging(params)
+        unknown = set(params) - API_RESERVED_PARAMS
+        if unknown:
+            raise APIError(400, f"不明な項目です: {', '.join(sorted(unknown))}")
+        etag = api_etag(tenant, dataset_version(tenant, FLOWS_FILE), path, params)
+        if self.not_modified(etag):
+            return
+        headers = load_flow_headers(tenant)
+        if params.get("q"):
+            term = params["q"][-1].lower()
+            headers = [header for header in headers if term in str(header.get("flow_name", "")).lower()]
+        self.send_stream(
+            etag, {"workspace": tenant, "dataset": "flows", "total": len(headers), "page": page, "per_page": per_page},
+            [api_page(headers, page, per_page)]
+        )
+
+    def send_flow(self, tenant, flow_id, path):
+        etag = api_etag(tenant, dataset_version(tenant, FLOWS_FILE), path, {})
+        if self.not_modified(etag):
+            return
+        flow = load_flow(flow_id, tenant) if flow_id in flow_header_map(tenant) else None
+        if flow is None:
+            raise APIError(404, f"フローが見つかりません: {flow_id}")
+        self.send_json(etag, flow)
+
+    def send_impact(self, tenant, query, path, params):
+        """影響分析の問い合わせ（get_impact_index の索引を引く。ステップにはステップ名を添える）"""
+        if query not in API_IMPACT_PARAMS:
+            raise APIError(404, "見つかりません")
+        required = API_IMPACT_PARAMS[query]
+        unknown = set(params) - set(required)
+        if unknown:
+            raise APIError(400, f"不明な項目です: {', '.join(sorted(unknown))}")
+        missing = [name for name in required if not params.get(name, [""])[-1].strip()]
+        if missing:
+            raise APIError(400, f"{', '.join(missing)} を指定してください")
+        values = {name: params[name][-1].strip() for name in required}
+        etag = api_etag(tenant, impact_index_version(tenant), path, params)
+        if self.not_modified(etag):
+            return
+        index = get_impact_index(tenant)
+        def labels(flow_id, node_ids):
+            return {node_id: index.node_label(flow_id, node_id) for node_id in node_ids}
+        if query == "person":
+            payload = index.person_impact(values["name"])
+            for step in payload["flow_steps"]:
+                step["labels"] = labels(step["flow_id"], step["node_ids"] + step["downstream"])
+        elif query == "downstream":
+            flow_id, node_id = values["flow_id"], values["node_id"]
+            if node_id not in index.flows.get(flow_id, {}).get("nodes", {}):
+                raise APIError(404, f"ステップが見つかりません: {flow_id}/{node_id}")
+            downstream = index.downstream(flow_id, node_id)
+            payload = {"flow_id": flow_id, "node_id": node_id, "downstream": downstream, "labels": labels(flow_id, [node_id, *downstream])}
+        else:
+            payload = {"label": values["label"], "flows": index.flows_through(values["label"])}
+            for match in payload["flows"]:
+                match["labels"] = labels(match["flow_id"], match["node_ids"])
+        self.send_json(etag, dict(payload, workspace=tenant))
+
+    def not_modified(self, etag):
+        """If-None-Match が一致すれば 304 を返す"""
+        tags = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]
+        if etag not in tags and "*" not in tags:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    def send_common_headers(self, etag):
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, no-cache")  # キャッシュは可、利用前に ETag で再検証
+
+    def send_json(self, etag, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_common_headers(etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, etag, meta, batches):
+        """一覧をチャンク転送で送る（items はバッチごとに復号・エンコードして書き出す）"""
+        self.send_response(200)
+        self.send_common_headers(etag)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.write_chunk(json.dumps(meta, ensure_ascii=False)[:-1] + ', "items": [')
+        separator = ""
+        for batch in batches:
+            if batch:
+                self.write_chunk(separator + ", ".join(json.dumps(item, ensure_ascii=False) for item in batch))
+                separator = ", "
+        self.write_chunk("]}")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def log_message(self, format, *args):
+        pass  # アクセスログは出さない
+
+@st.cache_resource
+def start_api_server(host, port):
+    """API サーバーをデーモンスレッドで起動する（ポートが使えなければ None）"""
+    try:
+        server = ThreadingHTTPServer((host, port), OpsMapAPIHandler)
+    except OSError:
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="opsmap-api", daemon=True).start()
+    return server
+
+def open_flow_in_builder(flow_id):
+    """FlowBuilderに遷移して指定フローを表示する（ボタンの on_click 用）"""
+    st.session_state.page = "FlowBuilder"
+    st.session_state.view_flow_id = flow_id
+
+def render_org_links(org_id):
+    """選択された組織エントリに紐づく業務とフローを表示"""
+    index = get_link_index()
+    org = record_map(ORG_FILE).get(org_id)
+    if not org:
+        return
+    task = record_map(TASKS_FILE).get(index.task_for_org(org_id))
+    flow = flow_header_map().get(index.flow_for_org(org_id))
+    
+    with st.container(border=True):
+        st.markdown(f"#### 📌 {org['業務']}（{org['部門']}・{org['担当者']}）")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**📚 業務辞書**")
+            if task:
+                st.write(f"**{task['業務名']}**（{task['部門']}）")
+                st.write(f"**説明**: {task['説明']}")
+                st.write(f"**工数**: {task['工数']} / **頻度**: {task['頻度']} / **担当者**: {task['担当者']}")
+            else:
+                st.caption("業務辞書に関連する業務が登録されていません")
+        with col2:
+            st.markdown("**🔄 FlowBuilder**")
+            if flow:
+                st.write(f"**{flow['flow_name']}**")
+                st.write(flow["description"])
+                st.button("🔄 FlowBuilderで開く", key=f"open_flow_{org_id}", on_click=open_flow_in_builder, args=(flow["flow_id"],))
+            else:
+                st.caption("関連するフローがありません")
+
+def change_mark(filename, record_id):
+    """他のユーザーが直近に更新したレコードに付ける目印"""
+    return "🔄 " if record_id in st.session_state.get("recent_changes", {}).get(filename, ()) else ""
 
 # 階層組織表示用のヘルパー関数
 def render_hierarchical_organization(org_data):
@@ -69,11 +3239,10 @@ def render_hierarchical_organization(org_data):
                         for i, task in enumerate(tasks):
                             with cols[i % 3]:
                                 if st.button(
-                                    f"📋 {task['業務']}\n👤 {task['担当者']}\n{task['重要度']}", 
+                                    f"{change_mark(ORG_FILE, task['id'])}📋 {task['業務']}\n👤 {task['担当者']}\n{task['重要度']}", 
                                     key=f"org_task_{task['id']}"
                                 ):
-                                    st.session_state.selected_task = task['業務']
-                                    st.info(f"選択された業務: {task['業務']}")
+                                    st.session_state.selected_org = task['id']
                     else:
                         # 課・係レベルの業務
                         with st.expander(f"📁 {subdiv_name}", expanded=False):
@@ -81,138 +3250,153 @@ def render_hierarchical_organization(org_data):
                             for i, task in enumerate(tasks):
                                 with cols[i % 3]:
                                     if st.button(
-                                        f"📋 {task['業務']}\n👤 {task['担当者']}\n{task['重要度']}", 
+                                        f"{change_mark(ORG_FILE, task['id'])}📋 {task['業務']}\n👤 {task['担当者']}\n{task['重要度']}", 
                                         key=f"org_task_sub_{task['id']}"
                                     ):
-                                        st.session_state.selected_task = task['業務']
-                                        st.info(f"選択された業務: {task['業務']}")
+                                        st.session_state.selected_org = task['id']
 
 # 階層フロー表示用のヘルパー関数
+FLOW_VIEW_CHUNK = 20
+FLOW_NODE_ICONS = {"start": "🚀", "end": "🏁", "decision": "❓", "subflow": "📦"}
+
+class FlowOutline:
+    """フローを開始ノードからの幅優先探索木として整理した表示用の構造
+
+    各ノードは最初に到達した経路の下に1回だけ置き、それ以外の接続（合流・差し戻し）は参照として持つ。
+    """
+
+    def __init__(self, flow):
+        self.flow_id = flow["flow_id"]
+        self.nodes = {node["node_id"]: node for node in flow.get("nodes", [])}
+        self.roots = [node_id for node_id, node in self.nodes.items() if node["type"] == "start"]
+        self.children = {node_id: [] for node_id in self.nodes}  # node_id -> [(子ノード, 条件)]
+        self.references = {node_id: [] for node_id in self.nodes}  # node_id -> [(既出ノード, 条件)]
+        edges = {node_id: [] for node_id in self.nodes}
+        for conn in flow.get("connections", []):
+            if conn.get("from") in edges and conn.get("to") in self.nodes:
+                edges[conn["from"]].append((conn["to"], conn.get("condition", "")))
+        order = list(self.roots)
+        placed = set(order)
+        for node_id in order:
+            for child, condition in edges[node_id]:
+                if child in placed:
+                    self.references[node_id].append((child, condition))
+                else:
+                    placed.add(child)
+                    order.append(child)
+                    self.children[node_id].append((child, condition))
+        self.sizes = {}
+        for node_id in reversed(order):
+            self.sizes[node_id] = 1 + sum(self.sizes[child] for child, _ in self.children[node_id])
+        self.unreachable = [node_id for node_id in self.nodes if node_id not in placed]
+
+def get_flow_outline(flow_id, tenant=None):
+    """フローの表示用構造（フローが更新されるまでキャッシュし、参照されたときに初めて読み込む）"""
+    tenant = normalize_tenant(tenant or current_tenant())
+    return cached_index(
+        tenant, f"outline:{flow_id}", dataset_version(tenant, FLOWS_FILE),
+        lambda: FlowOutline(flow) if (flow := load_flow(flow_id, tenant)) else None
+    )
+
+def toggle_flow_view(view_key):
+    expanded = st.session_state.setdefault("flow_view_expanded", set())
+    expanded.symmetric_difference_update({view_key})
+
 def render_hierarchical_flow(flow_data):
-    """階層構造でフローを表示"""
-    nodes = flow_data['nodes']
-    connections = flow_data['connections']
-    
-    # ノードをIDでマッピング
-    node_map = {node['node_id']: node for node in nodes}
-    
-    # 接続関係を解析
-    connection_map = {}
-    for conn in connections:
-        from_id = conn['from']
-        to_id = conn['to']
-        condition = conn.get('condition', '')
-        
-        if from_id not in connection_map:
-            connection_map[from_id] = []
-        connection_map[from_id].append({'to': to_id, 'condition': condition})
-    
-    # 開始ノードを見つける
-    start_nodes = [node for node in nodes if node['type'] == 'start']
-    if not start_nodes:
+    """階層構造でフローを表示（展開された範囲だけを描画し、サブフローは展開時に読み込む）"""
+    outline = get_flow_outline(flow_data["flow_id"])
+    if not outline.roots:
         st.error("開始ノードが見つかりません")
         return
     
     # フロー概要を表示
     st.markdown(f"### 📋 {flow_data['flow_name']}")
     st.markdown(f"**説明**: {flow_data['description']}")
-    
-    # 階層表示の開始
+    st.caption(f"全{len(outline.nodes)}ステップ。分岐・サブフローは ▶ で展開できます。")
     st.markdown("---")
     
-    def render_step_hierarchy(node_id, level=0, visited=None):
-        if visited is None:
-            visited = set()
-        
-        if node_id in visited or level > 15:  # 無限ループ防止
+    expanded = st.session_state.setdefault("flow_view_expanded", set())
+    
+    def render_node(outline, node_id, level):
+        node = outline.nodes[node_id]
+        indent = "　" * level
+        icon = FLOW_NODE_ICONS.get(node["type"], "📋")
+        if node["type"] in ["start", "end"]:
+            st.markdown(f"{indent}{icon} **{node['label']}**")
             return
-        
-        visited.add(node_id)
-        
-        if node_id not in node_map:
+        # <small> 以外はユーザーの入力なので HTML としては解釈させない
+        details = [f"👤 {html.escape(str(node['assigned_to']))}" if node.get("assigned_to") else "", f"⏱️ {step_minutes(node):g}分" if step_minutes(node) else ""]
+        line = f"{indent}{icon} **{html.escape(str(node['label']))}**　{'・'.join(d for d in details if d)}"
+        if node.get("description"):
+            line += f"  \n{indent}　<small>{html.escape(str(node['description']))}</small>"
+        st.markdown(line, unsafe_allow_html=True)
+    
+    def render_chain(outline, node_id, path, level, flow_stack):
+        """node_id から分岐までの一続きのステップを描画する（長い場合は FLOW_VIEW_CHUNK 件ごとに区切る）"""
+        indent = "　" * level
+        rendered = 0
+        while True:
+            render_node(outline, node_id, level)
+            node = outline.nodes[node_id]
+            if node["type"] == "subflow":
+                render_subflow(node, f"{path}>{node_id}", level, flow_stack)
+            for target, condition in outline.references[node_id]:
+                label = f"［{condition}］" if condition else ""
+                st.caption(f"{indent}　↪ {label}{outline.nodes[target]['label']} へ")
+            children = outline.children[node_id]
+            if len(children) == 1:
+                node_id = children[0][0]
+                rendered += 1
+                more_key = f"{path}+{node_id}"
+                if rendered >= FLOW_VIEW_CHUNK and more_key not in expanded:
+                    st.button(f"{indent}⏬ 続き（残り{outline.sizes[node_id]}ステップ）を表示", key=f"flow_view_{more_key}",
+                              on_click=toggle_flow_view, args=(more_key,))
+                    return
+                if rendered >= FLOW_VIEW_CHUNK:
+                    rendered = 0
+                continue
+            for branch_no, (child, condition) in enumerate(children, start=1):
+                branch_key = f"{path}/{child}"
+                is_open = branch_key in expanded
+                st.button(
+                    f"{indent}{'▼' if is_open else '▶'} 🔀 {condition or f'パス{branch_no}'}（{outline.sizes[child]}ステップ）",
+                    key=f"flow_view_{branch_key}", on_click=toggle_flow_view, args=(branch_key,)
+                )
+                if is_open:
+                    render_chain(outline, child, branch_key, level + 1, flow_stack)
             return
-        
-        node = node_map[node_id]
-        
-        # インデントレベルに応じたスタイル
+    
+    def render_subflow(node, path, level, flow_stack):
         indent = "　" * level
-        
-        # ノードタイプに応じたアイコンとスタイル
-        if node['type'] == 'start':
-            icon = "🚀"
-            style_class = "start-node"
-        elif node['type'] == 'end':
-            icon = "🏁"
-            style_class = "end-node"
-        elif node['type'] == 'decision':
-            icon = "❓"
-            style_class = "decision-node"
-        else:
-            icon = "📋"
-            style_class = "task-node"
-        
-        # ノード情報を階層表示
-        if node['type'] not in ['start', 'end']:
-            with st.expander(f"{indent}{icon} **{node['label']}**", expanded=True):
-                col1, col2 = st.columns([2, 1])
-                
-                with col1:
-                    st.write(f"**説明**: {node.get('description', 'なし')}")
-                    st.write(f"**担当者**: {node.get('assigned_to', 'なし')}")
-                    st.write(f"**予想時間**: {node.get('estimated_time', 'なし')}分")
-                
-                with col2:
-                    st.write(f"**タイプ**: {node['type']}")
-                    if node['type'] == 'decision':
-                        st.write("**分岐条件**:")
-                        if node_id in connection_map:
-                            for conn in connection_map[node_id]:
-                                condition = conn['condition'] if conn['condition'] else "デフォルト"
-                                next_node = node_map.get(conn['to'], {})
-                                next_label = next_node.get('label', 'Unknown')
-                                st.write(f"• {condition} → {next_label}")
-                
-                # 分岐がある場合の処理
-                if node_id in connection_map and len(connection_map[node_id]) > 1:
-                    st.markdown("**🔀 分岐パス:**")
-                    
-                    # 分岐ごとにタブを作成
-                    branch_tabs = []
-                    branch_connections = connection_map[node_id]
-                    
-                    for i, conn in enumerate(branch_connections):
-                        condition = conn['condition'] if conn['condition'] else f"パス{i+1}"
-                        branch_tabs.append(condition)
-                    
-                    if len(branch_tabs) > 1:
-                        tabs = st.tabs(branch_tabs)
-                        
-                        for i, (tab, conn) in enumerate(zip(tabs, branch_connections)):
-                            with tab:
-                                st.markdown(f"**条件**: {conn['condition'] if conn['condition'] else 'デフォルト'}")
-                                render_step_hierarchy(conn['to'], level + 1, visited.copy())
-                    else:
-                        # 単一接続の場合
-                        render_step_hierarchy(branch_connections[0]['to'], level + 1, visited.copy())
-                else:
-                    # 単一接続または接続なしの場合
-                    if node_id in connection_map:
-                        render_step_hierarchy(connection_map[node_id][0]['to'], level + 1, visited.copy())
-        else:
-            # start/endノードは簡潔に表示
-            st.markdown(f"{indent}{icon} **{node['label']}**")
-            if node_id in connection_map:
-                render_step_hierarchy(connection_map[node_id][0]['to'], level, visited.copy())
+        subflow_id = node.get("subflow_id")
+        is_open = path in expanded
+        header = flow_header_map().get(subflow_id)
+        if header is None:
+            st.warning(f"{indent}　参照先のフローが見つかりません: {subflow_id}")
+            return
+        st.button(f"{indent}　{'▼' if is_open else '▶'} サブフロー「{header['flow_name']}」",
+                  key=f"flow_view_{path}", on_click=toggle_flow_view, args=(path,))
+        if not is_open:
+            return
+        if subflow_id in flow_stack:
+            st.warning(f"{indent}　サブフローが循環して参照されています")
+            return
+        sub_outline = get_flow_outline(subflow_id)
+        for root in sub_outline.roots:
+            render_chain(sub_outline, root, f"{path}:{subflow_id}", level + 1, flow_stack + [subflow_id])
     
-    # 階層表示を開始
-    start_node = start_nodes[0]
-    render_step_hierarchy(start_node['node_id'])
+    for root in outline.roots:
+        render_chain(outline, root, outline.flow_id, 0, [outline.flow_id])
+    if outline.unreachable:
+        st.caption("開始ノードから到達できないステップ: " + "、".join(outline.nodes[node_id]["label"] for node_id in outline.unreachable))
 
 # データ初期化関数
 @st.cache_data
-def init_data_once():
+def init_data_once(tenant):
+    migrate_legacy_files(tenant)
+    
     # 業務データの初期化
-    if not os.path.exists(TASKS_FILE):
+    if not os.path.exists(data_path(TASKS_FILE, tenant)):
         initial_tasks = [
             {
                 "id": "task_001",
@@ -245,10 +3429,11 @@ def init_data_once():
                 "担当者": "伊藤"
             }
         ]
-        save_data(TASKS_FILE, initial_tasks)
+        save_data(TASKS_FILE, initial_tasks, tenant=tenant)
     
     # フローデータの初期化（階層分岐を含む例）
-    if not os.path.exists(FLOWS_FILE):
+    migrate_flows_file(tenant)
+    if not os.path.exists(data_path(FLOW_INDEX_FILE, tenant)):
         initial_flows = [
             {
                 "flow_id": "flow_001",
@@ -350,10 +3535,10 @@ def init_data_once():
                 }
             }
         ]
-        save_data(FLOWS_FILE, initial_flows)
+        write_flows([(flow["flow_id"], flow) for flow in initial_flows], tenant=tenant)
     
     # スキルデータの初期化
-    if not os.path.exists(SKILLS_FILE):
+    if not os.path.exists(data_path(SKILLS_FILE, tenant)):
         initial_skills = []
         skill_areas = ["経理業務", "人事業務", "総務業務", "営業業務", "情報システム", "マーケティング", "法務", "広報", "開発", "デザイン"]
         for i in range(1, 21): # 最低20個のスキルを生成
@@ -365,10 +3550,10 @@ def init_data_once():
                 "目標レベル": ((i + 2) % 5) + 1, # 1-5のレベルをランダムに設定
                 "経験業務数": (i % 10) + 1
             })
-        save_data(SKILLS_FILE, initial_skills)
+        save_data(SKILLS_FILE, initial_skills, tenant=tenant)
     
     # 組織データの初期化（階層構造対応）
-    if not os.path.exists(ORG_FILE):
+    if not os.path.exists(data_path(ORG_FILE, tenant)):
         initial_org = [
             # 経営管理グループ
             {"id": "org_001", "グループ": "経営管理グループ", "部門": "法務部", "課・係": "地方法律", "業務": "地方法令対応", "担当者": "田中", "重要度": "★★★"},
@@ -391,7 +3576,10 @@ def init_data_once():
             {"id": "org_014", "グループ": "技術グループ", "部門": "情報システム部", "課・係": "運用課", "業務": "システム運用", "担当者": "林", "重要度": "★★★"},
             {"id": "org_015", "グループ": "技術グループ", "部門": "情報システム部", "課・係": "", "業務": "IT戦略", "担当者": "清水", "重要度": "★★☆"}
         ]
-        save_data(ORG_FILE, initial_org)
+        save_data(ORG_FILE, initial_org, tenant=tenant)
+    
+    # 組織・業務・フローのリンク索引（未作成なら名前から初期リンクを作る）
+    get_link_index(tenant)
     
     return True
 
@@ -500,40 +3688,114 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# データ初期化
-init_data_once()
-
 # サイドバー
 st.sidebar.title("🏢 BackOps Guide")
 st.sidebar.markdown("---")
 
+# ワークスペース選択
+def add_tenant():
+    try:
+        tenant = normalize_tenant(st.session_state.get("new_tenant_name", ""))
+    except ValueError as e:
+        st.session_state.tenant_error = str(e)
+        return
+    tenant_dir(tenant)
+    st.session_state.tenant = tenant
+    st.session_state.new_tenant_name = ""
+    st.session_state.pop("tenant_error", None)
+
+tenants = list_tenants() or [DEFAULT_TENANT]
+if st.session_state.get("tenant") not in tenants:
+    st.session_state.tenant = DEFAULT_TENANT if DEFAULT_TENANT in tenants else tenants[0]
+st.sidebar.selectbox("ワークスペース", tenants, key="tenant")
+with st.sidebar.expander("➕ ワークスペースを追加", expanded=False):
+    st.text_input("ワークスペース名（英数字・_・-）", key="new_tenant_name")
+    st.button("作成", on_click=add_tenant)
+    if st.session_state.get("tenant_error"):
+        st.error(st.session_state.tenant_error)
+if not st.user.get("is_logged_in"):
+    st.sidebar.text_input("👤 ユーザー名（変更履歴に記録されます）", key="user_name")
+st.sidebar.markdown("---")
+
+# データ初期化
+init_data_once(current_tenant())
+if API_PORT:
+    start_api_server(API_HOST, API_PORT)
+
+# 他のセッションによる更新の検出
+st.session_state.recent_changes = {}
+for updated_file, updated_ids in sync_dataset_versions(current_tenant()).items():
+    if updated_ids is None:
+        st.toast(f"🔄 他のユーザーが{DATASET_LABELS[updated_file]}を更新しました")
+    else:
+        st.toast(f"🔄 他のユーザーが{DATASET_LABELS[updated_file]}を{len(updated_ids)}件更新しました")
+    st.session_state.recent_changes[updated_file] = updated_ids or set()
+
 # ナビゲーション
 page = st.sidebar.selectbox(
     "ページを選択",
-    ["ホーム", "OpsMap", "FlowBuilder", "業務辞書", "スキルマップ", "設定"]
+    ["ホーム", "OpsMap", "FlowBuilder", "業務辞書", "スキルマップ", "影響分析", "業務カレンダー", "変更履歴", "設定"],
+    key="page"
 )
 
+# 表示中のページが参照するデータセット（自動反映の監視対象）
+PAGE_DATASETS = {
+    "ホーム": list(HOME_FILES),
+    "OpsMap": [ORG_FILE],
+    "FlowBuilder": [FLOWS_FILE],
+    "業務辞書": [TASKS_FILE, ORG_FILE],
+    "スキルマップ": [SKILLS_FILE],
+    "影響分析": [FLOWS_FILE, TASKS_FILE, ORG_FILE],
+    "業務カレンダー": [TASKS_FILE, FLOWS_FILE],
+    "変更履歴": list(AUDIT_FILES),
+    "設定": [],
+}
+if st.sidebar.checkbox("🔄 他のユーザーの変更を自動反映", key="auto_refresh") and PAGE_DATASETS[page]:
+    watch_dataset_changes(current_tenant(), PAGE_DATASETS[page])
+
 # メイン画面
 if page == "ホーム":
     st.markdown("<h1 class=\"main-header\">🏠 ホーム</h1>", unsafe_allow_html=True)
     
+    home_stats = get_home_stats()
+    
+    metric_cols = st.columns(4)
+    metric_cols[0].metric("業務", home_stats.counts[TASKS_FILE])
+    metric_cols[1].metric("組織の業務", home_stats.counts[ORG_FILE])
+    metric_cols[2].metric("フロー", home_stats.counts[FLOWS_FILE])
+    metric_cols[3].metric("スキル", home_stats.counts[SKILLS_FILE])
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown("<div class=\"section-header\">📅 今週の業務予定</div>", unsafe_allow_html=True)
-        st.info("• 請求書発行（月末）\n• 月次決算準備\n• 新入社員研修")
+        due = home_stats.due_this_week(datetime.now().date())
+        if due:
+            lines = []
+            for period, tasks in due:
+                lines += [f"• {name}（{FREQUENCY_LABELS[period]}）" for name in list(tasks.values())[:HOME_LIST_SIZE]]
+                if len(tasks) > HOME_LIST_SIZE:
+                    lines.append(f"• ほか{FREQUENCY_LABELS[period]}の業務 {len(tasks) - HOME_LIST_SIZE}件")
+            st.info("\n".join(lines))
+        else:
+            st.info("今週予定されている定期業務はありません")
     
     with col2:
         st.markdown("<div class=\"section-header\">📊 スキル進捗</div>", unsafe_allow_html=True)
-        skills_data = load_data(SKILLS_FILE)
-        if skills_data:
-            for skill in skills_data[:3]: # ここはホーム画面の簡易表示なので3つに制限
-                level_stars = "★" * skill["現在レベル"] + "☆" * (5 - skill["現在レベル"])
-                st.success(f"• {skill['スキル分野']}: {level_stars}")
+        gaps = home_stats.largest_skill_gaps()
+        if gaps:
+            st.metric("目標に届いていないスキル", home_stats.skill_gap_count())
+            for name, gap in gaps:
+                st.warning(f"• {name}: あと{gap}レベル")
+        elif home_stats.counts[SKILLS_FILE]:
+            st.success("すべてのスキルが目標レベルに達しています")
     
     with col3:
         st.markdown("<div class=\"section-header\">🔔 通知</div>", unsafe_allow_html=True)
-        st.warning("• 属人化業務が3件検出されました\n• 新しい業務テンプレートが追加されました")
+        if home_stats.single_owner:
+            st.warning(f"• 属人化業務（重要度{HIGH_IMPORTANCE}・担当者1名）が{len(home_stats.single_owner)}件検出されました")
+        for flow_id, (flow_name, updated_at) in reversed(home_stats.recent_flows.items()):
+            st.info(f"• 「{flow_name}」が更新されました（{updated_at[:16].replace('T', ' ')}）")
 
 elif page == "OpsMap":
     st.markdown("<h1 class=\"main-header\">🗺️ OpsMap（組織構造）</h1>", unsafe_allow_html=True)
@@ -544,16 +3806,73 @@ elif page == "OpsMap":
     with tab1:
         st.markdown("<div class=\"section-header\">階層組織マップ</div>", unsafe_allow_html=True)
         
-        org_data = load_data(ORG_FILE)
+        org_snapshot, org_positions = render_facet_filters(ORG_FILE, "org_facet")
+        org_data = org_snapshot.rows(paginate(org_positions, "org_page"))
         if org_data:
-            # 階層表示を実行
+            # 階層表示を実行（絞り込みに一致した表示ページ分のみ）
             render_hierarchical_organization(org_data)
+        elif len(org_snapshot):
+            st.info("条件に一致する業務はありません")
+        
+        if st.session_state.get("selected_org"):
+            render_org_links(st.session_state.selected_org)
         
         st.info("💡 各業務をクリックすると、FlowBuilderで詳細なプロセスを確認できます。")
     
     with tab2:
         st.markdown("<div class=\"section-header\">組織データの追加・編集</div>", unsafe_allow_html=True)
         
+        # 一括操作（絞り込みで選んだエントリをまとめて変更）
+        with st.expander("🧰 一括操作", expanded=False):
+            bulk_snapshot, bulk_positions = render_facet_filters(ORG_FILE, "bulk_facet")
+            org_ids = bulk_snapshot.column("id")
+            excluded = set()
+            if len(bulk_positions) <= LIST_PAGE_SIZE * 10:
+                org_names = bulk_snapshot.column("業務")
+                labels = {org_ids[position]: f"{org_names[position]}（{org_ids[position]}）" for position in bulk_positions}
+                excluded = set(st.multiselect("対象から除外するエントリ", list(labels), key="bulk_exclude", format_func=labels.get))
+            selected_positions = [position for position in bulk_positions if org_ids[position] not in excluded]
+            selected_ids = [org_ids[position] for position in selected_positions]
+            st.write(f"**対象: {len(selected_ids)}件**")
+            if selected_ids:
+                st.dataframe(pd.DataFrame(bulk_snapshot.rows(selected_positions[:LIST_PAGE_SIZE])), hide_index=True)
+            
+            operation = st.radio("操作", ["👤 担当者の付け替え", "📦 移動", "✏️ 部門名の変更", "🗑️ 削除"], horizontal=True, key="bulk_operation")
+            with st.form("bulk_operation_form"):
+                if operation == "👤 担当者の付け替え":
+                    old_person = st.selectbox("元の担当者", get_facet_index(ORG_FILE)[1].values("担当者"))
+                    new_person = st.text_input("新しい担当者")
+                    include_tasks = st.checkbox("業務辞書の同じ担当者も付け替える")
+                elif operation == "📦 移動":
+                    move_group = st.text_input("移動先のグループ")
+                    move_dept = st.text_input("移動先の部門")
+                    move_subdept = st.text_input("課・係（空欄なら変更しない）")
+                elif operation == "✏️ 部門名の変更":
+                    old_dept = st.selectbox("変更する部門", get_facet_index(ORG_FILE)[1].values("部門"))
+                    new_dept = st.text_input("新しい部門名")
+                    include_tasks = st.checkbox("業務辞書の同じ部門名も変更する", value=True)
+                    st.caption("部門名の変更は絞り込みにかかわらず、その部門のすべてのエントリに反映されます")
+                else:
+                    confirm_delete = st.checkbox(f"対象の{len(selected_ids)}件を削除することを確認しました")
+                
+                if st.form_submit_button("実行"):
+                    applied = []
+                    if operation == "👤 担当者の付け替え" and new_person:
+                        applied = reassign_records(ORG_FILE, selected_ids, old_person, new_person)
+                        if include_tasks:
+                            task_ids = [task_id for task_id, task in record_map(TASKS_FILE).items() if old_person in assignee_people(task.get("担当者"))]
+                            applied += reassign_records(TASKS_FILE, task_ids, old_person, new_person)
+                    elif operation == "📦 移動" and move_group and move_dept:
+                        applied = move_org_entries(selected_ids, move_group, move_dept, move_subdept or None)
+                    elif operation == "✏️ 部門名の変更" and new_dept:
+                        applied = rename_department(old_dept, new_dept, include_tasks=include_tasks)
+                    elif operation == "🗑️ 削除" and confirm_delete:
+                        applied = delete_records(ORG_FILE, selected_ids)
+                    st.session_state.bulk_result = f"{len(applied)}件のデータを変更しました"
+                    st.rerun()
+            if st.session_state.get("bulk_result"):
+                st.success(st.session_state.pop("bulk_result"))
+        
         # 新規追加フォーム
         with st.expander("➕ 新しい組織データを追加", expanded=False):
             with st.form("add_org_form"):
@@ -562,12 +3881,12 @@ elif page == "OpsMap":
                 new_subdept = st.text_input("課・係名（例：地方法律）※任意")
                 new_task = st.text_input("業務名")
                 new_person = st.text_input("担当者")
-                new_importance = st.selectbox("重要度", ["★☆☆", "★★☆", "★★★"])
+                new_importance = st.selectbox("重要度", IMPORTANCE_LEVELS)
                 
                 if st.form_submit_button("追加"):
                     if new_group and new_dept and new_task and new_person:
                         org_data = load_data(ORG_FILE)
-                        new_id = f"org_{len(org_data) + 1:03d}"
+                        new_id = next_record_id(org_data, "org")
                         new_org = {
                             "id": new_id,
                             "グループ": new_group,
@@ -577,66 +3896,99 @@ elif page == "OpsMap":
                             "担当者": new_person,
                             "重要度": new_importance
                         }
-                        org_data.append(new_org)
-                        save_data(ORG_FILE, org_data)
+                        write_records(ORG_FILE, [(new_id, new_org)])
                         st.success("組織データが追加されました！")
                         st.rerun()
         
-        # 既存データの編集・削除
-        org_data = load_data(ORG_FILE)
-        if org_data:
-            st.subheader("既存データの編集・削除")
-            for i, org in enumerate(org_data):
-                with st.expander(f"📝 {org['グループ']} > {org['部門']} > {org.get('課・係', '')} - {org['業務']}", expanded=False):
-                    col1, col2 = st.columns([3, 1])
-                    
-                    with col1:
-                        with st.form(f"edit_org_form_{i}"):
-                            edit_group = st.text_input("グループ名", value=org["グループ"], key=f"group_{i}")
-                            edit_dept = st.text_input("部門名", value=org["部門"], key=f"dept_{i}")
-                            edit_subdept = st.text_input("課・係名", value=org.get("課・係", ""), key=f"subdept_{i}")
-                            edit_task = st.text_input("業務名", value=org["業務"], key=f"task_{i}")
-                            edit_person = st.text_input("担当者", value=org["担当者"], key=f"person_{i}")
-                            edit_importance = st.selectbox("重要度", ["★☆☆", "★★☆", "★★★"], 
-                                                         index=["★☆☆", "★★☆", "★★★"].index(org["重要度"]), key=f"imp_{i}")
-                            
-                            if st.form_submit_button("更新"):
-                                org_data[i] = {
-                                    "id": org["id"],
-                                    "グループ": edit_group,
-                                    "部門": edit_dept,
-                                    "課・係": edit_subdept,
-                                    "業務": edit_task,
-                                    "担当者": edit_person,
-                                    "重要度": edit_importance
-                                }
-                                save_data(ORG_FILE, org_data)
-                                st.success("データが更新されました！")
-                                st.rerun()
+        # 既存データの編集・削除（絞り込んだ中から選んだ1件だけを読み込んで編集する）
+        st.subheader("既存データの編集・削除")
+        org = render_record_picker(ORG_FILE, "edit_org", "業務", "組織データ")
+        if org:
+            link_index = get_link_index()
+            tasks_snapshot = get_snapshot(TASKS_FILE)
+            task_names = dict(zip(tasks_snapshot.column("id"), tasks_snapshot.column("業務名")))
+            flow_names = {flow_id: header["flow_name"] for flow_id, header in flow_header_map().items()}
+            st.markdown(f"**📝 {org.get('グループ', '')} > {org.get('部門', '')} > {org.get('課・係', '')} - {org.get('業務', '')}**")
+            col1, col2 = st.columns([3, 1])
+            
+            with col1:
+                with st.form(f"edit_org_form_{org['id']}"):
+                    edit_group = st.text_input("グループ名", value=org.get("グループ", ""), key=f"group_{org['id']}")
+                    edit_dept = st.text_input("部門名", value=org.get("部門", ""), key=f"dept_{org['id']}")
+                    edit_subdept = st.text_input("課・係名", value=org.get("課・係", ""), key=f"subdept_{org['id']}")
+                    edit_task = st.text_input("業務名", value=org.get("業務", ""), key=f"task_{org['id']}")
+                    edit_person = st.text_input("担当者", value=org.get("担当者", ""), key=f"person_{org['id']}")
+                    edit_importance = st.selectbox("重要度", IMPORTANCE_LEVELS, 
+                                                 index=importance_index(org.get("重要度")), key=f"imp_{org['id']}")
+                    linked_task = link_index.org_links.get(org["id"], {}).get("task_id")
+                    linked_flow = link_index.org_links.get(org["id"], {}).get("flow_id")
+                    task_options = [None] + list(task_names)
+                    flow_options = [None] + list(flow_names)
+                    edit_link_task = st.selectbox(
+                        "関連業務（業務辞書）", task_options,
+                        index=task_options.index(linked_task) if linked_task in task_names else 0,
+                        format_func=lambda task_id: "（なし）" if task_id is None else task_names[task_id],
+                        key=f"link_task_{org['id']}"
+                    )
+                    edit_link_flow = st.selectbox(
+                        "関連フロー（業務に紐づくフローより優先）", flow_options,
+                        index=flow_options.index(linked_flow) if linked_flow in flow_names else 0,
+                        format_func=lambda flow_id: "（なし）" if flow_id is None else flow_names[flow_id],
+                        key=f"link_flow_{org['id']}"
+                    )
                     
-                    with col2:
-                        if st.button("🗑️ 削除", key=f"delete_org_{i}"):
-                            org_data.pop(i)
-                            save_data(ORG_FILE, org_data)
-                            st.success("データが削除されました！")
-                            st.rerun()
+                    if st.form_submit_button("更新"):
+                        set_org_links(
+                            org["id"],
+                            edit_link_task if edit_link_task != linked_task else ...,
+                            edit_link_flow if edit_link_flow != linked_flow else ...
+                        )
+                        write_records(ORG_FILE, [(org["id"], {
+                            "id": org["id"],
+                            "グループ": edit_group,
+                            "部門": edit_dept,
+                            "課・係": edit_subdept,
+                            "業務": edit_task,
+                            "担当者": edit_person,
+                            "重要度": edit_importance
+                        })])
+                        st.success("データが更新されました！")
+                        st.rerun()
+            
+            with col2:
+                if st.button("🗑️ 削除", key=f"delete_org_{org['id']}"):
+                    write_records(ORG_FILE, [(org["id"], None)])
+                    st.success("データが削除されました！")
+                    st.rerun()
 
 elif page == "FlowBuilder":
     st.markdown("<h1 class=\"main-header\">🔄 FlowBuilder</h1>", unsafe_allow_html=True)
     
-    # タブで表示と編集を分ける
-    tab1, tab2 = st.tabs(["📊 フロー表示", "✏️ フロー編集"])
+    # タブで表示・編集・履歴を分ける
+    tab1, tab2, tab3 = st.tabs(["📊 フロー表示", "✏️ フロー編集", "🕘 バージョン履歴"])
+    
+    # フロー一覧はヘッダーのみを読み込み、本体は選択されたフローだけを読み込む
+    flow_headers = flow_header_map()
     
     with tab1:
-        flows_data = load_data(FLOWS_FILE)
-        
-        if flows_data:
-            # フロー選択
-            flow_names = [flow["flow_name"] for flow in flows_data]
-            selected_flow_name = st.selectbox("表示するフローを選択", flow_names)
+        if flow_headers:
+            # フロー選択（OpsMap・業務辞書から遷移した場合はそのフローを表示）
+            if st.session_state.get("view_flow_id") not in flow_headers:
+                st.session_state.view_flow_id = next(iter(flow_headers))
+            selected_flow_id = st.selectbox(
+                "表示するフローを選択", list(flow_headers),
+                format_func=lambda flow_id: flow_headers[flow_id]["flow_name"], key="view_flow_id"
+            )
             
             # 選択されたフローを表示
-            selected_flow = next(flow for flow in flows_data if flow["flow_name"] == selected_flow_name)
+            selected_flow = load_flow(selected_flow_id)
+            
+            # 関連する業務・組織
+            link_index = get_link_index()
+            related_tasks = [record_map(TASKS_FILE).get(task_id, {}).get("業務名", task_id) for task_id in link_index.tasks_for_flow(selected_flow_id)]
+            related_orgs = [f"{org['部門']}・{org['業務']}" for org_id in link_index.orgs_for_flow(selected_flow_id) if (org := record_map(ORG_FILE).get(org_id))]
+            if related_tasks or related_orgs:
+                st.caption(f"🔗 関連業務: {'、'.join(related_tasks) or 'なし'}　／　🗺️ 担当組織: {'、'.join(related_orgs) or 'なし'}")
             
             # 階層表示でフローを描画
             render_hierarchical_flow(selected_flow)
@@ -651,7 +4003,7 @@ elif page == "FlowBuilder":
                 st.info("接続が定義されていません")
             
             # JSON表示
-            with st.expander("📄 JSON構造を表示", expanded=False):
+            if st.toggle("📄 JSON構造を表示", key="show_flow_json"):
                 st.json(selected_flow)
     
     with tab2:
@@ -665,8 +4017,7 @@ elif page == "FlowBuilder":
                 
                 if st.form_submit_button("フローを作成"):
                     if new_flow_name and new_flow_desc:
-                        flows_data = load_data(FLOWS_FILE)
-                        new_flow_id = f"flow_{len(flows_data) + 1:03d}"
+                        new_flow_id = next_record_id(load_flow_headers(), "flow", id_field="flow_id")
                         new_flow = {
                             "flow_id": new_flow_id,
                             "flow_name": new_flow_name,
@@ -692,136 +4043,260 @@ elif page == "FlowBuilder":
                                 "updated_at": datetime.now().isoformat()
                             }
                         }
-                        flows_data.append(new_flow)
-                        save_data(FLOWS_FILE, flows_data)
+                        write_flows([(new_flow_id, new_flow)])
                         st.success("新しいフローが作成されました！")
                         st.rerun()
         
-        # 既存フローの編集
-        flows_data = load_data(FLOWS_FILE)
-        if flows_data:
+        # 一括インポート・エクスポート
+        with st.expander("📦 フローの一括インポート / エクスポート", expanded=False):
+            import_target = st.selectbox(
+                "取り込み先",
+                [None] + list(flow_headers),
+                format_func=lambda flow_id: "新しいフローとして作成" if flow_id is None else f"上書き: {flow_headers[flow_id]['flow_name']}",
+                key="import_target"
+            )
+            import_format = st.radio("形式", ["テキストDSL", "CSV（ノード表 + 接続リスト）"], horizontal=True, key="import_format")
+            
+            with st.form("bulk_import_flow_form"):
+                import_name = st.text_input("フロー名")
+                import_desc = st.text_area("フローの説明")
+                if import_format == "テキストDSL":
+                    dsl_text = st.text_area(
+                        "フロー定義",
+                        height=300,
+                        placeholder="start_1: start 開始\nstep_1: task 請求内容確認 @経理部・田中 30分 | 金額と内容を確認する\ndecision_1: decision 承認判定 @経理部長・山田 10分\nend_1: end 完了\nstart_1 -> step_1 -> decision_1\ndecision_1 -> end_1 [承認]\ndecision_1 -> step_1 [差し戻し]"
+                    )
+                else:
+                    nodes_csv = st.text_area("ノード表CSV", height=200, placeholder=",".join(FLOW_NODE_COLUMNS))
+                    edges_csv = st.text_area("接続リストCSV", height=150, placeholder=",".join(FLOW_EDGE_COLUMNS))
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    check_only = st.form_submit_button("🔍 検証のみ")
+                with col2:
+                    do_import = st.form_submit_button("📥 インポート")
+                
+                if check_only or do_import:
+                    if import_format == "テキストDSL":
+                        nodes, connections, issues = parse_flow_dsl(dsl_text)
+                    else:
+                        nodes, connections, issues = parse_flow_csv(nodes_csv, edges_csv)
+                    issues += validate_flow_structure(nodes, connections, flow_ids=flow_headers)
+                    st.caption(f"ノード {len(nodes)}件 / 接続 {len(connections)}件")
+                    valid = render_flow_issues(issues)
+                    if do_import:
+                        if not import_name and import_target is None:
+                            st.error("フロー名を入力してください")
+                        elif valid:
+                            target_flow = flow_headers.get(import_target, {})
+                            import_flow(
+                                import_name or target_flow["flow_name"],
+                                import_desc or target_flow.get("description", ""),
+                                nodes, connections, flow_id=import_target
+                            )
+                            st.success("フローをインポートしました！")
+                            st.rerun()
+            
+            if flow_headers:
+                st.markdown("**エクスポート**")
+                export_flow_id = st.selectbox("エクスポートするフロー", list(flow_headers), format_func=lambda flow_id: flow_headers[flow_id]["flow_name"], key="export_flow")
+                export_flow = load_flow(export_flow_id)
+                nodes_text, edges_text = export_flow_csv(export_flow)
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.download_button("📄 DSL", export_flow_dsl(export_flow), file_name=f"{export_flow['flow_id']}.txt", mime="text/plain")
+                with col2:
+                    st.download_button("📄 ノード表CSV", nodes_text, file_name=f"{export_flow['flow_id']}_nodes.csv", mime="text/csv")
+                with col3:
+                    st.download_button("📄 接続リストCSV", edges_text, file_name=f"{export_flow['flow_id']}_edges.csv", mime="text/csv")
+        
+        # 既存フローの編集（選択したフローだけを読み込んで編集する）
+        if flow_headers:
             st.subheader("既存フローの編集")
+            edit_flow_id = st.selectbox(
+                "編集するフロー", list(flow_headers),
+                format_func=lambda flow_id: flow_headers[flow_id]["flow_name"], key="edit_flow_id"
+            )
+            flow = load_flow(edit_flow_id)
             
-            for flow_idx, flow in enumerate(flows_data):
-                with st.expander(f"📝 {flow['flow_name']}", expanded=False):
-                    # フロー基本情報の編集
-                    with st.form(f"edit_flow_basic_{flow_idx}"):
-                        edit_flow_name = st.text_input("フロー名", value=flow["flow_name"], key=f"flow_name_{flow_idx}")
-                        edit_flow_desc = st.text_area("説明", value=flow["description"], key=f"flow_desc_{flow_idx}")
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("基本情報を更新"):
-                                flows_data[flow_idx]["flow_name"] = edit_flow_name
-                                flows_data[flow_idx]["description"] = edit_flow_desc
-                                flows_data[flow_idx]["metadata"]["updated_at"] = datetime.now().isoformat()
-                                save_data(FLOWS_FILE, flows_data)
-                                st.success("フロー情報が更新されました！")
-                                st.rerun()
-                        
-                        with col2:
-                            if st.form_submit_button("🗑️ フローを削除"):
-                                flows_data.pop(flow_idx)
-                                save_data(FLOWS_FILE, flows_data)
-                                st.success("フローが削除されました！")
-                                st.rerun()
+            if flow:
+                # フロー基本情報の編集
+                with st.form(f"edit_flow_basic_{edit_flow_id}"):
+                    edit_flow_name = st.text_input("フロー名", value=flow["flow_name"], key=f"flow_name_{edit_flow_id}")
+                    edit_flow_desc = st.text_area("説明", value=flow["description"], key=f"flow_desc_{edit_flow_id}")
                     
-                    # ノードの追加
-                    st.subheader("ノードの追加")
-                    with st.form(f"add_node_{flow_idx}"):
-                        node_label = st.text_input("ノード名", key=f"node_label_{flow_idx}")
-                        node_desc = st.text_area("説明", key=f"node_desc_{flow_idx}")
-                        node_type = st.selectbox("タイプ", ["task", "decision", "input", "output"], key=f"node_type_{flow_idx}")
-                        node_assigned = st.text_input("担当者", key=f"node_assigned_{flow_idx}")
-                        node_time = st.number_input("予想時間（分）", min_value=0, key=f"node_time_{flow_idx}")
-                        
-                        if st.form_submit_button("ノードを追加"):
-                            if node_label:
-                                new_node_id = f"step_{len([n for n in flow['nodes'] if n['type'] not in ['start', 'end']]) + 1}"
-                                new_node = {
-                                    "node_id": new_node_id,
-                                    "type": node_type,
-                                    "label": node_label,
-                                    "description": node_desc,
-                                    "assigned_to": node_assigned,
-                                    "estimated_time": node_time,
-                                    "position": {"x": 200, "y": 50}
-                                }
-                                flows_data[flow_idx]["nodes"].insert(-1, new_node)  # 最後のendノードの前に挿入
-                                flows_data[flow_idx]["metadata"]["updated_at"] = datetime.now().isoformat()
-                                save_data(FLOWS_FILE, flows_data)
-                                st.success("ノードが追加されました！")
-                                st.rerun()
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.form_submit_button("基本情報を更新"):
+                            write_flows([(edit_flow_id, updated_flow(
+                                flow, flow_name=edit_flow_name, description=edit_flow_desc
+                            ))])
+                            st.success("フロー情報が更新されました！")
+                            st.rerun()
                     
-                    # 接続の追加（分岐対応）
-                    st.subheader("接続の追加（分岐対応）")
-                    with st.form(f"add_connection_{flow_idx}"):
-                        # ノード選択肢を作成
-                        node_options = [f"{node['node_id']} ({node['label']})" for node in flow['nodes']]
-                        
-                        from_node = st.selectbox("接続元ノード", node_options, key=f"from_node_{flow_idx}")
-                        to_node = st.selectbox("接続先ノード", node_options, key=f"to_node_{flow_idx}")
-                        condition = st.text_input("分岐条件（例：承認、差し戻し、再提出）", key=f"condition_{flow_idx}")
-                        
-                        st.info("💡 分岐を作成するには、同じ接続元ノードから複数の接続を異なる条件で作成してください。")
-                        
-                        if st.form_submit_button("接続を追加"):
-                            if from_node and to_node:
-                                from_id = from_node.split(' ')[0]
-                                to_id = to_node.split(' ')[0]
-                                
-                                new_connection = {
-                                    "from": from_id,
-                                    "to": to_id
-                                }
-                                if condition:
-                                    new_connection["condition"] = condition
-                                
-                                flows_data[flow_idx]["connections"].append(new_connection)
-                                flows_data[flow_idx]["metadata"]["updated_at"] = datetime.now().isoformat()
-                                save_data(FLOWS_FILE, flows_data)
-                                st.success("接続が追加されました！")
-                                st.rerun()
+                    with col2:
+                        if st.form_submit_button("🗑️ フローを削除"):
+                            write_flows([(edit_flow_id, None)])
+                            st.success("フローが削除されました！")
+                            st.rerun()
+                
+                # ノードの追加
+                st.subheader("ノードの追加")
+                with st.form(f"add_node_{edit_flow_id}"):
+                    node_label = st.text_input("ノード名", key=f"node_label_{edit_flow_id}")
+                    node_desc = st.text_area("説明", key=f"node_desc_{edit_flow_id}")
+                    node_type = st.selectbox("タイプ", ["task", "decision", "input", "output", "subflow"], key=f"node_type_{edit_flow_id}")
+                    node_assigned = st.text_input("担当者", key=f"node_assigned_{edit_flow_id}")
+                    node_time = st.number_input("予想時間（分）", min_value=0, key=f"node_time_{edit_flow_id}")
+                    subflow_options = [None] + [flow_id for flow_id in flow_headers if flow_id != edit_flow_id]
+                    node_subflow = st.selectbox(
+                        "参照するフロー（タイプが subflow の場合）", subflow_options, key=f"node_subflow_{edit_flow_id}",
+                        format_func=lambda flow_id: "（なし）" if flow_id is None else flow_headers[flow_id]["flow_name"]
+                    )
+                    
+                    if st.form_submit_button("ノードを追加"):
+                        if node_type == "subflow" and node_subflow is None:
+                            st.error("サブフローとして参照するフローを選択してください")
+                        elif node_label:
+                            new_node_id = next_node_id(flow["nodes"])
+                            new_node = {
+                                "node_id": new_node_id,
+                                "type": node_type,
+                                "label": node_label,
+                                "description": node_desc,
+                                "assigned_to": node_assigned,
+                                "estimated_time": node_time,
+                                "position": {"x": 200, "y": 50}
+                            }
+                            if node_type == "subflow":
+                                new_node["subflow_id"] = node_subflow
+                            nodes = flow["nodes"][:-1] + [new_node] + flow["nodes"][-1:]  # 最後のendノードの前に挿入
+                            write_flows([(edit_flow_id, updated_flow(flow, nodes=nodes))])
+                            st.success("ノードが追加されました！")
+                            st.rerun()
+                
+                # 接続の追加（分岐対応）
+                st.subheader("接続の追加（分岐対応）")
+                with st.form(f"add_connection_{edit_flow_id}"):
+                    # ノード選択肢を作成
+                    node_options = [f"{node['node_id']} ({node['label']})" for node in flow['nodes']]
+                    
+                    from_node = st.selectbox("接続元ノード", node_options, key=f"from_node_{edit_flow_id}")
+                    to_node = st.selectbox("接続先ノード", node_options, key=f"to_node_{edit_flow_id}")
+                    condition = st.text_input("分岐条件（例：承認、差し戻し、再提出）", key=f"condition_{edit_flow_id}")
                     
-                    # 既存接続の管理
-                    if flow['connections']:
-                        st.subheader("既存接続の管理")
-                        for conn_idx, conn in enumerate(flow['connections']):
-                            col1, col2 = st.columns([3, 1])
-                            with col1:
-                                condition_text = f" (条件: {conn['condition']})" if conn.get('condition') else ""
-                                st.write(f"**{conn['from']}** → **{conn['to']}**{condition_text}")
-                            with col2:
-                                if st.button("🗑️", key=f"delete_conn_{flow_idx}_{conn_idx}"):
-                                    flows_data[flow_idx]["connections"].pop(conn_idx)
-                                    save_data(FLOWS_FILE, flows_data)
-                                    st.success("接続が削除されました！")
-                                    st.rerun()
+                    st.info("💡 分岐を作成するには、同じ接続元ノードから複数の接続を異なる条件で作成してください。")
+                    
+                    if st.form_submit_button("接続を追加"):
+                        if from_node and to_node:
+                            from_id = from_node.split(' ')[0]
+                            to_id = to_node.split(' ')[0]
+                            
+                            new_connection = {
+                                "from": from_id,
+                                "to": to_id
+                            }
+                            if condition:
+                                new_connection["condition"] = condition
+                            
+                            connections = flow["connections"] + [new_connection]
+                            write_flows([(edit_flow_id, updated_flow(flow, connections=connections))])
+                            st.success("接続が追加されました！")
+                            st.rerun()
+                
+                # 既存接続の管理
+                if flow['connections']:
+                    st.subheader("既存接続の管理")
+                    for conn_idx in paginate(range(len(flow['connections'])), f"conn_page_{edit_flow_id}"):
+                        conn = flow['connections'][conn_idx]
+                        col1, col2 = st.columns([3, 1])
+                        with col1:
+                            condition_text = f" (条件: {conn['condition']})" if conn.get('condition') else ""
+                            st.write(f"**{conn['from']}** → **{conn['to']}**{condition_text}")
+                        with col2:
+                            if st.button("🗑️", key=f"delete_conn_{edit_flow_id}_{conn_idx}"):
+                                connections = flow["connections"][:conn_idx] + flow["connections"][conn_idx + 1:]
+                                write_flows([(edit_flow_id, updated_flow(flow, connections=connections))])
+                                st.success("接続が削除されました！")
+                                st.rerun()
+
+    with tab3:
+        st.markdown("<div class=\"section-header\">バージョン履歴と差分</div>", unsafe_allow_html=True)
+        
+        if flow_headers:
+            history_flow = flow_headers[st.selectbox("フローを選択", list(flow_headers), format_func=lambda flow_id: flow_headers[flow_id]["flow_name"], key="history_flow")]
+            entries = load_flow_history(history_flow["flow_id"])
+            
+            if not entries:
+                st.info("このフローにはまだ編集履歴がありません")
+            else:
+                kind_labels = {"snapshot": "スナップショット", "delta": "差分", "deleted": "削除"}
+                version_labels = {e["version"]: f"v{e['version']}（{e['at'][:16].replace('T', ' ')}・{kind_labels[e['kind']]}）" for e in entries}
+                versions = list(version_labels)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    base_version = st.selectbox("比較元", versions, index=max(len(versions) - 2, 0), format_func=version_labels.get, key=f"diff_base_{history_flow['flow_id']}_{len(versions)}")
+                with col2:
+                    target_version = st.selectbox("比較先", versions, index=len(versions) - 1, format_func=version_labels.get, key=f"diff_target_{history_flow['flow_id']}_{len(versions)}")
+                
+                base_flow = checkout_flow(history_flow["flow_id"], base_version)
+                target_flow = checkout_flow(history_flow["flow_id"], target_version)
+                delta = compute_flow_delta(base_flow or {}, target_flow or {})
+                
+                st.graphviz_chart(flow_diff_dot(base_flow, target_flow))
+                st.caption("🟩 追加　🟥 削除　🟨 変更")
+                
+                node_delta = delta.get("nodes", {})
+                conn_delta = delta.get("connections", {})
+                col1, col2, col3 = st.columns(3)
+                col1.metric("追加ノード", len(node_delta.get("added", [])))
+                col2.metric("削除ノード", len(node_delta.get("removed", [])))
+                col3.metric("変更ノード", len(node_delta.get("changed", [])))
+                for _, conn in conn_delta.get("added", []):
+                    st.write(f"➕ **{conn['from']}** → **{conn['to']}** {conn.get('condition', '')}")
+                for from_id, to_id, condition in conn_delta.get("removed", []):
+                    st.write(f"➖ **{from_id}** → **{to_id}** {condition}")
+                for field, value in delta.get("fields", {}).items():
+                    if field != "metadata":
+                        st.write(f"✏️ {field}: {value}")
+                
+                if target_flow is not None and target_version != versions[-1]:
+                    if st.button(f"↩️ v{target_version} に戻す", key="restore_flow_version"):
+                        write_flows([(history_flow["flow_id"], updated_flow(target_flow))])
+                        st.success("フローを復元しました！")
+                        st.rerun()
 
 elif page == "業務辞書":
     st.markdown("<h1 class=\"main-header\">📚 業務辞書</h1>", unsafe_allow_html=True)
     
     # タブで表示と編集を分ける
-    tab1, tab2 = st.tabs(["📊 業務一覧", "✏️ 業務編集"])
+    tab1, tab2, tab3 = st.tabs(["📊 業務一覧", "✏️ 業務編集", "🧬 重複候補"])
     
     with tab1:
         # 業務検索
         search_term = st.text_input("🔍 業務を検索", placeholder="例: 請求書、経理、人事")
         
-        tasks_data = load_data(TASKS_FILE)
+        # 検索は業務名の列だけを復号して行い、ファセットの件数にも反映する
+        tasks_snapshot, matched_rows = render_facet_filters(TASKS_FILE, "task_facet", "業務名", search_term)
+        link_index = get_link_index()
+        flows_by_id = flow_header_map()
         
-        # 業務一覧表示
-        for task in tasks_data:
-            if not search_term or search_term.lower() in task["業務名"].lower():
-                with st.expander(f"📋 {task['業務名']} ({task['部門']})", expanded=False):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**説明**: {task['説明']}")
-                        st.write(f"**工数**: {task['工数']}")
-                        st.write(f"**担当者**: {task['担当者']}")
-                    with col2:
-                        st.write(f"**頻度**: {task['頻度']}")
-                        st.write(f"**重要度**: {task['重要度']}")
+        # 業務一覧表示（表示するページの行だけを復号する）
+        for task in tasks_snapshot.rows(paginate(matched_rows, "task_page")):
+            with st.expander(f"📋 {task['業務名']} ({task['部門']})", expanded=False):
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"**説明**: {task['説明']}")
+                    st.write(f"**工数**: {task['工数']}")
+                    st.write(f"**担当者**: {task['担当者']}")
+                with col2:
+                    st.write(f"**頻度**: {task['頻度']}")
+                    st.write(f"**重要度**: {task['重要度']}")
+                    linked_flow = flows_by_id.get(link_index.flow_for_task(task["id"]))
+                    if linked_flow:
+                        st.button(f"🔄 {linked_flow['flow_name']}を開く", key=f"task_flow_{task['id']}",
+                                  on_click=open_flow_in_builder, args=(linked_flow["flow_id"],))
     
     with tab2:
         st.markdown("<div class=\"section-header\">業務の追加・編集</div>", unsafe_allow_html=True)
@@ -834,13 +4309,13 @@ elif page == "業務辞書":
                 new_desc = st.text_area("説明")
                 new_time = st.text_input("工数")
                 new_freq = st.text_input("頻度")
-                new_importance = st.selectbox("重要度", ["★☆☆", "★★☆", "★★★"])
+                new_importance = st.selectbox("重要度", IMPORTANCE_LEVELS)
                 new_person = st.text_input("担当者")
                 
                 if st.form_submit_button("追加"):
                     if new_task_name and new_dept:
                         tasks_data = load_data(TASKS_FILE)
-                        new_id = f"task_{len(tasks_data) + 1:03d}"
+                        new_id = next_record_id(tasks_data, "task")
                         new_task = {
                             "id": new_id,
                             "業務名": new_task_name,
@@ -851,51 +4326,103 @@ elif page == "業務辞書":
                             "重要度": new_importance,
                             "担当者": new_person
                         }
-                        tasks_data.append(new_task)
-                        save_data(TASKS_FILE, tasks_data)
+                        write_records(TASKS_FILE, [(new_id, new_task)])
                         st.success("業務が追加されました！")
                         st.rerun()
         
-        # 既存業務の編集
-        tasks_data = load_data(TASKS_FILE)
-        if tasks_data:
-            st.subheader("既存業務の編集・削除")
-            for i, task in enumerate(tasks_data):
-                with st.expander(f"📝 {task['業務名']}", expanded=False):
-                    col1, col2 = st.columns([3, 1])
-                    
-                    with col1:
-                        with st.form(f"edit_task_form_{i}"):
-                            edit_name = st.text_input("業務名", value=task["業務名"], key=f"name_{i}")
-                            edit_dept = st.text_input("部門", value=task["部門"], key=f"dept_{i}")
-                            edit_desc = st.text_area("説明", value=task["説明"], key=f"desc_{i}")
-                            edit_time = st.text_input("工数", value=task["工数"], key=f"time_{i}")
-                            edit_freq = st.text_input("頻度", value=task["頻度"], key=f"freq_{i}")
-                            edit_importance = st.selectbox("重要度", ["★☆☆", "★★☆", "★★★"], 
-                                                         index=["★☆☆", "★★☆", "★★★"].index(task["重要度"]), key=f"imp_{i}")
-                            edit_person = st.text_input("担当者", value=task["担当者"], key=f"person_{i}")
-                            
-                            if st.form_submit_button("更新"):
-                                tasks_data[i] = {
-                                    "id": task["id"],
-                                    "業務名": edit_name,
-                                    "部門": edit_dept,
-                                    "説明": edit_desc,
-                                    "工数": edit_time,
-                                    "頻度": edit_freq,
-                                    "重要度": edit_importance,
-                                    "担当者": edit_person
-                                }
-                                save_data(TASKS_FILE, tasks_data)
-                                st.success("業務が更新されました！")
-                                st.rerun()
+        # 既存業務の編集（絞り込んだ中から選んだ1件だけを読み込んで編集する）
+        st.subheader("既存業務の編集・削除")
+        task = render_record_picker(TASKS_FILE, "edit_task", "業務名", "業務")
+        if task:
+            link_index = get_link_index()
+            flow_names = {flow_id: header["flow_name"] for flow_id, header in flow_header_map().items()}
+            flow_options = [None] + list(flow_names)
+            st.markdown(f"**📝 {task.get('業務名', '')}**")
+            col1, col2 = st.columns([3, 1])
+            
+            with col1:
+                with st.form(f"edit_task_form_{task['id']}"):
+                    edit_name = st.text_input("業務名", value=task.get("業務名", ""), key=f"name_{task['id']}")
+                    edit_dept = st.text_input("部門", value=task.get("部門", ""), key=f"dept_{task['id']}")
+                    edit_desc = st.text_area("説明", value=task.get("説明", ""), key=f"desc_{task['id']}")
+                    edit_time = st.text_input("工数", value=task.get("工数", ""), key=f"time_{task['id']}")
+                    edit_freq = st.text_input("頻度", value=task.get("頻度", ""), key=f"freq_{task['id']}")
+                    edit_importance = st.selectbox("重要度", IMPORTANCE_LEVELS, 
+                                                 index=importance_index(task.get("重要度")), key=f"imp_{task['id']}")
+                    edit_person = st.text_input("担当者", value=task.get("担当者", ""), key=f"person_{task['id']}")
+                    linked_flow = link_index.flow_for_task(task["id"])
+                    edit_link_flow = st.selectbox(
+                        "関連フロー", flow_options,
+                        index=flow_options.index(linked_flow) if linked_flow in flow_names else 0,
+                        format_func=lambda flow_id: "（なし）" if flow_id is None else flow_names[flow_id],
+                        key=f"task_link_flow_{task['id']}"
+                    )
                     
-                    with col2:
-                        if st.button("🗑️ 削除", key=f"delete_task_{i}"):
-                            tasks_data.pop(i)
-                            save_data(TASKS_FILE, tasks_data)
-                            st.success("業務が削除されました！")
-                            st.rerun()
+                    if st.form_submit_button("更新"):
+                        if edit_link_flow != linked_flow:
+                            set_task_flow_link(task["id"], edit_link_flow)
+                        write_records(TASKS_FILE, [(task["id"], {
+                            "id": task["id"],
+                            "業務名": edit_name,
+                            "部門": edit_dept,
+                            "説明": edit_desc,
+                            "工数": edit_time,
+                            "頻度": edit_freq,
+                            "重要度": edit_importance,
+                            "担当者": edit_person
+                        })])
+                        st.success("業務が更新されました！")
+                        st.rerun()
+            
+            with col2:
+                if st.button("🗑️ 削除", key=f"delete_task_{task['id']}"):
+                    write_records(TASKS_FILE, [(task["id"], None)])
+                    st.success("業務が削除されました！")
+                    st.rerun()
+    
+    with tab3:
+        st.markdown("<div class=\"section-header\">業務辞書・組織データの重複候補</div>", unsafe_allow_html=True)
+        st.caption("業務名・説明の文字 n-gram が似ているレコードをまとめて表示します（1グループ最大{}件）。統合すると重複は削除され、リンクは残すレコードに付け替えられます（業務辞書と組織データの組はリンクします）。".format(DEDUP_MAX_CLUSTER_SIZE))
+        threshold = round(st.slider("類似度のしきい値", min_value=0.3, max_value=1.0, value=0.6, step=0.05, key="dedup_threshold"), 2)
+        duplicate_index = get_duplicate_index()
+        clusters = duplicate_index.clusters(threshold)
+        if st.session_state.get("dedup_result"):
+            st.success(st.session_state.pop("dedup_result"))
+        if not clusters:
+            st.info("重複候補はありません")
+        records_by_file = {filename: record_map(filename) for filename in DEDUP_FILES}
+        dataset_labels = {TASKS_FILE: "業務辞書", ORG_FILE: "組織"}
+        for cluster in paginate(clusters, "dedup_page"):
+            members = [duplicate_index.records[row][:2] for row in cluster]
+            labels = {
+                member: f"{dataset_labels[member[0]]}: {duplicate_index.records[row][2]}（{member[1]}）"
+                for member, row in zip(members, cluster)
+            }
+            with st.expander(f"🧬 {duplicate_index.records[cluster[0]][2]} ほか{len(cluster) - 1}件", expanded=False):
+                st.dataframe(pd.DataFrame([
+                    {
+                        "データ": dataset_labels[filename],
+                        "ID": record_id,
+                        "名前": record.get("業務名") or record.get("業務", ""),
+                        "部門": record.get("部門", ""),
+                        "担当者": record.get("担当者", ""),
+                    }
+                    for filename, record_id in members
+                    if (record := records_by_file[filename].get(record_id)) is not None
+                ]), use_container_width=True, hide_index=True)
+                form_key = f"dedup_{members[0][0]}_{members[0][1]}"
+                canonical = st.selectbox("残すレコード", members, format_func=labels.get, key=f"{form_key}_canonical")
+                # 残すレコードとの類似度がしきい値以上のものだけを統合の対象にする
+                candidates = duplicate_index.similar_members(canonical, members, threshold)
+                duplicates = st.multiselect(
+                    "統合するレコード", candidates, format_func=labels.get, key=f"{form_key}_{canonical[1]}_members"
+                )
+                if len(candidates) < len(members) - 1:
+                    st.caption(f"残すレコードとの類似度がしきい値未満の {len(members) - 1 - len(candidates)} 件は統合の対象外です")
+                if st.button("統合", key=f"{form_key}_merge", disabled=not duplicates):
+                    applied = merge_duplicates(canonical, [member for member in duplicates if member in candidates])
+                    st.session_state.dedup_result = f"{labels[canonical]} に統合しました（{len(applied)}件のデータを変更）"
+                    st.rerun()
 
 elif page == "スキルマップ":
     st.markdown("<h1 class=\"main-header\">🎯 スキルマップ</h1>", unsafe_allow_html=True)
@@ -904,14 +4431,14 @@ elif page == "スキルマップ":
     tab1, tab2 = st.tabs(["📊 スキル表示", "✏️ スキル編集"])
     
     with tab1:
-        skills_data = load_data(SKILLS_FILE)
+        skills_snapshot = get_snapshot(SKILLS_FILE)
         
-        if skills_data:
-            df_skills = pd.DataFrame(skills_data)
+        if len(skills_snapshot):
+            df_skills = pd.DataFrame({column: skills_snapshot.column(column) for column in skills_snapshot.column_names})
             
             # スキルチャート
             st.subheader("📊 スキルレベル")
-            chart_data = df_skills.set_index("スキル分野")[["現在レベル", "目標レベル"]]
+            chart_data = df_skills.set_index("スキル分野")[["現在レベル", "目標レベル"]].apply(pd.to_numeric, errors="coerce")
             st.bar_chart(chart_data) # ここで全スキルが表示されるはず
             
             # 詳細テーブル
@@ -921,8 +4448,8 @@ elif page == "スキルマップ":
             # 成長提案
             st.subheader("💡 成長提案")
             suggestions = []
-            for skill in skills_data:
-                if skill["現在レベル"] < skill["目標レベル"]:
+            for skill in df_skills.to_dict("records"):
+                if HomeStats.skill_gap(skill) > 0:
                     suggestions.append(f"• {skill['スキル分野']}のスキルアップが必要です（現在: {skill['現在レベル']}, 目標: {skill['目標レベル']}）")
             
             if suggestions:
@@ -944,7 +4471,7 @@ elif page == "スキルマップ":
                 if st.form_submit_button("追加"):
                     if new_skill_name:
                         skills_data = load_data(SKILLS_FILE)
-                        new_id = f"skill_{len(skills_data) + 1:03d}"
+                        new_id = next_record_id(skills_data, "skill")
                         new_skill = {
                             "id": new_id,
                             "スキル分野": new_skill_name,
@@ -952,44 +4479,207 @@ elif page == "スキルマップ":
                             "目標レベル": new_target_level,
                             "経験業務数": new_experience
                         }
-                        skills_data.append(new_skill)
-                        save_data(SKILLS_FILE, skills_data)
+                        write_records(SKILLS_FILE, [(new_id, new_skill)])
                         st.success("スキルが追加されました！")
                         st.rerun()
         
-        # 既存スキルの編集
-        skills_data = load_data(SKILLS_FILE)
-        if skills_data:
-            st.subheader("既存スキルの編集・削除")
-            for i, skill in enumerate(skills_data):
-                with st.expander(f"📝 {skill['スキル分野']}", expanded=False):
-                    col1, col2 = st.columns([3, 1])
-                    
-                    with col1:
-                        with st.form(f"edit_skill_form_{i}"):
-                            edit_name = st.text_input("スキル分野", value=skill["スキル分野"], key=f"skill_name_{i}")
-                            edit_current = st.slider("現在レベル", 1, 5, skill["現在レベル"], key=f"current_{i}")
-                            edit_target = st.slider("目標レベル", 1, 5, skill["目標レベル"], key=f"target_{i}")
-                            edit_exp = st.number_input("経験業務数", min_value=0, value=skill["経験業務数"], key=f"exp_{i}")
-                            
-                            if st.form_submit_button("更新"):
-                                skills_data[i] = {
-                                    "id": skill["id"],
-                                    "スキル分野": edit_name,
-                                    "現在レベル": edit_current,
-                                    "目標レベル": edit_target,
-                                    "経験業務数": edit_exp
-                                }
-                                save_data(SKILLS_FILE, skills_data)
-                                st.success("スキルが更新されました！")
-                                st.rerun()
+        # 既存スキルの編集（絞り込んだ中から選んだ1件だけを読み込んで編集する）
+        st.subheader("既存スキルの編集・削除")
+        skill = render_record_picker(SKILLS_FILE, "edit_skill", "スキル分野", "スキル")
+        if skill:
+            st.markdown(f"**📝 {skill.get('スキル分野', '')}**")
+            col1, col2 = st.columns([3, 1])
+            
+            with col1:
+                with st.form(f"edit_skill_form_{skill['id']}"):
+                    edit_name = st.text_input("スキル分野", value=skill.get("スキル分野", ""), key=f"skill_name_{skill['id']}")
+                    edit_current = st.slider("現在レベル", 1, 5, clamp_integer(skill.get("現在レベル"), *SKILL_LEVEL_RANGE), key=f"current_{skill['id']}")
+                    edit_target = st.slider("目標レベル", 1, 5, clamp_integer(skill.get("目標レベル"), *SKILL_LEVEL_RANGE), key=f"target_{skill['id']}")
+                    edit_exp = st.number_input("経験業務数", min_value=0, value=clamp_integer(skill.get("経験業務数"), 0), key=f"exp_{skill['id']}")
                     
-                    with col2:
-                        if st.button("🗑️ 削除", key=f"delete_skill_{i}"):
-                            skills_data.pop(i)
-                            save_data(SKILLS_FILE, skills_data)
-                            st.success("スキルが削除されました！")
-                            st.rerun()
+                    if st.form_submit_button("更新"):
+                        write_records(SKILLS_FILE, [(skill["id"], {
+                            "id": skill["id"],
+                            "スキル分野": edit_name,
+                            "現在レベル": edit_current,
+                            "目標レベル": edit_target,
+                            "経験業務数": edit_exp
+                        })])
+                        st.success("スキルが更新されました！")
+                        st.rerun()
+            
+            with col2:
+                if st.button("🗑️ 削除", key=f"delete_skill_{skill['id']}"):
+                    write_records(SKILLS_FILE, [(skill["id"], None)])
+                    st.success("スキルが削除されました！")
+                    st.rerun()
+
+elif page == "影響分析":
+    st.markdown("<h1 class=\"main-header\">🧭 影響分析</h1>", unsafe_allow_html=True)
+    
+    impact_index = get_impact_index()
+    query_type = st.radio(
+        "分析の種類",
+        ["👤 担当者が不在の場合", "⬇️ ステップの下流", "🔎 ステップを通るフロー"],
+        horizontal=True
+    )
+    started = time.perf_counter()
+    
+    if query_type == "👤 担当者が不在の場合":
+        person = st.selectbox("担当者", impact_index.assignees(), index=None, placeholder="例: 田中")
+        if person:
+            impact = impact_index.person_impact(person)
+            tasks_by_id = record_map(TASKS_FILE)
+            org_by_id = record_map(ORG_FILE)
+            elapsed = (time.perf_counter() - started) * 1000
+            
+            col1, col2, col3 = st.columns(3)
+            col1.metric("止まるフローステップ", sum(len(s["node_ids"]) + len(s["downstream"]) for s in impact["flow_steps"]))
+            col2.metric("担当業務（業務辞書）", len(impact["tasks"]))
+            col3.metric("担当業務（OpsMap）", len(impact["org"]))
+            
+            st.subheader("🔄 フロー")
+            for step in impact["flow_steps"]:
+                with st.expander(f"{step['flow_name']}（直接 {len(step['node_ids'])} / 下流 {len(step['downstream'])}）", expanded=False):
+                    st.write("**担当ステップ**: " + "、".join(impact_index.node_label(step["flow_id"], n) for n in step["node_ids"]))
+                    if step["downstream"]:
+                        st.write("**止まる下流ステップ**: " + "、".join(impact_index.node_label(step["flow_id"], n) for n in step["downstream"]))
+                    st.button("FlowBuilderで開く", key=f"impact_flow_{step['flow_id']}", on_click=open_flow_in_builder, args=(step["flow_id"],))
+            if not impact["flow_steps"]:
+                st.caption("担当しているフローステップはありません")
+            
+            st.subheader("📚 業務辞書")
+            for item in impact["tasks"]:
+                task = tasks_by_id.get(item["id"])
+                if task:
+                    mark = "🔴 単独担当" if item["single_owner"] else "🟡 複数担当"
+                    st.write(f"{mark}　{task['業務名']}（{task['部門']}・{task['重要度']}）")
+            
+            st.subheader("🗺️ OpsMap")
+            for item in impact["org"]:
+                org = org_by_id.get(item["id"])
+                if org:
+                    mark = "🔴 単独担当" if item["single_owner"] else "🟡 複数担当"
+                    st.write(f"{mark}　{org['グループ']} > {org['部門']} > {org['業務']}（{org['重要度']}）")
+            st.caption(f"⏱️ {elapsed:.1f} ms")
+    
+    elif query_type == "⬇️ ステップの下流":
+        flow_headers = flow_header_map()
+        if flow_headers:
+            flow_id = st.selectbox("フロー", list(flow_headers), format_func=lambda f: flow_headers[f]["flow_name"])
+            entry = impact_index.flows.get(flow_id)
+            if entry:
+                node_id = st.selectbox("ステップ", list(entry["nodes"]), format_func=lambda n: f"{n}（{entry['nodes'][n].get('label', '')}）")
+                downstream = impact_index.downstream(flow_id, node_id)
+                elapsed = (time.perf_counter() - started) * 1000
+                st.metric("下流ステップ数", len(downstream))
+                if node_id in downstream:
+                    st.warning("このステップは差し戻しループの中にあります")
+                st.write("、".join(f"{impact_index.node_label(flow_id, n)}（{n}）" for n in downstream if n != node_id) or "下流のステップはありません")
+                st.caption(f"⏱️ {elapsed:.1f} ms")
+    
+    else:
+        label = st.text_input("ステップ名", placeholder="例: 承認判定")
+        if label:
+            matches = impact_index.flows_through(label)
+            elapsed = (time.perf_counter() - started) * 1000
+            st.metric("該当フロー数", len(matches))
+            for match in matches:
+                labels = "、".join(impact_index.node_label(match["flow_id"], n) for n in match["node_ids"])
+                col1, col2 = st.columns([3, 1])
+                col1.write(f"**{match['flow_name']}**: {labels}")
+                col2.button("開く", key=f"through_{match['flow_id']}", on_click=open_flow_in_builder, args=(match["flow_id"],))
+            st.caption(f"⏱️ {elapsed:.1f} ms")
+
+elif page == "業務カレンダー":
+    st.markdown("<h1 class=\"main-header\">📆 業務カレンダー</h1>", unsafe_allow_html=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        calendar_start = st.date_input("開始日", value=datetime.now().date())
+    with col2:
+        calendar_weeks = st.number_input("期間（週）", min_value=1, max_value=104, value=13)
+    
+    started = time.perf_counter()
+    schedule = get_workload_schedule()
+    calendar = schedule.calendar(calendar_start, int(calendar_weeks))
+    overloads = calendar.overloads()
+    elapsed = (time.perf_counter() - started) * 1000
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("担当者", len(calendar.people))
+    col2.metric("過負荷（人・週）", len(overloads))
+    col3.metric("週あたりの容量", f"{calendar.capacity / 60:g}時間")
+    
+    st.subheader("⚠️ 過負荷の週")
+    if overloads:
+        st.dataframe(pd.DataFrame(
+            [{"担当者": person, "週": str(week), "負荷（時間）": round(minutes / 60, 1)} for person, week, minutes in overloads[:LIST_PAGE_SIZE]]
+        ), hide_index=True)
+        if len(overloads) > LIST_PAGE_SIZE:
+            st.caption(f"ほか {len(overloads) - LIST_PAGE_SIZE} 件")
+    else:
+        st.success("期間内に容量を超える週はありません")
+    
+    st.subheader("👤 担当者別の負荷")
+    if calendar.people:
+        person = st.selectbox("担当者", sorted(calendar.people), key="calendar_person")
+        st.bar_chart(pd.Series(calendar.person_load(person) / 60, index=[str(day) for day in calendar.week_starts], name="負荷（時間）"))
+        horizon_end = calendar.start + np.timedelta64(7 * int(calendar_weeks), "D")
+        rows = []
+        for task_id, entry in schedule.entries.items():
+            if person in entry["load"] and entry["frequency"]:
+                dates = schedule.occurrences(task_id, calendar.start, horizon_end)
+                if len(dates):
+                    rows.append({
+                        "業務": entry["name"], "頻度": FREQUENCY_LABELS[entry["frequency"][0]],
+                        "1回の工数（分）": round(entry["load"][person]), "回数": len(dates), "次回": str(dates[0])
+                    })
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+    else:
+        st.info("頻度が読み取れる定期業務がありません")
+    st.caption(f"⏱️ {elapsed:.1f} ms")
+
+elif page == "変更履歴":
+    st.markdown("<h1 class=\"main-header\">🕒 変更履歴</h1>", unsafe_allow_html=True)
+    
+    audit_log = get_audit_log()
+    tab1, tab2 = st.tabs(["🕒 最近の変更", "🔎 レコードの履歴"])
+    
+    with tab1:
+        since_date = st.date_input("この日以降の変更", value=datetime.now().date() - timedelta(days=7))
+        positions = audit_log.since(since_date.isoformat())
+        for entry in audit_log.read(paginate(positions[::-1], "audit_page")):
+            st.write(f"`{entry['at'][:19].replace('T', ' ')}` **{entry['user']}**　{describe_audit_entry(entry)}")
+        if not positions:
+            st.info("この期間の変更はありません")
+    
+    with tab2:
+        audit_file = st.selectbox("データセット", list(AUDIT_FILES), format_func=DATASET_LABELS.get, key="audit_file")
+        current_records = flow_header_map() if audit_file == FLOWS_FILE else record_map(audit_file)
+        record_ids = sorted(audit_log.record_ids(audit_file))
+        if record_ids:
+            audit_record_id = st.selectbox(
+                "レコード", record_ids, key=f"audit_record_{audit_file}",
+                format_func=lambda record_id: record_id if record_id in current_records else f"🗑️ {record_id}（削除済み）"
+            )
+            history = audit_log.history(audit_file, audit_record_id)
+            for entry in reversed(history):
+                col1, col2 = st.columns([4, 1])
+                col1.write(f"`{entry['at'][:19].replace('T', ' ')}` **{entry['user']}**　{describe_audit_entry(entry)}")
+                if entry is history[-1] and entry["op"] == "delete":
+                    col2.button(
+                        "削除を取り消す", key=f"audit_restore_{entry['position']}",
+                        on_click=restore_record, args=(audit_file, audit_record_id, entry["position"], True)
+                    )
+                elif entry is not history[-1]:
+                    col2.button(
+                        "この時点に戻す", key=f"audit_restore_{entry['position']}",
+                        on_click=restore_record, args=(audit_file, audit_record_id, entry["position"])
+                    )
+        else:
+            st.info("このデータセットにはまだ変更履歴がありません")
 
 elif page == "設定":
     st.markdown("<h1 class=\"main-header\">⚙️ 設定</h1>", unsafe_allow_html=True)
@@ -998,6 +4688,18 @@ elif page == "設定":
     theme = st.selectbox("テーマ", ["ライト", "ダーク"])
     language = st.selectbox("言語", ["日本語", "English"])
     
+    st.subheader("🔌 読み取り専用API")
+    if not API_PORT:
+        st.caption("環境変数 OPSMAP_API_PORT を指定すると、データを JSON で取得できる API が起動します")
+    elif start_api_server(API_HOST, API_PORT) is None:
+        st.warning(f"API を {API_HOST}:{API_PORT} で起動できませんでした")
+    else:
+        st.code(
+            f"http://{API_HOST}:{API_PORT}/api/{current_tenant()}/tasks?page=1&per_page={LIST_PAGE_SIZE}\n"
+            f"http://{API_HOST}:{API_PORT}/api/{current_tenant()}/impact/person?name=<担当者>",
+            language=None
+        )
+    
     st.subheader("💾 データ設定")
     auto_save = st.checkbox("自動保存を有効にする", value=True)
     backup_frequency = st.selectbox("バックアップ頻度", ["毎日", "毎週", "毎月"])
@@ -1005,6 +4707,25 @@ elif page == "設定":
     if st.button("設定を保存"):
         st.success("設定が保存されました！")
     
+    # データの整合性
+    st.subheader("🩺 データの整合性")
+    integrity_issues = get_integrity_report().all_issues()
+    if st.session_state.get("integrity_result"):
+        st.success(st.session_state.pop("integrity_result"))
+    if not integrity_issues:
+        st.success("問題は見つかりませんでした")
+    else:
+        levels = [issue["level"] for issue in integrity_issues]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("エラー", levels.count("error"))
+        col2.metric("警告", levels.count("warning"))
+        col3.metric("自動修復できる問題", sum(issue["repairable"] for issue in integrity_issues))
+        st.dataframe(integrity_frame(integrity_issues), use_container_width=True, hide_index=True)
+        if st.button("🛠️ 安全な問題を自動修復", disabled=not any(issue["repairable"] for issue in integrity_issues)):
+            repaired_issues = repair_workspace()
+            st.session_state.integrity_result = f"{len(repaired_issues)}件の問題を修復しました"
+            st.rerun()
+    
     # データ管理
     st.subheader("📊 データ管理")
     col1, col2, col3 = st.columns(3)
@@ -1014,9 +4735,10 @@ elif page == "設定":
             # 全データをJSONで出力
             all_data = {
                 "tasks": load_data(TASKS_FILE),
-                "flows": load_data(FLOWS_FILE),
+                "flows": load_all_flows(),
                 "skills": load_data(SKILLS_FILE),
-                "organization": load_data(ORG_FILE)
+                "organization": load_data(ORG_FILE),
+                "links": load_data(LINKS_FILE)
             }
             st.download_button(
                 label="📥 全データをダウンロード",
@@ -1030,15 +4752,28 @@ elif page == "設定":
         if uploaded_file is not None:
             try:
                 import_data = json.load(uploaded_file)
+                repaired_data, import_issues = inspect_dataset_bundle(import_data)
+                if import_issues:
+                    repairable_count = sum(issue["repairable"] for issue in import_issues)
+                    st.warning(f"インポートデータに{len(import_issues)}件の問題があります（うち自動修復できるもの{repairable_count}件）")
+                    st.dataframe(integrity_frame(import_issues), use_container_width=True, hide_index=True)
+                    if st.checkbox("自動修復してから取り込む", value=True, key="import_repair"):
+                        import_data = repaired_data
                 if st.button("インポート実行"):
                     if "tasks" in import_data:
-                        save_data(TASKS_FILE, import_data["tasks"])
+                        replace_records(TASKS_FILE, import_data["tasks"])
                     if "flows" in import_data:
-                        save_data(FLOWS_FILE, import_data["flows"])
+                        imported_ids = {flow["flow_id"] for flow in import_data["flows"]}
+                        write_flows(
+                            [(flow["flow_id"], flow) for flow in import_data["flows"]]
+                            + [(header["flow_id"], None) for header in load_flow_headers() if header["flow_id"] not in imported_ids]
+                        )
                     if "skills" in import_data:
-                        save_data(SKILLS_FILE, import_data["skills"])
+                        replace_records(SKILLS_FILE, import_data["skills"])
                     if "organization" in import_data:
-                        save_data(ORG_FILE, import_data["organization"])
+                        replace_records(ORG_FILE, import_data["organization"])
+                    if "links" in import_data:
+                        save_data(LINKS_FILE, import_data["links"])
                     st.success("データがインポートされました！")
                     st.rerun()
             except Exception as e:
@@ -1047,10 +4782,18 @@ elif page == "設定":
     with col3:
         if st.button("🗑️ 全データをリセット"):
             if st.checkbox("本当にリセットしますか？"):
-                # データファイルを削除して初期化
-                for file in [TASKS_FILE, FLOWS_FILE, SKILLS_FILE, ORG_FILE]:
-                    if os.path.exists(file):
-                        os.remove(file)
+                # 削除を変更履歴に残してから、現在のワークスペースのデータファイルを削除して初期化
+                for file in (TASKS_FILE, SKILLS_FILE, ORG_FILE):
+                    replace_records(file, [])
+                write_flows([(header["flow_id"], None) for header in load_flow_headers()])
+                for file in DATA_FILES:
+                    path = data_path(file)
+                    if os.path.exists(path):
+                        os.remove(path)
+                shutil.rmtree(os.path.join(tenant_dir(), FLOWS_DIR), ignore_errors=True)
+                get_tenant_registry().drop(current_tenant())
+                for file in DATA_FILES:
+                    get_dataset_bus().publish(current_tenant(), file, origin=current_session_id())
                 init_data_once.clear()  # キャッシュをクリア
                 st.success("データがリセットされました！")
                 st.rerun()